@@ -1,12 +1,18 @@
 import numpy as np
 import pandas as pd
 import statistics as st
+import matplotlib as mpl
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 import seaborn as sns
-import random
+import colorsys
 
 from io import BytesIO
-import base64
+
+from plot_data import stratified_sample, line_data, density_2d, max_points # reduce big data before plotting
+from figure_pool import acquire_grid, release_grid, acquire_panel, release_panel, cell_origin, new_figure # reused Agg figures (no pyplot state)
+from shared_artifacts import category_order, value_counts as class_counts, group_stats, box_stats, column_stats # dataset level results
+from density import hist_kde, group_kde # binned KDE of the histograms / violins
 
 # Set the Seaborn style to darkid
 sns.set_theme(style='darkgrid')
@@ -17,7 +23,7 @@ sns.set_theme(style='darkgrid')
 # ***********************************************************************************
 
 # Boxen Plot  *********************************************************
-def boxen_plot(df, col, axs=None):
+def boxen_plot(df, col, axs=None, art=None):
   # Plot the boxenplot
   ax = sns.boxenplot(data=df[col], color='steelblue', saturation=0.8, linewidth=1.5, ax=axs)
 
@@ -32,15 +38,14 @@ def boxen_plot(df, col, axs=None):
   # display grid
   ax.yaxis.grid(True)
 
-  # Calculate Q1 and Q3 using numpy
-  q1 = np.percentile(df[col], 25)
-  q3 = np.percentile(df[col], 75)
+  # Q1, median, mean and Q3 of the column (computed once for the dataset)
+  stats = column_stats(df, col, art)
 
   # Add a horizontal line at the median
-  ax.axhline(y=q1, color='b', linestyle='-', linewidth=2)
-  ax.axhline(y=df[col].median(), color='green', linestyle='-', linewidth=3)
-  ax.axhline(y=df[col].mean(), color='r', linestyle='--', linewidth=1.2)
-  ax.axhline(y=q3, color='orange', linestyle='-', linewidth=2)
+  ax.axhline(y=stats['25%'], color='b', linestyle='-', linewidth=2)
+  ax.axhline(y=stats['50%'], color='green', linestyle='-', linewidth=3)
+  ax.axhline(y=stats['mean'], color='r', linestyle='--', linewidth=1.2)
+  ax.axhline(y=stats['75%'], color='orange', linestyle='-', linewidth=2)
 
   # Add a legend
   q1_legend = plt.Line2D([], [], color='b', linestyle='-', linewidth=1.2, label='Q1')
@@ -57,13 +62,28 @@ def boxen_plot(df, col, axs=None):
 
 
 # Strip Plot    ***************************************************************
-def strip_plot(df, colx,coly,hue=None, axs=None):
+def _jitter_strips(ax, first, width, rng):
+  # move the points of the strips drawn from the collection `first` along the categories, as seaborn's jitter
+  # but with the generator of the subplot (seaborn takes the global numpy one)
+  for points in ax.collections[first:]:
+    offsets = np.array(points.get_offsets())
+    if len(offsets) > 1:
+      offsets[:, 0] += rng.uniform(-width, width, len(offsets))
+      points.set_offsets(offsets)
+
+
+def strip_plot(df, colx,coly,hue=None, axs=None, rng=None):
+
+  df = stratified_sample(df, [colx, hue]) # same ratio of points from each group
+  rng = rng if rng is not None else np.random.default_rng(0)
+  first = len(axs.collections)
 
   palette=None
   if hue:
     palette='tab10'
     # Create a strip plot with custom point appearance
-    ax = sns.stripplot(data=df, x=colx, y=coly, hue=hue, dodge=True , palette=palette, linewidth=0.5, edgecolor='black', ax=axs)
+    ax = sns.stripplot(data=df, x=colx, y=coly, hue=hue, dodge=True , jitter=False, palette=palette, linewidth=0.5, edgecolor='black', ax=axs)
+    _jitter_strips(ax, first, 0.1 / max(1, len(category_order(df[hue]))), rng) # the strips of the hue share the width
 
     # Add a legend with custom labels and customize font size and legend size
     ax.set_title(f'{colx} vs {coly} group by  {hue}'.title())
@@ -73,16 +93,17 @@ def strip_plot(df, colx,coly,hue=None, axs=None):
 
   else:
     # Create a strip plot with custom point appearance
-    ax = sns.stripplot(data=df, x=colx, y=coly, linewidth=0.5, edgecolor='black', ax=axs)
+    ax = sns.stripplot(data=df, x=colx, y=coly, jitter=False, linewidth=0.5, edgecolor='black', ax=axs)
+    _jitter_strips(ax, first, 0.1, rng)
 
     ax.set_title(f'{colx} vs {coly}'.title())
 
 
 # Pie Plot      **************************************************************
-def pie_plot(df, col, ax=None):
+def pie_plot(df, col, ax=None, art=None):
 
-    # Calculate value counts
-    value_counts = df[col].value_counts().sort_values(ascending=False)
+    # Calculate value counts (shared by the figures of the dataset)
+    value_counts = class_counts(df, col, art).sort_values(ascending=False)
 
     # Set the explode of the first and biggest sector
     explode = [0] * len(value_counts)
@@ -113,9 +134,11 @@ def pie_plot(df, col, ax=None):
 
 
 # Count Plot           ****************************************************
-def count_plot(df, col, axs=None):
-    # Create countplot
-    ax = sns.countplot(y=df[col], data=df, palette='hot', ax=axs)
+def count_plot(df, col, axs=None, art=None):
+    # Create countplot from the value counts (classes in the order of seaborn countplot)
+    order = category_order(df[col])
+    counts = class_counts(df, col, art).reindex(order, fill_value=0)
+    ax = sns.barplot(x=counts.to_numpy(), y=[str(c) for c in order], palette='hot', orient='h', ax=axs)
     for p in ax.patches:
         ax.annotate(f'{int(p.get_width())}\n', (p.get_width(), p.get_y()+0.5), ha='left', va='center', color='black', size=9)
 
@@ -125,12 +148,46 @@ def count_plot(df, col, axs=None):
     ax.set_ylabel(f'{col}')
 
 # Bar Plot   ***************************************************************
-def bar_plot(df, colx,coly,colh=None, axs=None):
+def _dodge(n_x, n_hue, width=0.8):
+  # positions of the bars / boxes of each hue level around each class (as seaborn dodge)
+  each = width / n_hue
+  offsets = np.arange(n_hue) * each - width / 2 + each / 2
+  return [np.arange(n_x) + offset for offset in offsets], each
+
+
+def _colors(palette, n):
+  # seaborn categorical plots draw the palette colors desaturated
+  return [sns.desaturate(color, 0.75) for color in sns.color_palette(palette, n)]
+
+
+def _gray(colors):
+  # gray of the lines of seaborn categorical plots (darker than the lightest color)
+  return mpl.colors.rgb2hex([min(colorsys.rgb_to_hls(*c)[1] for c in colors) * 0.6] * 3)
 
-  palette='hot' if colh else None
 
-  # Create barplot with hue and dodge
-  ax = sns.barplot(x=colx, y=coly, hue=colh,palette=palette, dodge=True, data=df, ax=axs)
+def bar_plot(df, colx,coly,colh=None, axs=None, art=None):
+
+  # mean / confidence interval of each group (shared by the subplots of the same groups, see group_summary)
+  stats = group_stats(df, [colx, colh], coly, art)
+
+  x_order = category_order(df[colx])
+  hue_order = category_order(df[colh]) if colh else [None]
+  positions, width = _dodge(len(x_order), len(hue_order)) if colh else ([np.arange(len(x_order))], 0.8)
+  colors = _colors('hot', len(hue_order)) if colh else _colors(None, len(x_order))
+
+  # bars of the means with their confidence interval (AUTO_ANALYSIS_CI: normal approximation or bootstrap)
+  for j, hue in enumerate(hue_order):
+    keys = [(x, hue) if colh else x for x in x_order]
+    group = stats.reindex(keys)
+    mean = group['mean'].to_numpy()
+    ci = np.vstack([mean - group['ci_low'].to_numpy(), group['ci_high'].to_numpy() - mean])
+    axs.bar(positions[j], mean, width=width, color=colors[j] if colh else colors, label=hue if colh else None)
+    axs.errorbar(positions[j], mean, yerr=ci, fmt='none', ecolor='.26', elinewidth=mpl.rcParams['lines.linewidth'] * 1.8)
+
+  axs.set_xticks(np.arange(len(x_order)), [str(x) for x in x_order])
+  axs.set_xlim(-0.5, len(x_order) - 0.5)
+  axs.xaxis.grid(False)
+  ax = axs
 
   # Set plot title and labels
   ax.set_xlabel(f'{colx}')
@@ -147,10 +204,72 @@ def bar_plot(df, colx,coly,colh=None, axs=None):
 
 
 # Violin Plot   ****************************************************
-def violin_plot(df, colx,coly,colh=None,axs=None):
+def _inner_boxes(ax, boxes, positions, gray):
+  # whiskers, quartiles and median of each violin (as seaborn `inner='box'`), from the group summary
+  lw = mpl.rcParams['lines.linewidth']
+  for pos, box in zip(positions, boxes):
+    if box is None or box['whislo'] == box['whishi']: # no values, or a single one (drawn as a line by seaborn)
+      continue
+    ax.plot([pos, pos], [box['whislo'], box['whishi']], linewidth=lw, color=gray)
+    ax.plot([pos, pos], [box['q1'], box['q3']], linewidth=lw * 3, color=gray)
+    ax.scatter(pos, box['med'], zorder=3, color='white', edgecolor=gray, s=np.square(lw * 2))
+
+
+def _violins(ax, curves, positions, widths, colors, gray):
+  # violins of the densities of each group (as seaborn `scale='area'`: the densities over the same max),
+  # a single value is drawn as a line
+  lw = mpl.rcParams['lines.linewidth']
+  peak = max([curve[1].max() for curve in curves if curve is not None and curve[0].size > 1], default=1)
+  drawn = []
+  for curve, pos, width, color in zip(curves, positions, widths, colors):
+    if curve is None:
+      continue
+    support, density = curve
+    if support.size == 1:
+      ax.plot([pos - width / 2, pos + width / 2], [support[0]] * 2, color=gray, linewidth=lw)
+      continue
+    drawn.append(({'coords': support, 'vals': density, 'mean': np.nan, 'median': np.nan, 'min': support[0], 'max': support[-1]},
+                  pos, width * density.max() / peak, color))
+  if not drawn:
+    return
+
+  bodies = ax.violin([stats for stats, _, _, _ in drawn], positions=[pos for _, pos, _, _ in drawn],
+                     widths=[width for _, _, width, _ in drawn], showextrema=False)['bodies']
+  for body, (_, _, _, color) in zip(bodies, drawn):
+    body.update({'facecolor': color, 'edgecolor': gray, 'linewidth': lw, 'alpha': 1})
+
+
+def violin_plot(df, colx,coly,colh=None,axs=None, art=None):
+    # quartiles / whiskers of each group on all rows (shared with the box plots of the same groups)
+    stats = box_stats(df, [colx, colh], coly, art)
+    # density of each group on all rows (binned KDE, see density)
+    curves = group_kde(df, [colx, colh], coly)
+
     palette='hot' if colh else None
 
-    ax=sns.violinplot(x=colx, y=coly, hue=colh,data=df, palette=palette, ax=axs)
+    x_order = category_order(df[colx])
+    hue_order = category_order(df[colh]) if colh else [None]
+    positions, width = _dodge(len(x_order), len(hue_order)) if colh else ([np.arange(len(x_order))], 0.8)
+    colors = _colors(palette, len(hue_order) if colh else len(x_order))
+    gray = _gray(colors)
+    lw = mpl.rcParams['lines.linewidth']
+
+    if colh: # the violins of each class over their own max (as seaborn `scale_hue`)
+      for i, x in enumerate(x_order):
+        _violins(axs, [curves.get((x, hue)) for hue in hue_order], [positions[j][i] for j in range(len(hue_order))],
+                 [width] * len(hue_order), colors, gray)
+      for j, hue in enumerate(hue_order): # legend of each hue level
+        axs.add_patch(plt.Rectangle([0, 0], 0, 0, linewidth=lw / 2, edgecolor=gray, facecolor=colors[j], label=hue))
+    else:
+      _violins(axs, [curves.get(x) for x in x_order], positions[0], [width] * len(x_order), colors, gray)
+
+    for j, hue in enumerate(hue_order):
+      _inner_boxes(axs, [stats.get((x, hue) if colh else x) for x in x_order], positions[j], gray)
+
+    axs.set_xticks(np.arange(len(x_order)), [str(x) for x in x_order])
+    axs.set_xlim(-0.5, len(x_order) - 0.5)
+    axs.xaxis.grid(False)
+    ax = axs
 
     # Set plot title and labels
     ax.set_xlabel(f'{colx}')
@@ -166,11 +285,42 @@ def violin_plot(df, colx,coly,colh=None,axs=None):
       ax.set_title(f'{colx} vs {coly}')
 
 # Box Plot    *********************************************************
-def box_plot(df, colx, coly, colh=None, axs=None):
+def box_plot(df, colx, coly, colh=None, axs=None, art=None):
 
     palette= 'tab10' if colh else None
 
-    ax= sns.boxplot(x=colx, y=coly, hue=colh, palette=palette, data=df, ax=axs)
+    if colx:
+      # boxes from the quartiles / whiskers / fliers of each group (shared by the box plots of the same groups)
+      stats = box_stats(df, [colx, colh], coly, art)
+
+      x_order = category_order(df[colx])
+      hue_order = category_order(df[colh]) if colh else [None]
+      positions, width = _dodge(len(x_order), len(hue_order)) if colh else ([np.arange(len(x_order))], 0.8)
+      colors = _colors(palette, len(hue_order) if colh else len(x_order))
+      gray = _gray(colors)
+      lw = mpl.rcParams['lines.linewidth']
+
+      for j, hue in enumerate(hue_order):
+        keys = [(x, hue) if colh else x for x in x_order]
+        drawn = [(pos, stats[key], colors[j] if colh else colors[i]) for i, (pos, key) in enumerate(zip(positions[j], keys)) if key in stats]
+        if colh: # legend of this hue level
+          axs.add_patch(plt.Rectangle([0, 0], 0, 0, linewidth=lw / 2, edgecolor=gray, facecolor=colors[j], label=hue))
+        if not drawn:
+          continue
+        artists = axs.bxp([box for _, box, _ in drawn], positions=[pos for pos, _, _ in drawn],
+                          widths=width * 0.98 if colh else width, patch_artist=True, manage_ticks=False,
+                          whiskerprops={'color': gray, 'linewidth': lw}, capprops={'color': gray, 'linewidth': lw},
+                          medianprops={'color': gray, 'linewidth': lw},
+                          flierprops={'marker': 'd', 'markersize': 5, 'markerfacecolor': gray, 'markeredgecolor': gray, 'linewidth': 0})
+        for box, (_, _, color) in zip(artists['boxes'], drawn):
+          box.update({'facecolor': color, 'edgecolor': gray, 'linewidth': lw, 'zorder': 0.9})
+
+      axs.set_xticks(np.arange(len(x_order)), [str(x) for x in x_order])
+      axs.set_xlim(-0.5, len(x_order) - 0.5)
+      axs.xaxis.grid(False)
+      ax = axs
+    else:
+      ax= sns.boxplot(x=colx, y=coly, hue=colh, palette=palette, data=df, ax=axs)
 
     # Set plot title and labels
     ax.set_xlabel(f'{colx}')
@@ -208,8 +358,17 @@ def scatter_plot(df, colx, coly, hue=None, style=None, axs=None):
 
   pallet= 'tab10' if hue else None
 
-  # Create scatter plot
-  ax = sns.scatterplot(data=df, x=colx, y=coly, hue=hue, style=style, palette=pallet, ax=axs)
+  if not hue and not style and len(df) > max_points():
+    # too many points: draw the number of points in each cell instead of the points
+    counts, xedges, yedges = density_2d(df, colx, coly)
+    axs.pcolormesh(xedges, yedges, counts, cmap='viridis', norm=LogNorm()) # log scale, so sparse cells stay visible
+    axs.text(0.99, 0.01, f'density of {len(df)} rows', transform=axs.transAxes, ha='right', va='bottom', fontsize=8)
+    ax = axs
+  else:
+    df = stratified_sample(df, [hue, style]) # same ratio of points from each group
+
+    # Create scatter plot
+    ax = sns.scatterplot(data=df, x=colx, y=coly, hue=hue, style=style, palette=pallet, ax=axs)
 
   # Set plot title and labels
   ax.set_xlabel(f"{colx}", fontsize=12)
@@ -232,13 +391,20 @@ def scatter_plot(df, colx, coly, hue=None, style=None, axs=None):
 
 
 # Hisogram   **********************************************************
-def hist_plot(df, col, axs=None):
-
-  # calc number of bins
-  n = int(np.ceil(df.shape[0]**0.5))
+def hist_plot(df, col, axs=None, art=None):
+
+  # the histogram of the whole file of a streamed csv (see streaming), else of the data frame
+  hist = art['histograms'].get(col) if art else None
+  if hist is None:
+    # calc number of bins
+    n = int(np.ceil(df.shape[0]**0.5))
+    # the counts of the bins and the KDE from the same binning (see density)
+    hist = hist_kde(df[col].dropna().to_numpy(dtype='float64'), n)
+  n = len(hist['counts'])
+  centers = (hist['edges'][:-1] + hist['edges'][1:]) / 2
   # Create histogram
-  ax = sns.histplot(df[col], bins=n, kde=True, color='#5614b3', line_kws={'linewidth': 2}, ax=axs)
-  ax.lines[0].set_color('crimson') # Kde color
+  ax = sns.histplot(x=centers, weights=hist['counts'], bins=n, binrange=(hist['edges'][0], hist['edges'][-1]), color='#5614b3', alpha=0.5, ax=axs) # alpha of seaborn with a kde
+  ax.plot(hist['x'], hist['y'], color='crimson', linewidth=2) # Kde
 
   # Add labels and title
   ax.set_xlabel(f'{col}')
@@ -249,6 +415,9 @@ def hist_plot(df, col, axs=None):
 # Line Plot ************************************************************
 def line_plot(df, colx, coly, axs=None):
 
+  # mean of y for each x, at most `max_points` points (LTTB)
+  df = line_data(df, colx, coly)
+
   # Create the line plot
   ax= sns.lineplot(data=df, x=colx, y=coly, color='blue', marker='o', markersize=4, markeredgecolor='red', markerfacecolor='yellow', ax=axs)
 
@@ -258,10 +427,10 @@ def line_plot(df, colx, coly, axs=None):
   ax.legend(['Data'], loc='upper left')
 
 # HeatMap     *******************************************************************
-def heat_map(df, axs=None):
+def heat_map(df, axs=None, corr=None):
   
-  numeric_cols = df.select_dtypes(include='number')
-  corr_matrix = numeric_cols.corr()
+  # correlation matrix (shared by the figures of the dataset, else computed here)
+  corr_matrix = corr if corr is not None else df.select_dtypes(include='number').corr()
   #corr = df.corr()
   ax = sns.heatmap(corr_matrix, annot=True,  annot_kws={'size': 8}, fmt='.2', ax=axs)
 
@@ -272,158 +441,180 @@ def heat_map(df, axs=None):
   ax.tick_params(labelsize=9)
 
 
-
-
-
-
-  
-
-# ***************************************************************************************************
-# ***********************   All Categorical Plots in one Figure    **********************************
-# ***************************************************************************************************
-
-
-def cat_plot(df, colx,coly,colh=None):
-  # Create a figure and subplots
-  fig, axes = plt.subplots(3, 3, figsize=(16, 10))
-
-  # set the background color of the figure to light gray
+# area of a subplot with its labels (half of the space to the next subplots) *******
+def _cell_bounds(ax):
+  spec = ax.get_subplotspec()
+  grid = spec.get_gridspec()
+  bottoms, tops, lefts, rights = grid.get_grid_positions(ax.figure)
+  nrows, ncols = grid.get_geometry()
+  r, c = spec.rowspan.start, spec.colspan.start
+
+  left = (rights[c - 1] + lefts[c]) / 2 if c else 0
+  right = (rights[c] + lefts[c + 1]) / 2 if c < ncols - 1 else 1
+  top = (bottoms[r - 1] + tops[r]) / 2 if r else tops[r]
+  bottom = (bottoms[r] + tops[r + 1]) / 2 if r < nrows - 1 else 0
+  return left, bottom, right - left, top - bottom
+
+
+def _cell_inches():
+  # size of the middle cell of the 3x3 figure with its labels (inches), on the axes of a panel figure
+  panel = acquire_panel((0, 0))
+  _, _, width, height = _cell_bounds(panel['axes'][0, 0])
+  figsize = panel['fig'].get_size_inches()
+  release_panel(panel)
+  return width * figsize[0], height * figsize[1]
+
+
+def heatmap_image(corr, dpi=100):
+  '''
+  1. function takes the correlation matrix of the dataset
+  2. draw the heatmap once, in a figure of the size of its cell (with its labels) in the 3x3 figure
+  3. return the rgba pixels, pasted in the figure of each continuous column by `paste_image`
+  '''
+  fig = new_figure(figsize=_cell_inches())
+  fig.set_dpi(dpi)
   fig.set_facecolor('#cccccc')
-  
-  # Adjust the spacing between subplots
-  plt.subplots_adjust(hspace=0.5, wspace=0.3)
-
-  # *********************************************************
-  # ************ Plot on the subplots (First Row) ***********
-  # *********************************************************
-
-  pie_plot(df, colx, axes[0, 0])
-  count_plot(df, colx, axs=axes[0,1])
-
-  rand_col = random.choice(coly) # Choose a random column from the conti_list
-  strip_plot(df, colx, rand_col, axs=axes[0, 2])
+  heat_map(None, axs=fig.add_subplot(), corr=corr)
+  fig.tight_layout(pad=0.2)
+  fig.canvas.draw()
+  return np.asarray(fig.canvas.buffer_rgba()).copy()
 
-    # *********************************************************
-    # ************ Plot on the subplots (Second Row) ***********
-    # *********************************************************
 
-  if len(colh)>1:
-    rand_col = random.choice(coly) # Choose a random column from the conti_list
-    h_col = random.choice([col for col in colh if col != rand_col and col != colx]) # Choose a random column from the colh exclude rand_col
-    bar_plot(df, colx, rand_col, h_col, axs=axes[1,0])
+def paste_image(ax, image):
+  # show the image over the whole cell of the subplot
+  ax.set_position(_cell_bounds(ax))
+  ax.imshow(image, aspect='auto', interpolation='antialiased')
+  ax.axis('off')
 
-    rand_col = random.choice(coly) # Choose a random column from the conti_list
-    h_col = random.choice([col for col in colh if col != rand_col and col != colx]) # Choose a random column from the colh exclude rand_col
-    strip_plot(df, colx, rand_col, h_col, axs=axes[1, 1])
 
-    rand_col = random.choice(coly) # Choose a random column from the conti_list
-    h_col = random.choice([col for col in colh if col != rand_col and col != colx]) # Choose a random column from the colh exclude rand_col
-    violin_plot(df, colx, rand_col, h_col, axs=axes[1,2])
 
-    # *********************************************************
-    # ************ Plot on the subplots (Third Row) ***********
-    # *********************************************************
 
-    rand_col = random.choice(coly) # Choose a random column from the conti_list
-    h_col = random.choice([col for col in colh if col != rand_col and col != colx])  # Choose a random column from the colh exclude rand_col
-    strip_plot(df, colx, rand_col, h_col, axs=axes[2, 0])
-
-    rand_col = random.choice(coly) # Choose a random column from the conti_list
-    h_col = random.choice([col for col in colh if col != rand_col and col != colx])  # Choose a random column from the colh exclude rand_col
-    box_plot(df, colx, rand_col, h_col, axs=axes[2,1])
-
-    rand_col = random.choice(coly) # Choose a random column from the conti_list
-    h_col = random.choice([col for col in colh if col != rand_col and col != colx]) # Choose a random column from the colh exclude rand_col
-    bar_plot(df, colx, rand_col, h_col, axs=axes[2,2])
-
-  # Set a big title for the entire figure
-  fig.suptitle(f"{colx} analysis \n{'*'*20}".title(), fontsize=16)
+  
 
+# png bytes of a figure  ***************************************************************
+def fig_to_png(fig):
   #capture the figure and Save it to a temporary buffer.
   buf = BytesIO()
-  fig.savefig(buf, format="png")  
-  # Embed the result in the html output.
-  data = base64.b64encode(buf.getbuffer()).decode("ascii")
-
-  return data
-
-
-
-
+  fig.savefig(buf, format="png")
+  return buf.getvalue()
 
 
-# *****************************************************************************************************
-# ***********************   All Continuous Plots in one Figure    *************************************
-# *****************************************************************************************************
 
+# ***************************************************************************************************
+# ***********************   Subplots of the Figures    **********************************************
+# ***************************************************************************************************
 
-def cont_plot(df, colx, cont_list, cat_list, colh):
-  # Create a figure and subplots
-  fig, axes = plt.subplots(3, 3, figsize=(16, 10))
+# each subplot of a figure is described by a spec: the plot name and its columns, as ('strip', 'sex', 'age', 'alive'),
+# the specs of all figures are chosen by the plot plan (see plot_plan), `spec_panel` gives the function drawing one
 
-  # set the background color of the figure to light gray
-  fig.set_facecolor('#cccccc')
+def _panel(plot, *args, ax_name='axs', **kwargs):
+  # function drawing `plot(*args)` on the axes it takes
+  return lambda ax: plot(*args, **{ax_name: ax}, **kwargs)
 
-  # Adjust the spacing between subplots
-  plt.subplots_adjust(hspace=0.5, wspace=0.3)
 
-  # *********************************************************
-  # ************ Plot on the subplots (First Row) ***********
-  # *********************************************************
-  hist_plot(df, colx, axs=axes[0, 0])
+# plot of each spec name: (function, name of its axes argument, takes the shared artifacts, takes a random generator)
+spec_plots = {
+  'pie': (pie_plot, 'ax', True, False),
+  'count': (count_plot, 'axs', True, False),
+  'strip': (strip_plot, 'axs', False, True),
+  'bar': (bar_plot, 'axs', True, False),
+  'violin': (violin_plot, 'axs', True, False),
+  'box': (box_plot, 'axs', True, False),
+  'hist': (hist_plot, 'axs', True, False),
+  'line': (line_plot, 'axs', False, False),
+  'scatter': (scatter_plot, 'axs', False, False),
+  'boxen': (boxen_plot, 'axs', True, False),
+}
 
-  if len(cont_list) > 1 :
-    rand_col = random.choice([col for col in cont_list if col != colx]) # Choose a random column from the conti_list
-    line_plot(df, colx, rand_col, axes[0, 1])
 
-    rand_col = random.choice([col for col in cont_list if col != colx]) # Choose a random column from the conti_list
-    scatter_plot(df, colx, rand_col, axs=axes[0, 2])
+def spec_panel(df, spec, art=None, rng=None):
+  '''function drawing the subplot of the spec (plot name, columns ...) on the axes it takes (random parts from `rng`)'''
+  name, *cols = spec
+  if name == 'heatmap':
+    if art and art['heatmap'] is not None:
+      return lambda ax: paste_image(ax, art['heatmap']) # the same heatmap for all columns, drawn once
+    return _panel(heat_map, df, corr=art['corr'] if art else None)
 
-  # *********************************************************
-  # ************ Plot on the subplots (Second Row) ***********
-  # *********************************************************
+  plot, ax_name, shared, seeded = spec_plots[name]
+  return _panel(plot, df, *cols, ax_name=ax_name, **({'art': art} if shared else {}), **({'rng': rng} if seeded else {}))
 
-  boxen_plot(df, colx, axs=axes[1, 0])
-  
-  if len(cont_list) > 1 :
-    heat_map(df, axs=axes[1, 1])
 
 
-  rand_cat = random.choice(cat_list) # Choose a random column from the cat_list
-  h_col = random.choice([col for col in colh if col != rand_cat]) if len(colh)>1 else colh[0] # Choose a random column from the colh exclude rand_cat
-  box_plot(df, rand_cat, colx, h_col, axs=axes[1, 2])
+# ***************************************************************************************************
+# ***********************   Draw the Panels    ******************************************************
+# ***************************************************************************************************
 
+def _axes_origin(ax):
+  # lower left corner of the subplot (its place in the grid, before any aspect change) in pixels
+  width, height = ax.figure.canvas.get_width_height()
+  box = ax.get_position(original=True)
+  return box.x0 * width, box.y0 * height
+
+
+def panel_pixels(draw, phase=(0, 0)):
+  '''
+  1. function takes the drawing function of a subplot (and the phase of its cell, see `panel_phase`)
+  2. draw it alone on a transparent figure, on an axes of the size of a subplot of the 3x3 figure,
+     keep the pixels it covers (its labels, title and legend too)
+  3. return the rgba pixels and their offset from the lower left corner of the axes,
+     to paste them in the cells of the same phase
+  '''
+  panel = acquire_panel(phase)
+  fig, ax = panel['fig'], panel['axes'][0, 0]
+  x0, y0 = _axes_origin(ax) # before drawing (`paste_image` moves the axes)
+  draw(ax)
+  fig.canvas.draw()
+
+  rgba = np.asarray(fig.canvas.buffer_rgba())
+  drawn = rgba[..., 3] > 0
+  rows, cols = np.flatnonzero(drawn.any(axis=1)), np.flatnonzero(drawn.any(axis=0))
+  image = rgba[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1].copy()
+  offset = (cols[0] - x0, rgba.shape[0] - 1 - rows[-1] - y0) # the image rows go down, the offset up
+
+  # clear the figure for the next subplot (not released if drawing failed, it is freed instead)
+  release_panel(panel)
+
+  return image, offset
+
+
+def composite_figure(panels, colx):
+  '''
+  1. function takes the pixels of the subplots [((row, col), (image, offset))] and the column name
+  2. paste them on a figure of the pool at the place of their subplots (the other cells stay empty)
+  3. return the png bytes
+  '''
+  # Take a figure from the pool (gray background)
+  grid = acquire_grid()
+  fig = grid['fig']
+
+  for (row, col), (image, (dx, dy)) in panels:
+    x0, y0 = cell_origin(row, col)
+    fig.figimage(image, xo=round(x0 + dx), yo=round(y0 + dy)) # pixel to pixel (no resampling)
 
-  # *********************************************************
-  # ************ Plot on the subplots (Third Row) ***********
-  # *********************************************************
+  # Set a big title for the entire figure
+  fig.suptitle(f"{colx} analysis \n{'*'*20}".title(), fontsize=16)
 
-  if len(cont_list) > 1 and len(cat_list) > 1 :
-    rand_col = random.choice([col for col in cont_list if col != colx]) # Choose a random column from the conti_list
-    rand_cat = random.choice(cat_list) # Choose a random column from the cat_list
-    h_col = random.choice([col for col in colh if col != rand_cat]) if len(colh)>1 else colh[0] # Choose a random column from the colh exclude rand_cat
-    scatter_plot(df, colx, rand_col, rand_cat, h_col, axs=axes[2, 0])
+  # png bytes of the figure (saved in the figure store, served by url)
+  data = fig_to_png(fig)
 
+  # clear the figure for the next column (not released if drawing failed, it is freed instead)
+  release_grid(grid)
 
-    rand_col = random.choice([col for col in cont_list if col != colx]) # Choose a random column from the conti_list
-    rand_cat = random.choice(cat_list) # Choose a random column from the cat_list
-    scatter_plot(df, colx, rand_col, rand_cat, axs=axes[2, 1])
+  return data
 
-    rand_col = random.choice([col for col in cont_list if col != colx]) # Choose a random column from the conti_list
-    rand_cat = random.choice(cat_list) # Choose a random column from the cat_list
-    h_col = random.choice([col for col in colh if col != rand_cat]) if len(colh)>1 else colh[0] # Choose a random column from the colh exclude rand_cat
-    scatter_plot(df, colx, rand_col, rand_cat, h_col, axs=axes[2, 2])
 
-  # Set a big title for the entire figure
-  fig.suptitle(f"{colx} analysis \n{'*'*20}".title(), fontsize=16)
+def panel_png(draw, figsize=(8, 5)):
+  '''
+  1. function takes the drawing function of one panel
+  2. draw it alone, in its own figure (gray background as the 3x3 figure)
+  3. return the png bytes
+  '''
+  fig = new_figure(figsize=figsize)
+  fig.set_facecolor('#cccccc')
+  draw(fig.add_subplot())
+  return fig_to_png(fig)
 
-  # capture the figure and Save it to a temporary buffer.
-  buf = BytesIO()
-  fig.savefig(buf, format="png")
-  # Embed the result in the html output.
-  data = base64.b64encode(buf.getbuffer()).decode("ascii")
 
-  return data
 
 
 # ***************************************************************************************************
@@ -436,7 +627,8 @@ def other_columns(other_list):
     num_lines = np.ceil(len(other_list) / 5)  # number of lines 5
 
     # Create a blank plot
-    fig, ax = plt.subplots()
+    fig = new_figure()
+    ax = fig.subplots()
 
     # Set the x-axis range
     ax.set_xlim(0, 5)
@@ -455,11 +647,8 @@ def other_columns(other_list):
         col_num = i % 5  # Column number
         ax.text(col_num + 0.5, line_num + 0.5, value, ha='center', va='center', fontsize=12)
 
-    #capture the figure and Save it to a temporary buffer.
-    buf = BytesIO()
-    fig.savefig(buf, format="png")  
-    # Embed the result in the html output.
-    data = base64.b64encode(buf.getbuffer()).decode("ascii")
+    # png bytes of the figure (saved in the figure store, served by url)
+    data = fig_to_png(fig)
 
     return data
 
@@ -1,11 +1,24 @@
-import numpy as np
 import pandas as pd
-import statistics as st
 import matplotlib.pyplot as plt
 import seaborn as sns
 import random
+import io
 
-from all_plots import cat_plot, cont_plot, other_columns # my custom functions
+from all_plots import other_columns, heatmap_image # my custom functions
+from plot_plan import plan_figures, batch_aggregates
+from render_pool import render_figures
+from column_profile import profile_columns, refresh_profile
+from type_inference import replace_missing
+from sketches import stats_settings, use_sketches, approx_quantiles
+from shared_artifacts import dataset_artifacts
+from compaction import compact_frame
+from summary import summarize, describe_numeric, describe_other, info_text
+from instrument import stage, record, log
+
+
+# version of the analysis output, change it when the tables or figures change
+# (it is part of the result cache key, so old results are not reused)
+ANALYSIS_VERSION = 10
 
 
 
@@ -15,98 +28,128 @@ from all_plots import cat_plot, cont_plot, other_columns # my custom functions
 
 
 # check if there is an ID columns ****************************************
-def check_id(df):
+def check_id(df, profile=None):
+
+  if profile is None:
+    profile = profile_columns(df)
 
-  id_names = [col for col in df if 'id' in col.lower() ] # list of columns have 'id' in its name
+  id_names = [col for col in df if 'id' in str(col).lower() ] # list of columns have 'id' in its name
 
-  i_d = [col for col in df if df[col].nunique() == df.shape[0]] # list of all columns has unique values == number of all df rows
+  # list of all columns has unique values == number of all df rows
+  # (an estimated number of unique values only has to be within 3 times its relative error)
+  unique_min = profile.attrs['rows'] * (1 - 3 * profile.attrs.get('nunique_error', 0))
+  i_d = list(profile.index[profile['nunique'] >= unique_min])
 
-  if len(i_d) == 1 :                                            # if there is one column so it must be the index
+  if len(i_d) > 1 : # if we have more than one column in id list
+    i_d = [col for col in i_d if col in id_names]  # check if any of these columns have "id" in its name
+
+  if len(i_d) == 1 :  # if there is one column so it must be the index
     #df.set_index(id[0], inplace=True)                          # set the column as index
     df.drop(columns=i_d[0], inplace=True)   # drop the 'id' column because it makes plot so bad
-    return df
-  elif len(i_d) > 1 : # if we have more than one column in id list
-    sub_id = [col for col in i_d if col in id_names]  # check if any of these columns have "id" in its name
-    if len(sub_id) == 1 :  # check if sub_id have only one column
-      df.drop(columns=sub_id[0], inplace=True)   # drop the 'id' column because it makes plot so bad
-      return df
-  else:
-    return df
+    refresh_profile(profile, df, [])
+
+  return df
 
 # check high number of nulls ******************************************************
  
-def check_nulls(df):
+def check_nulls(df, profile=None):
   """
-  1. function takes data frame
+  1. function takes data frame (and its column profile)
   2. drop the column has more than 50% nulls
   3. return data frame
   """
-  df = check_id(df) # check if there ara an id column in df
+  if profile is None:
+    profile = profile_columns(df)
+
+  with stage('check_id'):
+    df = check_id(df, profile) # check if there ara an id column in df
 
-  # list of some possible string values can be found insted of 'nulls'
-  missing_str = ['miss','not found','unknown','NA','unspecified','other','N/A','invalid','none','null','empty','@','/','$','%','&','?','!','~','|','\\','< >','[]']
-  df.replace(missing_str, np.nan, inplace=True) # replace any noise value in df by 'NAN'
+  # replace any noise value in the object columns by 'NAN' (numbers can't have them)
+  changed = replace_missing(df, profile.index[profile['kind'] == 'object'])
 
-  for col in df: #  loop foe each col in df
+  # update the nulls and the distinct values (the noise values are not classes any more) of the changed columns
+  refresh_profile(profile, df, changed, fields=('nulls', 'nunique'))
 
-    if df[col].isna().sum()/len(df) > 0.5 : # check if column has more than 50% nulls
-      df.drop(columns=col, inplace=True) # drop the column has more than 50% nulls
+  # drop the columns have more than 50% nulls
+  df.drop(columns=profile.index[profile['nulls'] / profile.attrs['rows'] > 0.5], inplace=True)
+  refresh_profile(profile, df, [])
 
 
   return df # return df after drop column with more than 50% nulls
 
 
 
+# value to fill the nulls of a column *********************************************
+def fill_value(df, col, profile, how='mode'):
+  '''
+  1. function takes data frame, column name, column profile and 'mode' or 'mean'
+  2. return the mode / mean of the whole data if the profile has it (streamed file)
+  3. otherwise compute it from the data frame
+  '''
+  if how in profile and pd.notna(profile.at[col, how]):
+    return profile.at[col, how]
+
+  return df[col].mode()[0] if how == 'mode' else df[col].mean()
+
+
 # function handle nulls & convert types ********************************************
  
-def clean_data(df):
+def clean_data(df, profile=None):
   '''
-  1. function takes data frame
+  1. function takes data frame (and its column profile, updated in place)
   2. create list of any column types not [int , float, bool]
   3. check the values type inside each column
   4. handle missing values according to values type
   5. convert column type to a suitable type
   6. return data frame
   '''
-  df = check_nulls(df) # drop any column has more than 50% nulls
-  numerical_column = ['int64', 'float64', 'int32', 'int16', 'int8', 'float32', 'uint8', 'uint16', 'uint32', 'uint64', 'bool']
+  if profile is None:
+    profile = profile_columns(df)
 
-  obj_col = [col for col in df if df[col].dtype not in numerical_column] # create list of any column types not [int , float, bool]
+  with stage('check_nulls'):
+    df = check_nulls(df, profile) # drop any column has more than 50% nulls
+
+  changed = [] # columns changed by the cleaning, their profile is recomputed at the end
 
   for col in df: # loop on each col in df
-    if col in obj_col : # if col type not [int, float, bool]
-        t=[] # empty list to store some types of each single value int the column
+    kind, value_type, nulls = profile.at[col, 'kind'], profile.at[col, 'value_type'], profile.at[col, 'nulls']
 
-        for i in range(25): # loop on from 0 to 24
-          if not pd.isnull(df[col][i]): # check the first 25 value in each column if not null
-            t.append(type(df[col][i])) # if the value is not null , appent it's type in `t` list
+    if kind == 'object' : # if col type not [int, float, bool]
+        # `value_type` is the type inferred from a random sample of the column values
 
-        if st.mode(t) == str: # check on the mode of `t` list if is 'str', then the column should be 'object'
+        if value_type == str: # if the mode is 'str', then the column should be 'object'
           # convert the 'sting values' iside column to lower case
           df[col] = df[col].str.lower() # make sure that all values in the same shape
-          df[col] = df[col].fillna(df[col].mode()[0]) # fill nulls in this column with the mode of the column
+          fill = fill_value(df, col, profile, 'mode')
+          df[col] = df[col].fillna(fill.lower() if isinstance(fill, str) else fill) # fill nulls in this column with the mode of the column
+          changed.append(col)
 
-        elif st.mode(t) == bool: # check the mode of `t` if bool
-          df[col] = df[col].fillna(df[col].mode()[0]) # fill nulls with the mode
+        elif value_type == bool: # check the mode of the types if bool
+          df[col] = df[col].fillna(fill_value(df, col, profile, 'mode')) # fill nulls with the mode
           df[col] = df[col].astype(int) # convert the column to int , (1 for Ture and 0 for False)
+          changed.append(col)
 
-        elif (st.mode(t) == float) or (st.mode(t) == int): # if the mode of `t` is numeric
+        elif (value_type == float) or (value_type == int): # if the mode of the types is numeric
           df[col] = pd.to_numeric(df[col], errors='coerce') # convert it to numeric, and replace any value(/,+,@) cann't converted to NAN
-          df[col] = df[col].fillna(df[col].mean()) # fill nulls with the mean of the column
+          df[col] = df[col].fillna(fill_value(df, col, profile, 'mean')) # fill nulls with the mean of the column
+          changed.append(col)
 
-    elif df[col].dtype == bool : # check if column type is bool
-      df[col] = df[col].fillna(df[col].mode()[0]) # fill nulls with the mode
+    elif kind == 'bool' : # check if column type is bool
+      df[col] = df[col].fillna(fill_value(df, col, profile, 'mode')) # fill nulls with the mode
       df[col] = df[col].astype(int) # convert the column to int , (1 for Ture and 0 for False)
+      changed.append(col)
+
+    elif nulls: # if not object or bool , it must be [int , float], only fill the columns have nulls
+      df[col] = df[col].fillna(fill_value(df, col, profile, 'mean')) # fill nulls with the mean of the column
+      changed.append(col)
 
-    else: # if not in obj_col or not bool , it must be [int , float]
-      df[col] = pd.to_numeric(df[col], errors='coerce')  # convert it to numeric, and replace any value(/,+,@) cann't converted to NAN
-      df[col] = df[col].fillna(df[col].mean()) # fill nulls with the mean of the column
+  refresh_profile(profile, df, changed)
 
   return df
 
 
 # cluster columns types *************************************************************
-def split_type(df):
+def split_type(df, profile=None):
 
   '''
   cat_list = [ col for col in obj_list if df[col].nunique() <= 15  ] # list with categorical column have <= 15 class
@@ -114,18 +157,17 @@ def split_type(df):
   cat_list += conti_cat_list # add conti_cat_list to cat_list
   '''
 
-  numerical_column = ['int64', 'float64', 'int32', 'int16', 'int8', 'float32', 'uint8', 'uint16', 'uint32', 'uint64', 'bool']
+  if profile is None:
+    profile = profile_columns(df)
 
-  obj_list = []    # create list of non numerical columns (and) any column with number of unique <=15
-  for col in df.columns:
-      if df[col].dtype not in numerical_column or df[col].nunique() <= 15:
-          obj_list.append(col)
+  nunique = profile['nunique']
+  numeric = profile['kind'] != 'object' # [int , float, bool] columns
 
-  cat_list = [ col for col in obj_list if df[col].nunique() <= 15  ] # list of column with only number of unique <=15
+  cat_list = [ col for col in df if nunique[col] <= 15  ] # list of column with only number of unique <=15 (numerical or not)
 
-  conti_list = [ col for col in df if df[col].dtype in numerical_column and col not in cat_list ] # list of numerical continuous columns
+  conti_list = [ col for col in df if numeric[col] and col not in cat_list ] # list of numerical continuous columns
 
-  hue_cat = [ col for col in cat_list if df[col].nunique() < 4 ]  # list of categorical column have < 4 class (for hue in plots)
+  hue_cat = [ col for col in cat_list if nunique[col] < 4 ]  # list of categorical column have < 4 class (for hue in plots)
 
   other_list = [ col for col in df if col not in cat_list and col not in conti_list and col not in hue_cat] # other columns not in [cat_list, conti_list, hue_cat ]
 
@@ -133,34 +175,161 @@ def split_type(df):
 
 
 
+# ***********************************************************************************
+# ****************************   Summary Tables    **********************************
+# ***********************************************************************************
+
+def numeric_describe(df, stats=None, summary=None):
+  '''
+  1. function takes data frame (the stats settings, default from the environment, and its `summarize` result)
+  2. return `df.describe()`, with the quantiles estimated by KLL sketches if the stats backend is 'sketch'
+     (taken from the summary when there is one)
+  '''
+  stats = stats or stats_settings()
+  num = df.select_dtypes(include='number')
+  if not use_sketches(stats) or not num.shape[1]:
+    des = describe_numeric(df, summary) if summary is not None else None
+    return df.describe() if des is None else des
+
+  des = num.agg(['count', 'mean', 'std', 'min'])
+  quantiles = pd.DataFrame({col: approx_quantiles(num[col], (0.25, 0.5, 0.75), stats['quantile_error']) for col in num},
+                           index=['25%', '50%', '75%'])
+  return pd.concat([des, quantiles, num.agg(['max'])])
+
+
+def summary_tables(df):
+  '''
+  1. function takes data frame (before cleaning)
+  2. create html of the first 5 rows, df.info and the numerical / object describe
+     (all from one pass over the data, see `summary`)
+  3. return dict of the tables (a describe is None if the data frame has no such columns)
+  '''
+
+  # Get the first 5 rows of the loaded dataset
+  with stage('head'):
+    head_table = df.head().to_html(classes='table table-striped')
+
+  # stats of all columns at once: numerical stats, classes counts, non-null counts
+  with stage('summarize'):
+    summary = summarize(df)
+
+  # Get the dataset information
+  with stage('info'):
+    info_table = info_text(df, summary)
+    if info_table is None: # too many columns / rows, pandas shows it another way
+      buffer = io.StringIO() #create a buffer from StringIO
+      df.info(buf=buffer) # save the df.info in buffer
+      info_table = buffer.getvalue() # get value from the buffer
+
+  # Calculate the summary statistics
+  pd.set_option('display.float_format', lambda x: f'{x:.2f}')# set the float format for pandas outputs
+  try:
+    with stage('describe_numeric'):
+      des_n = numeric_describe(df, summary=summary).to_html(classes='table table-striped')
+  except Exception as e: # no numerical columns
+    log.info('no numerical describe: %s: %s', type(e).__name__, e)
+    des_n = None
+  try :
+    with stage('describe_object'):
+      des_c = describe_other(df, summary)
+      if des_c is None: # dates ..., or no object columns (pandas raises)
+        des_c = df.describe(exclude=[int,float])
+      des_c = des_c.to_html(classes='table table-striped')
+  except Exception as e: # no object columns
+    log.info('no object describe: %s: %s', type(e).__name__, e)
+    des_c = None
+
+  return {'head_table': head_table, 'info_table': info_table, 'des_n': des_n, 'des_c': des_c}
+
+
+
 # ***********************************************************************************
 # *******************************   All In One    ***********************************
 # ***********************************************************************************
 
-def all_in_one(df):
+def prepare_analysis(df, profile=None, on_compact=None):
+  '''
+  1. function takes data frame (optional column profile)
+  2. clean the data and cluster the columns types
+  3. compact the dtypes (categories / smaller numbers), report the memory before / after to `on_compact`
+  4. compute the dataset level artifacts once (correlation heatmap, value counts, group stats)
+  5. plan the subplots of each figure and compute the group stats of all of them at once (`plot_plan`)
+  6. return dict of everything needed to render the figures:
+     'df' (cleaned), 'jobs' (kind, column and panels of each figure), 'art', 'other_list' and 'columns' (profile table)
+  '''
+
+  if profile is None:
+    with stage('profile'):
+      profile = profile_columns(df) # nulls, cardinality and types of all columns in one pass
+
+  before = profile.copy() # the profile of the loaded data, for the profile table
+  dtypes = df.dtypes
 
-  df = clean_data(df) # handle nulls & dtypes
+  with stage('clean_data'):
+    df = clean_data(df, profile) # handle nulls & dtypes
 
   # cluster types of columns
-  cat_list, conti_list, hue_cat, other_list = split_type(df)
+  with stage('split_type'):
+    cat_list, conti_list, hue_cat, other_list = split_type(df, profile)
+
+  # smaller dtypes for the plots (and the copies sent to the worker processes)
+  with stage('compact_frame'):
+    df, compaction = compact_frame(df, cat_list)
+  if on_compact:
+    on_compact(compaction)
+
+  # one figure job for each column can be plotted (categorical columns first, as they are displayed)
+  jobs = [('cat', col, (conti_list, hue_cat)) for col in df if col in cat_list] # apply all categorical plots on these columns
+  jobs += [('cont', col, (conti_list, cat_list, hue_cat)) for col in df if col in conti_list] # apply all continuous plots on these columns
+
+  # results shared by all figures: correlation (heatmap drawn once), value counts, group stats
+  with stage('artifacts'):
+    art = dataset_artifacts(df, cat_list, conti_list, profile.attrs.get('histograms'))
+    if art['corr'] is not None:
+      art['heatmap'] = heatmap_image(art['corr'])
+
+  # the subplots of every figure (seeded random columns), then the bar / box group stats they need
+  with stage('plot_plan'):
+    plan = plan_figures(jobs)
+    batch_aggregates(df, plan, art)
+  jobs = [(kind, col, panels) for (kind, col, args), panels in zip(jobs, plan)]
+
+  # role of each loaded column (dropped by the cleaning: id / too many nulls)
+  role = {col: 'categorical' for col in cat_list}
+  role.update({col: 'continuous' for col in conti_list})
+  role.update({col: 'no plots' for col in other_list})
+  rows = before.attrs['rows'] or 1
+  columns = [{'col': col, 'dtype': str(dtypes[col]), 'nulls': f"{100 * before.at[col, 'nulls'] / rows:.1f}%",
+              'nunique': int(before.at[col, 'nunique']) if pd.notna(before.at[col, 'nunique']) else None,
+              'role': role.get(col, 'dropped')} for col in before.index]
+
+  return {'df': df, 'jobs': jobs, 'art': art, 'other_list': other_list, 'columns': columns}
+
+
+def all_in_one(df, workers=None, on_plan=None, on_figure=None, profile=None, on_compact=None):
+  '''
+  1. function takes data frame (optional number of worker processes and column profile)
+  2. clean the data, cluster the columns types, compact the dtypes and compute the artifacts (`prepare_analysis`)
+  3. render the figure of each categorical / continuous column in parallel
+  4. report the memory of the compaction to `on_compact`, the planned columns to `on_plan`
+     and each finished figure to `on_figure` (each stage and figure is timed, see `instrument`)
+  5. return the figures ids (in columns order, png in the figure store) and the columns have no plots
+  '''
 
+  prepared = prepare_analysis(df, profile, on_compact)
+  df, jobs = prepared['df'], prepared['jobs']
 
-  all_figs={'cat_fig':[],'cont_fig':[]}
+  if on_plan:
+    on_plan([(kind, col) for kind, col, panels in jobs])
 
 
-  for col in df :  # loop in each column in df
-    
-    if col in cat_list:  # check if the column is categorical
-      cat_fig_data = cat_plot(df, col, conti_list, hue_cat) # apply all categorical plots on current column
-      all_figs['cat_fig'].append(cat_fig_data)
-    
-    elif col in conti_list :
-      cont_fig_data = cont_plot(df, col, conti_list, cat_list, hue_cat) # apply all continuous plots on current column
-      all_figs['cont_fig'].append(cont_fig_data)
-    else:
-      continue  
+  all_figs={'cat_fig':[],'cont_fig':[]}
 
-  
-  return all_figs , other_list
+  for (kind, col, panels), (fig_id, timing) in zip(jobs, render_figures(df, jobs, workers, prepared['art'])):
+    record(timing) # timing of the figure, measured where it was rendered
+    all_figs[f'{kind}_fig'].append(fig_id)
+    if on_figure:
+      on_figure(kind, col, fig_id)
 
 
+  return all_figs , prepared['other_list']
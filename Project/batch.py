@@ -0,0 +1,171 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from autoAnalysis import all_in_one, summary_tables # my custom functions
+from columnar import columnar_formats, columnar_format, read_columnar
+from figure_store import figure_path
+
+
+
+# ************************************************************************************
+# ***************************    Batch Analysis    ***********************************
+# ************************************************************************************
+
+# analyse many files without the web app, each file in its own process:
+#   python batch.py data/ "exports/*.csv" --out reports --workers 8
+# each file gets a report bundle (open index.html, the figures are png files next to it):
+#   <out>/<file name>/index.html
+#   <out>/<file name>/figures/<n>_<column>.png
+# and the whole run a throughput summary (<out>/summary.json, printed at the end).
+
+_extentions = ['.csv'] + list(columnar_formats)
+
+_templates = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+                         autoescape=select_autoescape(['html']))
+
+
+def find_files(inputs):
+    '''
+    1. function takes list of directories, files or glob patterns
+    2. return the sorted paths of the csv / columnar files they contain (directories are not searched recursively)
+    '''
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            matches = glob.glob(item)
+        paths.update(path for path in matches
+                     if os.path.isfile(path) and os.path.splitext(path)[1].lower() in _extentions)
+    return sorted(paths)
+
+
+def _bundle_dir(out, path, used):
+    # one directory for each file, named by the file (a number is added if two files have the same name)
+    name = os.path.splitext(os.path.basename(path))[0]
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f'{name}_{n}'
+    used.add(candidate)
+    return os.path.join(out, candidate)
+
+
+def _safe_name(col):
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(col))[:60]
+
+
+# analyse one file (in a worker process) ****************************************
+def analyse_file(path, bundle):
+    '''
+    1. function takes the path of a csv / parquet / feather / arrow file and the directory of its report
+    2. read the file, create the summary tables and the figures (rendered in this process)
+    3. write the report bundle: index.html and the png of each figure
+    4. return the stats of the file (rows, columns, size, seconds, error)
+    '''
+    start = time.time()
+    info = {'file': path, 'report': os.path.join(bundle, 'index.html'), 'bytes': os.path.getsize(path),
+            'rows': 0, 'columns': 0, 'figures': 0, 'error': None}
+
+    os.makedirs(os.path.join(bundle, 'figures'), exist_ok=True)
+    figures, compaction = [], {}
+
+    def on_figure(kind, col, fig_id): # copy the png right away (the figure store can evict it later)
+        name = f'figures/{len(figures):03d}_{_safe_name(col)}.png'
+        shutil.copyfile(figure_path(fig_id), os.path.join(bundle, name))
+        figures.append({'kind': kind, 'col': col, 'src': name})
+
+    tables, other_list = None, []
+    try:
+        fmt = columnar_format(path)
+        df = read_columnar(path, fmt) if fmt else pd.read_csv(path)
+        info['rows'], info['columns'] = df.shape
+        tables = summary_tables(df) # before `all_in_one` changes the data frame
+        _, other_list = all_in_one(df, workers=1, on_figure=on_figure, on_compact=compaction.update)
+    except Exception as e:
+        info['error'] = f'{type(e).__name__}: {e}'
+
+    html = _templates.get_template('report.html').render(
+        df_name=os.path.splitext(os.path.basename(path))[0], **(tables or {}), figures=figures,
+        other_list=other_list, compaction=compaction, error=info['error'])
+    with open(info['report'], 'w', encoding='utf-8') as f:
+        f.write(html)
+
+    info['figures'] = len(figures)
+    info['seconds'] = round(time.time() - start, 3)
+    return info
+
+
+# analyse all files *************************************************************
+def run_batch(inputs, out='reports', workers=None):
+    '''
+    1. function takes the input directories / files / globs, the output directory and the number of processes
+    2. analyse the files in a pool of processes (one file for each process at a time)
+    3. write and return the throughput summary
+    '''
+    paths = find_files(inputs)
+    workers = max(1, workers or os.cpu_count() or 1)
+    os.makedirs(out, exist_ok=True)
+
+    used = set()
+    bundles = {path: _bundle_dir(out, path, used) for path in paths}
+
+    start = time.time()
+    files = []
+    with ProcessPoolExecutor(max_workers=min(workers, max(1, len(paths)))) as pool:
+        futures = {pool.submit(analyse_file, path, bundles[path]): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                info = future.result()
+            except Exception as e: # the worker process died
+                info = {'file': futures[future], 'report': None, 'bytes': 0, 'rows': 0, 'columns': 0,
+                        'figures': 0, 'seconds': 0, 'error': f'{type(e).__name__}: {e}'}
+            files.append(info)
+            print(f"[{len(files)}/{len(paths)}] {info['file']}: "
+                  f"{info['error'] or str(info['rows']) + ' rows, ' + str(info['figures']) + ' figures'} ({info['seconds']}s)",
+                  file=sys.stderr)
+
+    elapsed = time.time() - start
+    rows = sum(info['rows'] for info in files)
+    size = sum(info['bytes'] for info in files)
+    summary = {
+        'files': len(files),
+        'failed': sum(1 for info in files if info['error']),
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'rows': rows,
+        'mb': round(size / 2**20, 3),
+        'files_per_s': round(len(files) / elapsed, 3) if elapsed else None,
+        'rows_per_s': round(rows / elapsed, 1) if elapsed else None,
+        'mb_per_s': round(size / 2**20 / elapsed, 3) if elapsed else None,
+        'results': sorted(files, key=lambda info: info['file']),
+    }
+
+    with open(os.path.join(out, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+    return summary
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analyse many csv / parquet / feather / arrow files, one report bundle for each file')
+    parser.add_argument('inputs', nargs='+', help='directories, files or glob patterns')
+    parser.add_argument('--out', default='reports', help='directory of the report bundles (default: reports)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of cores)')
+    args = parser.parse_args()
+
+    summary = run_batch(args.inputs, args.out, args.workers)
+    print(f"{summary['files']} files ({summary['failed']} failed), {summary['rows']} rows, {summary['mb']} MB "
+          f"in {summary['seconds']}s with {summary['workers']} processes: "
+          f"{summary['files_per_s']} files/s, {summary['rows_per_s']} rows/s, {summary['mb_per_s']} MB/s")
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,439 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+import statistics
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import matplotlib
+
+from autoAnalysis import (ANALYSIS_VERSION, check_id, check_nulls, clean_data, split_type,
+                          summary_tables, all_in_one) # my custom functions
+from all_plots import heatmap_image
+from plot_plan import cat_plot, cont_plot, clear_memo
+from column_profile import profile_columns
+from compaction import compact_frame
+from shared_artifacts import dataset_artifacts
+from summary import summarize
+from group_summary import group_summary
+from density import group_kde
+from engine import active_engine, load_engine
+from type_inference import missing_str
+
+
+
+# ************************************************************************************
+# ***************************    Benchmarks    ***************************************
+# ************************************************************************************
+
+# time each stage of the pipeline on synthetic datasets, and compare the results between commits:
+#   python benchmarks.py run --rows 1000,100000 --cardinality 5,50 --out bench_results/<commit>.json
+#   python benchmarks.py compare bench_results/<old>.json bench_results/<new>.json
+#   python benchmarks.py cold-start --repeat 5    (time to start a new server process, see startup)
+# for each dataset (rows x columns x cardinality x null ratio) and stage:
+#   seconds     wall time (median / min of the repeats)
+#   cpu         cpu time of this process (median), less than `seconds` when waiting on the render processes
+#   peak_mb     peak of the memory allocated by the stage (tracemalloc, one extra run, this process only)
+
+# stages in pipeline order, each one runs on the output of the previous ones (prepared before the timing)
+stage_names = ['profile', 'check_id', 'check_nulls', 'clean_data', 'split_type', 'compact_frame',
+               'artifacts', 'summarize', 'group_summary', 'density', 'summary_tables', 'cat_plot', 'cont_plot', 'all_in_one',
+               'engine_scan', 'load_dataset']
+
+
+# Synthetic Data  ***********************************************************************
+def synthetic_frame(rows=10_000, cols=8, cardinality=5, null_ratio=0.1, seed=0):
+    '''
+    1. function takes the shape of the dataset, the number of classes of its categorical columns and the ratio of nulls
+    2. create an id column, two hue columns (2 and 3 classes), then cycle through
+       floats, integers, categorical strings, numbers stored as strings and free text until `cols` columns
+    3. replace `null_ratio` of the values of each column (except the id) by nulls, half of them
+       by noise strings ('unknown', '?' ...) in the string columns
+    4. return the data frame (same seed -> same data)
+    '''
+    rng = np.random.default_rng(seed)
+    classes = np.array([f'class_{i}' for i in range(max(1, cardinality))])
+
+    data = {
+        'id': np.arange(rows),
+        'flag': rng.random(rows) < 0.4,
+        'segment': rng.choice(['low', 'mid', 'high'], rows, p=[0.5, 0.3, 0.2]),
+    }
+
+    makers = [
+        ('num', lambda: rng.normal(50, 15, rows).round(3)),
+        ('count', lambda: rng.poisson(200, rows)),
+        ('cat', lambda: rng.choice(classes, rows, p=_zipf(len(classes)))),
+        ('price', lambda: rng.lognormal(3, 1, rows).round(2).astype(str).astype(object)),
+        ('text', lambda: np.char.add('item ', rng.integers(0, rows, rows).astype(str)).astype(object)),
+    ]
+    for i, (name, make) in zip(range(len(data), cols), itertools.cycle(makers)):
+        data[f'{name}_{i}'] = make()
+
+    df = pd.DataFrame(data)
+    for col in df.columns[1:]:
+        mask = rng.random(rows) < null_ratio
+        if df[col].dtype == object:
+            df[col] = df[col].where(~mask, np.where(rng.random(rows) < 0.5, None, rng.choice(missing_str[:10], rows)))
+        elif df[col].dtype == bool:
+            df[col] = df[col].astype(object).mask(mask)
+        else:
+            df[col] = df[col].mask(mask)
+
+    return df
+
+
+def _zipf(n):
+    # skewed class frequencies, as most real categorical columns
+    weights = 1 / np.arange(1, n + 1)
+    return weights / weights.sum()
+
+
+# Stages  *******************************************************************************
+# each stage: name -> (setup, run, cleanup), `setup(state)` builds the input (not timed), `run(*input)` is timed
+def _pipeline_state(df, workers):
+    # outputs of every stage of the pipeline, inputs of the next ones
+    state = {'df': df, 'workers': workers, 'csv': df.to_csv(index=False).encode()}
+    state['profile'] = profile_columns(df.copy())
+    cleaned_profile = state['profile'].copy()
+    state['cleaned'] = clean_data(df.copy(), cleaned_profile)
+    state['cleaned_profile'] = cleaned_profile
+    state['split'] = split_type(state['cleaned'], cleaned_profile)
+    state['compact'], _ = compact_frame(state['cleaned'].copy(), state['split'][0])
+    return state
+
+
+def _artifacts(df, cat_list, conti_list):
+    art = dataset_artifacts(df, cat_list, conti_list)
+    if art['corr'] is not None:
+        art['heatmap'] = heatmap_image(art['corr'])
+    return art
+
+
+def _plot(plot, df, col, *args, art=None):
+    return plot(df, col, *args, art=art, seed=0) # the same subplots every run
+
+
+def _groups_input(s):
+    # the continuous columns of the first categorical column and hue (as a grouped bar / box subplot)
+    cat_list, conti_list, hue_cat, _ = s['split']
+    if not cat_list or not conti_list:
+        return None
+    by = [cat_list[0]] + [col for col in hue_cat if col != cat_list[0]][:1]
+    return s['compact'], by, conti_list
+
+
+def _density_input(s):
+    # the densities of the first continuous column for each class of the first categorical column (as a violin subplot)
+    groups = _groups_input(s)
+    return groups and (groups[0], groups[1][:1], groups[2][0])
+
+
+def _cat_input(s):
+    cat_list, conti_list, hue_cat, _ = s['split']
+    if not cat_list or not conti_list:
+        return None
+    return cat_plot, s['compact'], cat_list[0], conti_list, hue_cat, _artifacts(s['compact'], cat_list, conti_list)
+
+
+def _cont_input(s):
+    cat_list, conti_list, hue_cat, _ = s['split']
+    if not cat_list or not conti_list or not hue_cat:
+        return None
+    return cont_plot, s['compact'], conti_list[0], conti_list, cat_list, hue_cat, _artifacts(s['compact'], cat_list, conti_list)
+
+
+def _upload(csv):
+    # the whole web path: upload -> job -> all figures in the figure store (empty result cache, so nothing is reused)
+    from main import app
+    from jobs import get_job
+
+    res = app.test_client().post('/load_dataset', data={'dataset_file': (io.BytesIO(csv), 'bench.csv')},
+                                 content_type='multipart/form-data')
+    if res.status_code != 303:
+        raise RuntimeError(f'/load_dataset returned {res.status_code}')
+
+    job = get_job(res.headers['Location'].rstrip('/').split('/')[-2])
+    while job['status'] in ('queued', 'running'):
+        time.sleep(0.005)
+    if job['status'] != 'done':
+        raise RuntimeError('the analysis job failed')
+
+
+def _engine_input(s):
+    # the csv saved in a temp file (removed by `load_engine`), only with AUTO_ANALYSIS_ENGINE=duckdb / polars
+    if active_engine() == 'pandas':
+        return None
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(s['csv'])
+    return path, 'csv'
+
+
+def _empty_cache(csv):
+    path = tempfile.mkdtemp(prefix='bench-cache-')
+    os.environ['AUTO_ANALYSIS_CACHE_DIR'] = path
+    return (csv,), path
+
+
+def _remove_cache(path):
+    os.environ.pop('AUTO_ANALYSIS_CACHE_DIR', None)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+stages = {
+    'profile':        (lambda s: (s['df'].copy(),), profile_columns, None),
+    'check_id':       (lambda s: (s['df'].copy(), s['profile'].copy()), check_id, None),
+    'check_nulls':    (lambda s: (s['df'].copy(), s['profile'].copy()), check_nulls, None),
+    'clean_data':     (lambda s: (s['df'].copy(), s['profile'].copy()), clean_data, None),
+    'split_type':     (lambda s: (s['cleaned'], s['cleaned_profile']), split_type, None),
+    'compact_frame':  (lambda s: (s['cleaned'].copy(), s['split'][0]), compact_frame, None),
+    'artifacts':      (lambda s: (s['compact'], s['split'][0], s['split'][1]), _artifacts, None),
+    'summarize':      (lambda s: (s['df'],), summarize, None),
+    'group_summary':  (_groups_input, group_summary, None),
+    'density':        (_density_input, group_kde, None),
+    'summary_tables': (lambda s: (s['df'],), summary_tables, None),
+    'cat_plot':       (_cat_input, lambda plot, df, col, *args: _plot(plot, df, col, *args[:-1], art=args[-1]), None),
+    'cont_plot':      (_cont_input, lambda plot, df, col, *args: _plot(plot, df, col, *args[:-1], art=args[-1]), None),
+    'all_in_one':     (lambda s: (s['df'].copy(), s['workers']), lambda df, workers: all_in_one(df, workers), None),
+    'engine_scan':    (_engine_input, load_engine, None),
+    'load_dataset':   (lambda s: _empty_cache(s['csv']), _upload, _remove_cache),
+}
+
+
+def time_stage(name, state, repeat=3):
+    '''
+    1. function takes the stage name, the pipeline state of the dataset and the number of runs
+    2. time the stage `repeat` times (wall and cpu), then run it once more with tracemalloc for its peak memory
+    3. return dict of the results, None if the dataset has no input for this stage (no categorical columns ...)
+    '''
+    setup, run, cleanup = stages[name]
+
+    def prepare():
+        clear_memo() # each run draws its subplots (none memoized by the previous run)
+        args = setup(state)
+        if args is None:
+            return None, None
+        return args if cleanup else (args, None)
+
+    walls, cpus = [], []
+    for _ in range(repeat + 1): # the first run only warms up (imports, caches, figure pool)
+        args, extra = prepare()
+        if args is None:
+            return None
+        wall, cpu = time.perf_counter(), time.process_time()
+        run(*args)
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+        if cleanup:
+            cleanup(extra)
+
+    args, extra = prepare()
+    tracemalloc.start()
+    try:
+        run(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        if cleanup:
+            cleanup(extra)
+
+    walls, cpus = walls[1:], cpus[1:]
+    return {'seconds': round(statistics.median(walls), 4), 'min_seconds': round(min(walls), 4),
+            'cpu': round(statistics.median(cpus), 4), 'peak_mb': round(peak / 2**20, 2), 'repeat': repeat}
+
+
+# Run  **********************************************************************************
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(rows=(1_000, 20_000), cols=(8,), cardinality=(5, 50), nulls=(0.1,), names=None,
+                   repeat=3, workers=1, seed=0):
+    '''
+    1. function takes the values of each dataset parameter (every combination is a dataset) and the stages to time
+    2. create each synthetic dataset, prepare the pipeline state and time the stages
+    3. return the results with the environment they ran in (commit, versions, cpus)
+    '''
+    names = names or stage_names
+    results = []
+    for n_rows, n_cols, n_classes, ratio in itertools.product(rows, cols, cardinality, nulls):
+        dataset = {'rows': n_rows, 'cols': n_cols, 'cardinality': n_classes, 'nulls': ratio}
+        state = _pipeline_state(synthetic_frame(n_rows, n_cols, n_classes, ratio, seed), workers)
+
+        timings = {}
+        for name in names:
+            timings[name] = time_stage(name, state, repeat)
+            print(f"{dataset} {name}: {timings[name]}", file=sys.stderr)
+        results.append({'dataset': dataset, 'stages': timings})
+
+    meta = {
+        'commit': _commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'analysis_version': ANALYSIS_VERSION,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'matplotlib': matplotlib.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'workers': workers,
+        'seed': seed,
+    }
+    return {'meta': meta, 'results': results}
+
+
+# Compare  ******************************************************************************
+def _key(dataset):
+    return tuple(dataset[k] for k in ('rows', 'cols', 'cardinality', 'nulls'))
+
+
+def compare(base, new, threshold=0.1, min_seconds=0.01):
+    '''
+    1. function takes two benchmark results (baseline and new) and the relative change to report
+    2. match the datasets and stages of both results
+    3. return list of rows (dataset, stage, base / new seconds and peak, ratios, 'slower' | 'faster' | '')
+       a stage is slower / faster only if its time changed more than `threshold` and `min_seconds` (noise)
+    '''
+    base_results = {_key(r['dataset']): r['stages'] for r in base['results']}
+    rows = []
+    for result in new['results']:
+        old_stages = base_results.get(_key(result['dataset']))
+        if old_stages is None:
+            continue
+        for name, stage in result['stages'].items():
+            old = old_stages.get(name)
+            if not old or not stage:
+                continue
+            ratio = stage['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+            change = ''
+            if abs(stage['seconds'] - old['seconds']) >= min_seconds:
+                if ratio > 1 + threshold:
+                    change = 'slower'
+                elif ratio < 1 - threshold:
+                    change = 'faster'
+            rows.append({'dataset': result['dataset'], 'stage': name,
+                         'base_seconds': old['seconds'], 'new_seconds': stage['seconds'], 'ratio': round(ratio, 3),
+                         'base_peak_mb': old['peak_mb'], 'new_peak_mb': stage['peak_mb'], 'change': change})
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'dataset':<36} {'stage':<15} {'base s':>9} {'new s':>9} {'ratio':>7} {'base MB':>9} {'new MB':>9}")
+    for row in rows:
+        d = row['dataset']
+        dataset = f"{d['rows']}x{d['cols']} card={d['cardinality']} nulls={d['nulls']}"
+        print(f"{dataset:<36} {row['stage']:<15} {row['base_seconds']:>9.4f} {row['new_seconds']:>9.4f} "
+              f"{row['ratio']:>7.2f} {row['base_peak_mb']:>9.2f} {row['new_peak_mb']:>9.2f} {row['change']}")
+
+
+
+# Cold Start  ***************************************************************************
+# run in a new interpreter: start the server, ask the home page, then import the analysis stack
+_cold_start_code = '''
+import json
+import main
+from startup import since_start, startup_times, load_stack
+main.app.test_client().get('/')
+home = since_start()
+load_stack()
+print(json.dumps(dict(startup_times(), home_page_seconds=home)))
+'''
+
+
+def cold_start(repeat=5):
+    '''
+    1. function takes the number of new processes to start
+    2. in each one (no preload, no warm datasets): import the server, serve the home page, import the analysis stack
+    3. return the median seconds of each step from the start of the process:
+       server_ready, home_page (what a restart / new instance waits before serving), stack_ready (first analysis)
+       and process (the whole run, with the interpreter exit)
+    '''
+    env = dict(os.environ, AUTO_ANALYSIS_PRELOAD='0', AUTO_ANALYSIS_WARM_POOL='0', AUTO_ANALYSIS_WARM_DATASETS='',
+               AUTO_ANALYSIS_LOG_LEVEL='WARNING', MPLBACKEND='Agg')
+    runs = []
+    for _ in range(repeat):
+        wall = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', _cold_start_code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), env=env).stdout
+        run = json.loads(out.strip().splitlines()[-1])
+        run['process_seconds'] = time.perf_counter() - wall
+        runs.append(run)
+        print(f'cold start: {run}', file=sys.stderr)
+
+    return {name: round(statistics.median(run[name] for run in runs), 3) for name in runs[0]}
+
+
+
+def _numbers(kind):
+    return lambda value: [kind(v) for v in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the analysis pipeline on synthetic datasets')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='time the stages, write the results as json')
+    run.add_argument('--rows', type=_numbers(int), default=[1_000, 20_000], help='comma separated (default 1000,20000)')
+    run.add_argument('--cols', type=_numbers(int), default=[8], help='comma separated (default 8)')
+    run.add_argument('--cardinality', type=_numbers(int), default=[5, 50], help='classes of the categorical columns (default 5,50)')
+    run.add_argument('--nulls', type=_numbers(float), default=[0.1], help='ratio of nulls (default 0.1)')
+    run.add_argument('--stages', type=lambda value: value.split(','), default=None,
+                     help=f"comma separated (default all: {','.join(stage_names)})")
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--workers', type=int, default=1, help='render processes of all_in_one / load_dataset (default 1)')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--out', default=None, help='json file (default bench_results/<commit>.json)')
+
+    cmp = commands.add_parser('compare', help='compare two results, exit 1 if a stage is slower')
+    cmp.add_argument('base')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=0.1, help='relative change reported (default 0.1)')
+
+    cold = commands.add_parser('cold-start', help='time to start the server in new processes')
+    cold.add_argument('--repeat', type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == 'cold-start':
+        print(json.dumps({'meta': {'commit': _commit(), 'python': platform.python_version(), 'repeat': args.repeat},
+                          'cold_start': cold_start(args.repeat)}, indent=2))
+
+    elif args.command == 'run':
+        unknown = set(args.stages or []) - set(stage_names)
+        if unknown:
+            parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+        os.environ['AUTO_ANALYSIS_WORKERS'] = str(args.workers) # the web path reads it from the environment
+        result = run_benchmarks(args.rows, args.cols, args.cardinality, args.nulls, args.stages,
+                                args.repeat, args.workers, args.seed)
+
+        out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_results',
+                                       f"{(result['meta']['commit'] or 'local')[:10]}.json") # ignored by git
+        os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(out)
+
+    else:
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.new, encoding='utf-8') as f:
+            new = json.load(f)
+
+        rows = compare(base, new, args.threshold)
+        print_comparison(rows)
+        sys.exit(1 if any(row['change'] == 'slower' for row in rows) else 0)
@@ -0,0 +1,79 @@
+from sketches import stats_settings, use_sketches, approx_nunique, hll_error, hll_new
+from type_inference import infer_types, type_settings
+
+
+
+# ************************************************************************************
+# ***************************    Column Profile    ***********************************
+# ************************************************************************************
+
+# dtypes handled as numbers by the preprocessing and the plots
+numerical_column = ['int64', 'float64', 'int32', 'int16', 'int8', 'float32', 'uint8', 'uint16', 'uint32', 'uint64', 'bool']
+
+
+def _kinds(df):
+  # 'bool' | 'numeric' | 'object' for each column, from the dtypes only
+  return df.dtypes.map(lambda t: 'bool' if t == bool else 'numeric' if t in numerical_column else 'object')
+
+
+def _nunique(df, error):
+  # exact cardinality, or HyperLogLog estimate when `error` is given
+  return approx_nunique(df, error) if error else df.nunique()
+
+
+def profile_columns(df, sample=None, stats=None):
+  '''
+  1. function takes data frame (and the stats settings, default from the environment)
+  2. compute for all columns at once: number of nulls, number of unique values, kind of dtype
+     (the number of unique values is estimated with a sketch if the stats backend is 'sketch')
+  3. infer the values types of the object columns from a random sample of `sample` values (default from the environment)
+  4. return the profile as a data frame (one row for each column, number of rows in attrs['rows'])
+  '''
+  stats = stats or stats_settings()
+  sample = sample or type_settings()['sample']
+  error = hll_error(hll_new(stats['distinct_error'])) if use_sketches(stats) else 0
+
+  profile = df.isna().sum().to_frame('nulls') # nulls of each column
+  profile['nunique'] = _nunique(df, error)    # cardinality of each column
+  profile['kind'] = _kinds(df)
+
+  obj_col = list(profile.index[profile['kind'] == 'object'])
+  profile['value_type'] = None
+  profile['value_type'] = profile['value_type'].astype(object)
+  for col, t in infer_types(df, obj_col, sample).items():
+    profile.at[col, 'value_type'] = t
+
+  profile.attrs['rows'] = len(df)
+  profile.attrs['sample'] = sample
+  profile.attrs['nunique_error'] = error # relative error of `nunique` (0 = exact)
+
+  return profile
+
+
+# keep the profile in sync with the data frame ********************************
+def refresh_profile(profile, df, cols, fields=('nulls', 'nunique', 'kind')):
+  '''
+  1. function takes the profile, the data frame and the columns changed since the profile was computed
+  2. drop the columns removed from the data frame
+  3. recompute `fields` only for the changed columns (in place)
+     (a streamed profile keeps the counts of the whole file, only the kinds are recomputed)
+  '''
+  if profile.attrs.get('streamed'):
+    fields = [field for field in fields if field == 'kind']
+
+  removed = [col for col in profile.index if col not in df.columns]
+  if removed:
+    profile.drop(index=removed, inplace=True)
+
+  cols = [col for col in cols if col in df.columns]
+  if not cols:
+    return profile
+
+  if 'nulls' in fields:
+    profile.loc[cols, 'nulls'] = df[cols].isna().sum()
+  if 'nunique' in fields:
+    profile.loc[cols, 'nunique'] = _nunique(df[cols], profile.attrs.get('nunique_error', 0))
+  if 'kind' in fields:
+    profile.loc[cols, 'kind'] = _kinds(df[cols])
+
+  return profile
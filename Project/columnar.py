@@ -0,0 +1,137 @@
+import os
+
+try: # optional, only for the columnar uploads
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  import pyarrow.feather as feather
+except ImportError:
+  pa = None
+
+
+
+# ************************************************************************************
+# ***************************    Columnar Files    ***********************************
+# ************************************************************************************
+
+# Parquet / Feather / Arrow IPC uploads are read with pyarrow:
+#   - the upload is saved in a temp file and memory mapped (no copy of the file in memory)
+#   - only the columns the analysis can use are read (column projection):
+#     nested / binary columns are skipped, and for Parquet the columns with more than
+#     50% nulls (from the row groups statistics, they would be dropped by the cleaning)
+
+# file extention -> format
+columnar_formats = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'ipc', '.arrows': 'ipc', '.ipc': 'ipc'}
+
+
+def columnar_format(filename):
+  '''format of the uploaded file from its extention, None if it is not a columnar file'''
+  return columnar_formats.get(os.path.splitext(filename)[1].lower())
+
+
+def _usable(field):
+  # columns the analysis can handle (numbers, strings, booleans, dates, categories)
+  t = field.type
+  return not (pa.types.is_nested(t) or pa.types.is_binary(t) or pa.types.is_large_binary(t)
+              or pa.types.is_fixed_size_binary(t))
+
+
+def _null_ratios(metadata):
+  # nulls / rows of each column from the Parquet row groups statistics (columns without statistics are missing)
+  if not metadata.num_rows:
+    return {}
+
+  nulls = {}
+  for i in range(metadata.num_columns):
+    name = metadata.schema.column(i).path
+    counts = [metadata.row_group(rg).column(i).statistics for rg in range(metadata.num_row_groups)]
+    if all(stats is not None and stats.has_null_count for stats in counts):
+      nulls[name] = sum(stats.null_count for stats in counts) / metadata.num_rows
+  return nulls
+
+
+def project_columns(schema, null_ratios=None, max_nulls=0.5):
+  '''
+  1. function takes the arrow schema of the file (and the null ratio of the columns if known)
+  2. return the names of the columns to read
+  '''
+  null_ratios = null_ratios or {}
+  return [field.name for field in schema if _usable(field) and null_ratios.get(field.name, 0) <= max_nulls]
+
+
+def usable_columns(path, fmt):
+  '''names of the columns of a Parquet / Arrow IPC file the analysis reads (from its schema, nothing else is read)'''
+  if pa is None:
+    raise ImportError('pyarrow is needed to read Parquet / Feather / Arrow files')
+
+  if fmt == 'parquet':
+    parquet = pq.ParquetFile(path, memory_map=True)
+    return project_columns(parquet.schema_arrow, _null_ratios(parquet.metadata))
+
+  source = pa.memory_map(path)
+  try:
+    schema = pa.ipc.open_file(source).schema
+  except pa.ArrowInvalid:
+    if fmt == 'feather': # Feather v1
+      return project_columns(feather.read_table(path, memory_map=True).schema)
+    source.seek(0)
+    schema = pa.ipc.open_stream(source).schema
+  return project_columns(schema)
+
+
+def ipc_file(path):
+  '''True if the file is in the Arrow IPC file format (Feather v2), False for Feather v1 / the IPC stream format'''
+  try:
+    pa.ipc.open_file(pa.memory_map(path))
+  except pa.ArrowInvalid:
+    return False
+  return True
+
+
+# Read  *********************************************************************************
+def read_table(path, fmt):
+  '''arrow table of the usable columns of a Parquet / Feather / Arrow IPC file (memory mapped)'''
+  if fmt == 'parquet':
+    parquet = pq.ParquetFile(path, memory_map=True)
+    columns = project_columns(parquet.schema_arrow, _null_ratios(parquet.metadata))
+    return parquet.read(columns=columns)
+
+  source = pa.memory_map(path)
+  try:
+    reader = pa.ipc.open_file(source) # Feather v2 is the Arrow IPC file format
+  except pa.ArrowInvalid:
+    if fmt == 'feather': # Feather v1
+      return feather.read_table(path, memory_map=True)
+    source.seek(0)
+    reader = pa.ipc.open_stream(source) # Arrow IPC stream format
+
+  table = reader.read_all() # zero copy, the buffers point into the mapped file
+  return table.select(project_columns(table.schema))
+
+
+def read_columnar(path, fmt):
+  '''
+  1. function takes the path of a Parquet / Feather / Arrow IPC file and its format
+  2. memory map the file and read the usable columns only
+  3. return the data frame (strings as objects, as `pd.read_csv` gives them)
+  '''
+  if pa is None:
+    raise ImportError('pyarrow is needed to read Parquet / Feather / Arrow files')
+
+  table = read_table(path, fmt)
+  return table.to_pandas(split_blocks=True, self_destruct=True) # free each arrow column once converted
+
+
+def load_columnar(path, fmt):
+  '''
+  1. function takes the path of a columnar file (removed at the end) and its format
+  2. return the data frame (input of an analysis job)
+  '''
+  try:
+    df = read_columnar(path, fmt)
+  finally:
+    try:
+      os.remove(path)
+    except OSError: # still mapped (windows)
+      pass
+
+  return {'df': df}
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+try: # optional, only for the Arrow strings
+  import pyarrow
+except ImportError:
+  pyarrow = None
+
+
+
+# ************************************************************************************
+# ***************************    Compaction    ***************************************
+# ************************************************************************************
+
+# after the cleaning, the data frame is made smaller before the plots:
+#   strings of the categorical columns -> 'category' (classes in order of first appearance, as the plots draw them)
+#   integers                           -> the smallest integer type holding them
+#   floats                             -> float32 when no value changes
+#   other strings (optional)           -> Arrow strings (AUTO_ANALYSIS_ARROW_STRINGS=1, needs pyarrow)
+
+def compact_settings():
+  return {'arrow_strings': os.environ.get('AUTO_ANALYSIS_ARROW_STRINGS', '0') == '1'}
+
+
+def memory_mb(df):
+  '''memory of the data frame in MB (strings included)'''
+  return df.memory_usage(deep=True).sum() / 2**20
+
+
+def _compact_column(s, categorical, arrow):
+  # smaller version of the column (the column itself if it can't be smaller)
+  if s.dtype == object:
+    if categorical:
+      return s.astype(pd.CategoricalDtype(pd.unique(s.dropna())))
+    if arrow:
+      return s.astype('string[pyarrow]')
+    return s
+
+  if pd.api.types.is_integer_dtype(s):
+    return pd.to_numeric(s, downcast='integer')
+
+  if pd.api.types.is_float_dtype(s) and s.dtype != np.float32:
+    small = s.astype(np.float32)
+    if np.array_equal(small.to_numpy(dtype=np.float64), s.to_numpy(), equal_nan=True): # no value changed
+      return small
+
+  return s
+
+
+def compact_frame(df, cat_list, settings=None):
+  '''
+  1. function takes the cleaned data frame and the categorical columns (from `split_type`)
+  2. convert each column to a smaller dtype (in place)
+  3. return the data frame and a report of the memory before / after (MB) and the changed columns
+  '''
+  settings = settings or compact_settings()
+  arrow = settings['arrow_strings'] and pyarrow is not None
+
+  before = memory_mb(df)
+  changed = {}
+  for col in df:
+    small = _compact_column(df[col], col in cat_list, arrow)
+    if small.dtype != df[col].dtype:
+      changed[col] = f'{df[col].dtype} -> {small.dtype}'
+      df[col] = small
+
+  report = {'before_mb': round(before, 2), 'after_mb': round(memory_mb(df), 2), 'columns': changed}
+  return df, report
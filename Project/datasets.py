@@ -0,0 +1,152 @@
+import os
+import sys
+import argparse
+import threading
+import importlib.util
+
+from instrument import log
+
+# optional, the local copies are Parquet files if pyarrow is installed (pickle otherwise),
+# only looked up: pandas imports it when it reads / writes them
+pyarrow = importlib.util.find_spec('pyarrow')
+
+
+
+# ************************************************************************************
+# ***************************    Built-In Datasets    ********************************
+# ************************************************************************************
+
+# the built-in (seaborn) datasets are kept in a local directory:
+#   <dataset dir>/seaborn/<name>.csv        raw files downloaded by seaborn (prefetch)
+#   <dataset dir>/<name>.parquet | .pkl     data frame ready to use (columnar, dtypes kept)
+# so they are downloaded at most once, and work offline once prefetched:
+#   python datasets.py prefetch [names ...]
+# the server can also keep them in memory with their profile and tables (warm up),
+# then an analysis of a built-in dataset starts without reading anything.
+# pandas / seaborn are imported when a dataset is read, the server can list the names without them.
+
+# Dataset names
+dataset_names = ["titanic", "tips", "penguins",  "taxis", "dots", "exercise", "geyser", "glue", "iris", "mpg", ]
+
+_warm = {}                # name -> {'df', 'profile', 'tables'} kept in memory
+_lock = threading.Lock()
+
+
+def dataset_dir():
+    return os.environ.get('AUTO_ANALYSIS_DATASET_DIR',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datasets'))
+
+
+def _local_path(name):
+    return os.path.join(dataset_dir(), f"{name}.{'parquet' if pyarrow else 'pkl'}")
+
+
+def _read_local(name):
+    import pandas as pd
+
+    path = _local_path(name)
+    if not os.path.exists(path):
+        return None
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def _save_local(name, df):
+    os.makedirs(dataset_dir(), exist_ok=True)
+    path = _local_path(name)
+    tmp = f'{path}.tmp'
+    if path.endswith('.parquet'):
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_pickle(tmp)
+    os.replace(tmp, path) # never a half written file
+
+
+# read a dataset *************************************************************
+def load_builtin(name):
+    '''
+    1. function takes the name of a built-in dataset
+    2. read its local copy, or load it with seaborn (raw file kept in the dataset dir) and save the local copy
+    3. return the data frame
+    '''
+    df = _read_local(name)
+    if df is None:
+        import seaborn as sns
+        df = sns.load_dataset(name, data_home=os.path.join(dataset_dir(), 'seaborn'))
+        _save_local(name, df)
+    return df
+
+
+def builtin_dataset(name):
+    '''
+    1. function takes the name of a built-in dataset
+    2. return the input of an analysis job: a copy of the warm data frame with its profile and tables,
+       or the data frame read from the local copy
+    '''
+    with _lock:
+        warm = _warm.get(name)
+
+    if warm: # the job changes the data frame and the profile, give it copies
+        return {'df': warm['df'].copy(), 'profile': warm['profile'].copy(), 'tables': warm['tables']}
+
+    return {'df': load_builtin(name)}
+
+
+# prefetch / warm up ***********************************************************
+def prefetch(names=None):
+    '''save the local copy of each dataset (download it if needed), return the names that failed'''
+    failed = []
+    for name in names or dataset_names:
+        try:
+            load_builtin(name)
+        except Exception as e:
+            print(f'{name}: {type(e).__name__}: {e}', file=sys.stderr)
+            failed.append(name)
+    return failed
+
+
+def warm_names():
+    '''datasets to keep in memory (AUTO_ANALYSIS_WARM_DATASETS = 'all' or comma separated names, empty = none)'''
+    value = os.environ.get('AUTO_ANALYSIS_WARM_DATASETS', '').strip()
+    if value == 'all':
+        return list(dataset_names)
+    return [name.strip() for name in value.split(',') if name.strip() in dataset_names]
+
+
+def warm_up(names=None):
+    '''
+    1. function takes the names of the datasets (default from the environment)
+    2. read each dataset, compute its profile and summary tables (once)
+    3. keep them in memory for the next analyses
+    '''
+    from autoAnalysis import summary_tables
+    from column_profile import profile_columns
+
+    for name in warm_names() if names is None else names:
+        try:
+            df = load_builtin(name)
+            warm = {'df': df, 'profile': profile_columns(df), 'tables': summary_tables(df)}
+        except Exception as e: # missing offline, the dataset is loaded by its job as usual
+            log.warning('warm up %s: %s: %s', name, type(e).__name__, e)
+            continue
+        with _lock:
+            _warm[name] = warm
+
+
+def start_warm_up():
+    '''warm up the datasets of the environment in a background thread (the server starts right away)'''
+    names = warm_names()
+    if names:
+        threading.Thread(target=warm_up, args=(names,), name='warm-up', daemon=True).start()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local copies of the built-in datasets')
+    parser.add_argument('command', choices=['prefetch'])
+    parser.add_argument('names', nargs='*', help='datasets to prefetch (default all)')
+    args = parser.parse_args()
+
+    failed = prefetch(args.names)
+    sys.exit(1 if failed else 0)
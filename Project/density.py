@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from group_summary import group_codes
+
+
+
+# ************************************************************************************
+# ***************************    Density    ******************************************
+# ************************************************************************************
+
+# the KDE curves (the line of the histograms, the violins) are gaussian kernel densities with Scott's
+# bandwidth (as seaborn), computed on binned values instead of summing a kernel for each row:
+#   - the values are counted once in AUTO_ANALYSIS_KDE_GRID equal bins over the support of each curve
+#     (one `bincount` for all the groups of a column), the histogram is the sum of its sub-bins
+#   - the counts are convolved with the gaussian kernel by FFT (zero padded, all the groups at once)
+# after the counting the cost depends on the number of bins, not on the number of rows.
+
+def kde_settings():
+  return {'grid': int(os.environ.get('AUTO_ANALYSIS_KDE_GRID', 1024))}
+
+
+def scott_bandwidth(count, std):
+  '''bandwidth of the kernel: Scott's rule (std * n ** -1/5, as seaborn / scipy `gaussian_kde`)'''
+  return std * np.power(count, -0.2)
+
+
+def _smooth(counts, width):
+  # convolve each row of counts with a gaussian of `width` bins (its bandwidth / bin size) by FFT,
+  # the rows padded with zeros so the kernel does not wrap around
+  m = counts.shape[1]
+  size = 1 << int(np.ceil(np.log2(2 * m)))
+  lag = np.minimum(np.arange(size), size - np.arange(size))
+  kernel = np.exp(-0.5 * (lag / np.maximum(width, 1e-3)[:, None]) ** 2)
+  kernel /= kernel.sum(axis=1, keepdims=True)
+  smoothed = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel), size)[:, :m]
+  return np.maximum(smoothed, 0) # rounding of the FFT around 0
+
+
+def binned_kde(counts, lo, step, std, scale=1):
+  '''
+  1. function takes counts of values in equal bins (the first from `lo`, `step` wide), the std of the values
+     (and the scale of the curve, 1: values per bin)
+  2. smooth the counts with the gaussian kernel of Scott's bandwidth
+  3. return the x (bin centers) and y of the KDE curve, empty if the values are all equal
+  '''
+  if not std > 0:
+    return np.array([]), np.array([])
+  width = scott_bandwidth(counts.sum(), std) / step
+  x = lo + (np.arange(len(counts)) + 0.5) * step
+  return x, _smooth(counts[None].astype('float64'), np.array([width]))[0] * scale
+
+
+def hist_kde(values, bins, grid=None):
+  '''
+  1. function takes the values of a column (no nulls), the number of bins of its histogram (and the KDE bins)
+  2. count the values once in sub-bins of the histogram bins (equal bins over min / max, as np.histogram)
+  3. return dict of the histogram {'edges', 'counts'} and of its KDE curve {'x', 'y'} over the same range,
+     scaled to the counts (density * count * bin width, as seaborn histplot); no curve if the values are all equal
+  '''
+  grid = grid or kde_settings()['grid']
+  if values.size == 0:
+    return {'edges': np.linspace(0, 1, bins + 1), 'counts': np.zeros(bins), 'x': np.array([]), 'y': np.array([])}
+
+  lo, hi = values.min(), values.max()
+  if lo == hi:
+    lo, hi = lo - 0.5, hi + 0.5
+  split = -(-grid // bins) # sub-bins of each histogram bin
+  step = (hi - lo) / (bins * split)
+  fine = np.bincount(np.clip(((values - lo) / step).astype(np.int64), 0, bins * split - 1), minlength=bins * split)
+
+  x, y = binned_kde(fine, lo, step, values.std(ddof=1) if values.size > 1 else 0, scale=split)
+  return {'edges': np.linspace(lo, hi, bins + 1), 'counts': fine.reshape(bins, split).sum(axis=1), 'x': x, 'y': y}
+
+
+def group_kde(df, by, col, cut=2, grid=None):
+  '''
+  1. function takes data frame, the group columns (x [, hue]), the continuous column (and the cut, the KDE bins)
+  2. count the values of all groups in one `bincount`, `grid` bins for each group over its own support
+     (its min / max extended by cut * bandwidth, as seaborn violinplot)
+  3. smooth the counts of all groups at once
+  4. return dict of {group: (support, density)} (the density integrates to 1, a single value / all values
+     equal: the value with the density [1.]), the groups without values are left out
+  '''
+  grid = grid or kde_settings()['grid']
+  by = [c for c in by if c is not None]
+  codes, index = group_codes(df, by)
+  values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+  valid = (codes >= 0) & ~np.isnan(values)
+  codes, values = codes[valid], values[valid]
+
+  stats = pd.Series(values).groupby(codes).agg(['count', 'min', 'max', 'std']).reindex(range(len(index)))
+  count, low, high, std = (stats[name].fillna(0).to_numpy() for name in ('count', 'min', 'max', 'std'))
+  curves = {index[g]: (np.array([low[g]]), np.array([1.])) for g in np.flatnonzero((count > 0) & ~(std > 0))}
+
+  smooth = np.flatnonzero(std > 0)
+  if smooth.size:
+    bandwidth = scott_bandwidth(count[smooth], std[smooth])
+    lo, hi = low[smooth] - cut * bandwidth, high[smooth] + cut * bandwidth
+    step = (hi - lo) / grid
+
+    rank = np.full(len(index), -1)
+    rank[smooth] = np.arange(smooth.size)
+    keep = rank[codes] >= 0
+    row = rank[codes[keep]]
+    cell = np.clip(((values[keep] - lo[row]) / step[row]).astype(np.int64), 0, grid - 1)
+    counts = np.bincount(row * grid + cell, minlength=smooth.size * grid).reshape(smooth.size, grid)
+
+    density = _smooth(counts.astype('float64'), bandwidth / step) / (count[smooth] * step)[:, None]
+    support = lo[:, None] + (np.arange(grid) + 0.5) * step[:, None]
+    curves.update({index[g]: (support[i], density[i]) for i, g in enumerate(smooth)})
+
+  return curves
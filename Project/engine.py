@@ -0,0 +1,341 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from column_profile import profile_columns
+from type_inference import missing_str
+from streaming import file_info
+from columnar import usable_columns, ipc_file, read_table
+from instrument import log
+
+try: # optional, only for AUTO_ANALYSIS_ENGINE=duckdb
+  import duckdb
+except ImportError:
+  duckdb = None
+
+try: # optional, only for AUTO_ANALYSIS_ENGINE=polars
+  import polars as pl
+except ImportError:
+  pl = None
+
+
+
+# ************************************************************************************
+# ***************************    Data Engines    *************************************
+# ************************************************************************************
+
+# the uploads saved in a file (big csv files, Parquet / Feather / Arrow files) can be reduced by an embedded
+# multi-threaded engine instead of pandas (AUTO_ANALYSIS_ENGINE=duckdb | polars, default pandas):
+#   - the engine scans the file out of core with all the cores (AUTO_ANALYSIS_ENGINE_THREADS for duckdb,
+#     POLARS_MAX_THREADS for polars) and computes the stats of every column in one query:
+#     nulls (the noise strings are nulls), exact distinct count, count / mean / std / min / quartiles / max
+#     of the numbers (the text columns coerced to numbers, as `pd.to_numeric` in `clean_data`), and the most
+#     common value of the text / bool / date columns (mode fill, top / freq; ties: the smallest value)
+#   - only these stats, the first rows and a random sample of AUTO_ANALYSIS_SAMPLE_ROWS rows (the same rows for
+#     both engines) come back to pandas: the profile has the nulls, cardinality and fill values of the whole
+#     file (as a streamed one, see streaming), `check_nulls`, `clean_data` and `split_type` run on the sample
+#     with them, the describe tables are the ones of the whole file
+# an engine that is not installed falls back to pandas (the chunked streaming / columnar reads).
+
+engines = ['duckdb', 'polars']
+stat_names = ['rows', 'count', 'nunique', 'n', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+_warned = set() # engines asked but not installed, warned once
+
+
+def engine_settings():
+  return {'engine': os.environ.get('AUTO_ANALYSIS_ENGINE', 'pandas'),
+          'threads': int(os.environ.get('AUTO_ANALYSIS_ENGINE_THREADS', 0))}
+
+
+def active_engine(settings=None):
+  '''name of the engine reducing the saved uploads, 'pandas' if none is asked or it is not installed'''
+  name = (settings or engine_settings())['engine']
+  if name not in engines:
+    return 'pandas'
+  if (duckdb if name == 'duckdb' else pl) is None:
+    if name not in _warned:
+      _warned.add(name)
+      log.warning('AUTO_ANALYSIS_ENGINE=%s but %s is not installed, the uploads are read with pandas', name, name)
+    return 'pandas'
+  return name
+
+
+def _kind(numeric, boolean, text):
+  # how the column is reduced: 'number' | 'bool' | 'text' (noise strings, coerced numbers) | 'other' (dates ...)
+  return 'bool' if boolean else 'number' if numeric else 'text' if text else 'other'
+
+
+# DuckDB  *******************************************************************************
+def _quote(name):
+  return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(value):
+  return "'" + str(value).replace("'", "''") + "'"
+
+
+def _duckdb_source(con, path, fmt):
+  # sql of the rows of the file (dates of a csv kept as text, as `pd.read_csv` reads them)
+  if fmt == 'csv':
+    source = f'read_csv_auto({_literal(path)})'
+    dates = [name for name, dtype, *_ in con.execute(f'DESCRIBE SELECT * FROM {source}').fetchall()
+             if dtype.startswith(('DATE', 'TIME'))]
+    replace = f" REPLACE ({', '.join(f'CAST({_quote(c)} AS VARCHAR) AS {_quote(c)}' for c in dates)})" if dates else ''
+    return f'SELECT *{replace} FROM {source}'
+
+  columns = ', '.join(_quote(c) for c in usable_columns(path, fmt))
+  if fmt == 'parquet':
+    return f'SELECT {columns} FROM read_parquet({_literal(path)})'
+  import pyarrow.dataset as ds # Feather v2 / Arrow IPC, scanned by duckdb from the memory mapped file
+  con.register('ipc_file', ds.dataset(path, format='ipc') if ipc_file(path) else read_table(path, fmt)) # Feather v1 / stream
+  return f'SELECT {columns} FROM ipc_file'
+
+
+def _duckdb_values(name, dtype):
+  # sql of the values (noise strings / NaN as nulls) and of the numbers of a column, and its kind
+  q = _quote(name)
+  numeric = dtype in ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT', 'UINTEGER',
+                      'UBIGINT', 'FLOAT', 'DOUBLE') or dtype.startswith('DECIMAL')
+  kind = _kind(numeric, dtype == 'BOOLEAN', dtype == 'VARCHAR')
+
+  if kind == 'text':
+    values = f"CASE WHEN {q} IN ({', '.join(_literal(s) for s in missing_str)}) THEN NULL ELSE {q} END"
+    numbers = f'TRY_CAST({values} AS DOUBLE)'
+  elif kind == 'number':
+    values = f'CASE WHEN isnan({q}) THEN NULL ELSE {q} END' if dtype in ('FLOAT', 'DOUBLE') else q
+    numbers = f'CAST({values} AS DOUBLE)'
+  else:
+    values, numbers = q, f'CAST({q} AS INTEGER)' if kind == 'bool' else None
+
+  if numbers:
+    numbers = f'CASE WHEN isfinite({numbers}) THEN {numbers} END'
+  return values, numbers, kind
+
+
+def _duckdb_top(values, names):
+  # aggregate of the most common value and its count (the counts of `histogram` sorted by -count, value),
+  # the loop variable named unlike the columns (a column of the same name would be taken instead)
+  taken = {str(name).lower() for name in names}
+  e = next(f'entry{i}' for i in range(len(taken) + 1) if f'entry{i}' not in taken)
+  return (f"list_sort([{{'freq': -CAST({e}.value AS BIGINT), 'value': {e}.key}} "
+          f"for {e} in map_entries(histogram({values}))])[1]")
+
+
+def _duckdb_scan(path, fmt, sample_size, seed, threads):
+  con = duckdb.connect(config={'threads': threads} if threads else {})
+  try:
+    con.execute(f'CREATE TEMP VIEW data AS {_duckdb_source(con, path, fmt)}')
+    columns = {name: _duckdb_values(name, dtype) for name, dtype, *_ in con.execute('DESCRIBE data').fetchall()}
+
+    # stats of all columns in one scan
+    select, fields = ['count(*)'], []
+    for name, (values, numbers, kind) in columns.items():
+      select += [f'count({values})', f'count(DISTINCT {values})']
+      fields += [(name, 'count'), (name, 'nunique')]
+      if numbers:
+        select += [f'count({numbers})', f'avg({numbers})', f'stddev_samp({numbers})', f'min({numbers})',
+                   f'quantile_cont({numbers}, [0.25, 0.5, 0.75])', f'max({numbers})']
+        fields += [(name, 'n'), (name, 'mean'), (name, 'std'), (name, 'min'), (name, 'quartiles'), (name, 'max')]
+      if kind != 'number':
+        select.append(_duckdb_top(values, columns))
+        fields.append((name, 'top'))
+    row = con.execute(f"SELECT {', '.join(select)} FROM data").fetchone()
+    stats = _stats_table(columns, row[0], zip(fields, row[1:]))
+
+    head = con.execute('SELECT * FROM data LIMIT 5').df()
+    rows = _sample_rows(stats.attrs['rows'], sample_size, seed)
+    # the row numbers are the ones of the file only if it is read by one thread (no order in a parallel scan)
+    con.execute('SET threads = 1')
+    sample = con.execute('SELECT * EXCLUDE (sample_row) FROM (SELECT *, row_number() OVER () - 1 AS sample_row FROM data) '
+                         'WHERE sample_row IN (SELECT unnest(?)) ORDER BY sample_row', [rows.tolist()]).df()
+  finally:
+    con.close()
+  return _as_read(head), _as_read(sample), stats
+
+
+# Polars  *******************************************************************************
+def _polars_source(path, fmt):
+  if fmt == 'csv':
+    return pl.scan_csv(path, infer_schema_length=10_000)
+  columns = usable_columns(path, fmt)
+  if fmt != 'parquet' and not ipc_file(path): # Feather v1 / Arrow IPC stream, read by pyarrow
+    return pl.from_arrow(read_table(path, fmt)).lazy()
+  return (pl.scan_parquet(path) if fmt == 'parquet' else pl.scan_ipc(path)).select(columns)
+
+
+def _polars_values(name, dtype):
+  # expressions of the values (noise strings / NaN as nulls) and of the numbers of a column, and its kind
+  c = pl.col(name)
+  kind = _kind(dtype.is_numeric(), dtype == pl.Boolean, dtype == pl.String)
+
+  if kind == 'text':
+    values = pl.when(c.is_in(missing_str)).then(None).otherwise(c)
+    numbers = values.cast(pl.Float64, strict=False)
+  elif kind == 'number':
+    values = pl.when(c.is_nan()).then(None).otherwise(c) if dtype.is_float() else c
+    numbers = values.cast(pl.Float64)
+  else:
+    values, numbers = c, c.cast(pl.Float64) if kind == 'bool' else None
+
+  if numbers is not None:
+    numbers = pl.when(numbers.is_finite()).then(numbers)
+  return values, numbers, kind
+
+
+def _polars_top(values):
+  # aggregate of the most common value and its count (the value counts sorted by -count, value)
+  counts = values.alias('value').drop_nulls().value_counts(name='freq')
+  return counts.sort_by([counts.struct.field('freq'), counts.struct.field('value')], descending=[True, False]).first()
+
+
+def _polars_scan(path, fmt, sample_size, seed):
+  data = _polars_source(path, fmt)
+  columns = {name: _polars_values(name, dtype) for name, dtype in data.collect_schema().items()}
+
+  # stats of all columns in one scan (streaming engine: the file is not loaded in memory)
+  select, fields = [pl.len()], []
+  for name, (values, numbers, kind) in columns.items():
+    select += [values.count(), values.drop_nulls().n_unique()]
+    fields += [(name, 'count'), (name, 'nunique')]
+    if numbers is not None:
+      select += [numbers.count(), numbers.mean(), numbers.std(), numbers.min(),
+                 pl.concat_list([numbers.quantile(q, interpolation='linear') for q in (0.25, 0.5, 0.75)]), numbers.max()]
+      fields += [(name, 'n'), (name, 'mean'), (name, 'std'), (name, 'min'), (name, 'quartiles'), (name, 'max')]
+    if kind != 'number':
+      select.append(_polars_top(values))
+      fields.append((name, 'top'))
+  row = data.select([expr.alias(str(i)) for i, expr in enumerate(select)]).collect(engine='streaming').row(0)
+  stats = _stats_table(columns, row[0], zip(fields, row[1:]))
+
+  head = data.head(5).collect().to_pandas()
+  rows = _sample_rows(stats.attrs['rows'], sample_size, seed)
+  sample = (data.with_row_index('sample_row').filter(pl.col('sample_row').is_in(rows.tolist()))
+            .drop('sample_row').collect(engine='streaming').to_pandas())
+  return _as_read(head), _as_read(sample), stats
+
+
+# Reduced Results  **********************************************************************
+def _sample_rows(rows, size, seed):
+  # rows of the sample (all of them for a small file), in the order of the file
+  if rows <= size:
+    return np.arange(rows)
+  return np.sort(np.random.default_rng(seed).choice(rows, size, replace=False))
+
+
+def _stats_table(columns, rows, fields):
+  # one row of stats for each column (the quartiles of the query split in 25% / 50% / 75%,
+  # the most common value {'value', 'freq'} (duckdb: -freq) in top / freq)
+  stats = pd.DataFrame(index=pd.Index(list(columns), dtype=object), columns=stat_names[1:] + ['top', 'freq'], dtype=object)
+  stats['kind'] = [column[2] for column in columns.values()]
+  stats['n'] = 0
+  for (name, field), value in fields:
+    if field == 'quartiles':
+      stats.loc[name, ['25%', '50%', '75%']] = list(value) if value is not None else [np.nan] * 3
+    elif field == 'top':
+      stats.at[name, 'top'], stats.at[name, 'freq'] = (value['value'], abs(value['freq'])) if value else (None, 0)
+    else:
+      stats.at[name, field] = value
+  stats.attrs['rows'] = int(rows)
+  return stats
+
+
+def _as_read(df):
+  # dtypes as `pd.read_csv` gives them: nullable booleans as objects, nullable numbers as floats
+  for col in df:
+    dtype = df[col].dtype
+    if isinstance(dtype, pd.BooleanDtype):
+      df[col] = df[col].astype(object).where(df[col].notna(), None)
+    elif pd.api.types.is_extension_array_dtype(dtype) and pd.api.types.is_numeric_dtype(dtype):
+      df[col] = df[col].to_numpy(dtype='float64', na_value=np.nan)
+  return df
+
+
+def engine_profile(sample, stats):
+  '''
+  1. function takes the sample and the stats of the whole file (`scan_file`)
+  2. build the column profile of the sample (value types)
+  3. replace its nulls / cardinality by the ones of the whole file, add the mean and mode fill values
+  4. return the profile (marked as `streamed`, its counts are not recomputed from the sample)
+  '''
+  profile = profile_columns(sample)
+  stats = stats.reindex(profile.index)
+  rows = stats.attrs['rows']
+
+  profile['nulls'] = (rows - stats['count'].astype('int64')).to_numpy()
+  profile['nunique'] = stats['nunique'].astype('int64').to_numpy()
+  profile['mean'] = stats['mean'].where(stats['n'] > 0).astype('float64').to_numpy()
+  profile['mode'] = pd.Series(stats['top'].to_numpy(), index=profile.index, dtype=object)
+
+  profile.attrs['rows'] = rows
+  profile.attrs['streamed'] = True
+  profile.attrs['nunique_error'] = 0 # the engines count the distinct values exactly
+  return profile
+
+
+def engine_tables(sample, head, stats, engine):
+  '''
+  1. function takes the sample, the first rows and the stats of the whole file, the engine name
+  2. create the same tables as `summary_tables`: head, info, numerical and object describe
+  3. return dict of the tables
+  '''
+  head_table = head.to_html(classes='table table-striped')
+  info_table = file_info(stats.attrs['rows'], stats['count'].astype('int64').to_dict(), sample.dtypes.to_dict(),
+                         len(sample), source=f'scanned by {engine}')
+
+  pd.set_option('display.float_format', lambda x: f'{x:.2f}')# set the float format for pandas outputs
+
+  # numerical describe (int / float columns)
+  numeric = [col for col in stats.index if stats.at[col, 'n'] and sample[col].dtype.kind in 'iuf']
+  des_n = None
+  if numeric:
+    des_n = stats.loc[numeric, ['n', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']].T.astype('float64')
+    des_n.index = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+    des_n = des_n.to_html(classes='table table-striped')
+
+  # object describe (all other columns)
+  other = [col for col in stats.index if col not in numeric and stats.at[col, 'kind'] != 'number']
+  des_c = None
+  if other:
+    des_c = stats.loc[other, ['count', 'nunique', 'top', 'freq']].T
+    des_c.index = ['count', 'unique', 'top', 'freq']
+    des_c = des_c.to_html(classes='table table-striped')
+
+  return {'head_table': head_table, 'info_table': info_table, 'des_n': des_n, 'des_c': des_c}
+
+
+# Scan an Uploaded File  ****************************************************************
+def scan_file(path, fmt, sample_size=10_000, seed=0, settings=None):
+  '''
+  1. function takes the path of a csv / Parquet / Feather / Arrow file, its format, the sample size and the engine settings
+  2. compute the stats of every column of the whole file with the engine
+  3. return the first rows, the sample (pandas data frames) and the stats (one row for each column)
+  '''
+  settings = settings or engine_settings()
+  engine = active_engine(settings)
+  if engine == 'duckdb':
+    return _duckdb_scan(path, fmt, sample_size, seed, settings['threads'])
+  if engine == 'polars':
+    return _polars_scan(path, fmt, sample_size, seed)
+  raise ImportError(f"the {settings['engine']} engine is not available")
+
+
+def load_engine(path, fmt, sample_size=10_000, seed=0, settings=None):
+  '''
+  1. function takes the path of a saved upload (removed at the end), its format ('csv', 'parquet', 'feather', 'ipc'),
+     the sample size and the engine settings
+  2. scan the file with the engine
+  3. return the sample, its tables and its column profile (input of an analysis job)
+  '''
+  settings = settings or engine_settings()
+  try:
+    head, sample, stats = scan_file(path, fmt, sample_size, seed, settings)
+  finally:
+    try:
+      os.remove(path)
+    except OSError: # still mapped (windows)
+      pass
+
+  return {'df': sample, 'tables': engine_tables(sample, head, stats, active_engine(settings)),
+          'profile': engine_profile(sample, stats)}
@@ -0,0 +1,197 @@
+import os
+import threading
+
+import numpy as np
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from instrument import rss_mb
+
+
+
+# ************************************************************************************
+# ***************************    Figure Pool    **************************************
+# ************************************************************************************
+
+# the figures are explicit Agg figures (not pyplot, so nothing is kept in the pyplot figure
+# manager), reused by the next column / subplot: they are cleared when they are released.
+# each process keeps at most AUTO_ANALYSIS_FIGURE_POOL free figures of each kind, the others are
+# freed with their last reference (a figure is never returned to the pool if drawing it failed).
+#   - grid: the gray 16x10 figure of a column, the pixels of its 9 subplots are pasted on it (see plot_plan)
+#   - panel: a small transparent figure with the axes of one subplot (the same inches as in the grid,
+#     the middle cell of the same 3x3 layout, the other cells are outside the figure) and a margin for
+#     its labels, title and legend. its axes starts at the same fraction of a pixel as the subplot of
+#     its cell in the grid (its phase), so the pixels are the ones the grid would draw there.
+#     the panel figures are kept for each phase.
+
+grid_size = (16, 10)                  # inches of the 3x3 figure
+grid_space = {'hspace': 0.5, 'wspace': 0.3}
+panel_margin = (1.5, 1.2)             # inches around the axes of a panel figure (left / right, bottom / top)
+
+_free = []
+_free_panels = {} # phase -> free panel figures
+_lock = threading.Lock() # the jobs of the web server render in several threads
+
+
+def pool_size():
+  '''max number of free figures kept by each process (AUTO_ANALYSIS_FIGURE_POOL, 0 = no reuse)'''
+  return int(os.environ.get('AUTO_ANALYSIS_FIGURE_POOL', 2))
+
+
+def new_figure(figsize=None):
+  '''Agg figure not managed by pyplot (freed as soon as it is not referenced)'''
+  fig = Figure(figsize=figsize)
+  FigureCanvasAgg(fig)
+  return fig
+
+
+# layout of the 3x3 figure  *************************************************************
+def _cell_size():
+  # inches of the axes of a subplot of the 3x3 figure
+  rc = mpl.rcParams
+  width = grid_size[0] * (rc['figure.subplot.right'] - rc['figure.subplot.left']) / (3 + 2 * grid_space['wspace'])
+  height = grid_size[1] * (rc['figure.subplot.top'] - rc['figure.subplot.bottom']) / (3 + 2 * grid_space['hspace'])
+  return width, height
+
+
+def cell_origin(row, col):
+  '''lower left corner of the axes of the (row, col) subplot of the 3x3 figure, in pixels'''
+  rc = mpl.rcParams
+  width, height = _cell_size()
+  x0 = grid_size[0] * rc['figure.subplot.left'] + col * width * (1 + grid_space['wspace'])
+  y0 = grid_size[1] * rc['figure.subplot.top'] - height - row * height * (1 + grid_space['hspace'])
+  return x0 * rc['figure.dpi'], y0 * rc['figure.dpi']
+
+
+def panel_phase(row, col):
+  '''fraction of a pixel (x, y) where the axes of the (row, col) subplot of the 3x3 figure starts'''
+  x0, y0 = cell_origin(row, col)
+  return round(x0 % 1, 3), round(y0 % 1, 3)
+
+
+def _new_grid():
+  fig = new_figure(figsize=grid_size)
+
+  # set the background color of the figure to light gray
+  fig.set_facecolor('#cccccc')
+
+  return {'fig': fig, 'axes': np.empty((0,), dtype=object), 'specs': []}
+
+
+def _new_panel(phase):
+  # transparent figure with the axes of one subplot of the 3x3 figure (same inches), and the margin around it
+  width, height = _cell_size()
+  dpi = mpl.rcParams['figure.dpi']
+  mx, my = panel_margin[0] + phase[0] / dpi, panel_margin[1] + phase[1] / dpi
+  size = (width + 2 * panel_margin[0], height + 2 * panel_margin[1])
+
+  fig = new_figure(figsize=size)
+  fig.patch.set_alpha(0)
+  # the same 3x3 grid, placed so its middle cell is the axes (the cell bounds of `paste_image` are the same)
+  left = (mx - width * (1 + grid_space['wspace'])) / size[0]
+  bottom = (my - height * (1 + grid_space['hspace'])) / size[1]
+  cells = fig.add_gridspec(3, 3, left=left, right=left + width * (3 + 2 * grid_space['wspace']) / size[0],
+                           bottom=bottom, top=bottom + height * (3 + 2 * grid_space['hspace']) / size[1], **grid_space)
+  axes = np.empty((1, 1), dtype=object)
+  axes[0, 0] = ax = fig.add_subplot(cells[1, 1])
+
+  return {'fig': fig, 'axes': axes, 'specs': [ax.get_subplotspec()], 'phase': phase}
+
+
+def _default_ticks(ax):
+  # the ticks of a new axes (from the rc params, as `Axes.__init__` sets them)
+  rc = mpl.rcParams
+  for which in ('minor', 'major'):
+    ax.tick_params(which=which,
+                   top=rc['xtick.top'] and rc[f'xtick.{which}.top'], bottom=rc['xtick.bottom'] and rc[f'xtick.{which}.bottom'],
+                   labeltop=rc['xtick.labeltop'] and rc[f'xtick.{which}.top'], labelbottom=rc['xtick.labelbottom'] and rc[f'xtick.{which}.bottom'],
+                   left=rc['ytick.left'] and rc[f'ytick.{which}.left'], right=rc['ytick.right'] and rc[f'ytick.{which}.right'],
+                   labelleft=rc['ytick.labelleft'] and rc[f'ytick.{which}.left'], labelright=rc['ytick.labelright'] and rc[f'ytick.{which}.right'])
+
+
+def _reset(grid):
+  # back to empty axes at their places (colorbars and pasted subplots removed, moved axes restored)
+  fig = grid['fig']
+  axes = list(grid['axes'].flat)
+
+  for ax in fig.axes:
+    if ax not in axes:
+      ax.remove()
+  for image in list(fig.images):
+    image.remove()
+
+  for ax, spec in zip(axes, grid['specs']):
+    ax.tick_params(which='both', reset=True) # grid / tick styles are not cleared by `clear`
+    ax.clear()
+    _default_ticks(ax)
+    ax.set_aspect('auto', adjustable='box') # the pie plot makes its axes equal and hides the frame
+    ax.set_frame_on(True)
+    ax.set_subplotspec(spec)
+    ax.set_axis_on()
+
+  fig.suptitle('')
+
+
+# take / give back a figure  ************************************************************
+def acquire_grid():
+  '''
+  1. take a free 3x3 figure of the pool (a new one if the pool is empty), without axes: the subplots are pasted on it
+  2. return dict of the figure, give it back with `release_grid` after saving it
+  '''
+  with _lock:
+    if _free:
+      return _free.pop()
+  return _new_grid()
+
+
+def release_grid(grid):
+  '''clear the figure and keep it for the next column (or drop it if the pool is full)'''
+  with _lock:
+    if len(_free) >= pool_size():
+      return
+
+  _reset(grid)
+
+  with _lock:
+    if len(_free) < pool_size():
+      _free.append(grid)
+
+
+def acquire_panel(phase):
+  '''
+  1. take a free panel figure of the phase (one subplot of the 3x3 figure alone, a new one if there is none)
+  2. return dict of the figure and its axes, give it back with `release_panel` after drawing it
+  '''
+  with _lock:
+    free = _free_panels.get(phase)
+    if free:
+      return free.pop()
+  return _new_panel(phase)
+
+
+def release_panel(panel):
+  '''clear the panel figure and keep it for the next subplot of its phase (or drop it if the pool is full)'''
+  with _lock:
+    free = _free_panels.setdefault(panel['phase'], [])
+    if len(free) >= pool_size():
+      return
+
+  _reset(panel)
+
+  with _lock:
+    if len(free) < pool_size():
+      free.append(panel)
+
+
+# memory report  ************************************************************************
+def figure_memory():
+  '''
+  memory of the figures in this process:
+  resident memory (MB), figures left open in pyplot (should stay 0) and figures kept by the pool
+  '''
+  with _lock:
+    pooled = len(_free) + sum(len(free) for free in _free_panels.values())
+
+  return {'rss_mb': round(rss_mb(), 1), 'pyplot_figures': len(plt.get_fignums()), 'pooled_figures': pooled}
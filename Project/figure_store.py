@@ -0,0 +1,92 @@
+import os
+import re
+import hashlib
+import tempfile
+import threading
+
+from result_cache import cache_dir, evict_lru
+
+
+
+# ************************************************************************************
+# ***************************    Figure Store    *************************************
+# ************************************************************************************
+
+# the figures are png files named by the hash of their bytes:
+#   <figure dir>/<figure id>.png
+# the same figure is stored once, and its id never points to other bytes, so the
+# browser can cache it forever. the least recently used files are removed when the
+# store is bigger than its limit: the store is scanned each time a process has written
+# 1/20 of the limit since its last scan (not for every figure), so it can pass its limit
+# by that much for each process.
+
+_fig_id = re.compile(r'^[0-9a-f]{32}$')
+
+_written = 0 # bytes of figures written by this process since it last checked the size of the store
+_written_lock = threading.Lock()
+
+
+def figure_dir():
+    return os.environ.get('AUTO_ANALYSIS_FIGURE_DIR', os.path.join(cache_dir(), 'figures'))
+
+
+def figure_limit():
+    '''max size of the figure store in bytes'''
+    return int(float(os.environ.get('AUTO_ANALYSIS_FIGURE_MB', 1024)) * 1024 * 1024)
+
+
+def figure_path(fig_id):
+    '''path of the figure file, None if `fig_id` is not a valid id'''
+    if not _fig_id.match(fig_id or ''):
+        return None
+    return os.path.join(figure_dir(), f'{fig_id}.png')
+
+
+def figure_exists(fig_id):
+    path = figure_path(fig_id)
+    return path is not None and os.path.exists(path)
+
+
+# save a figure **************************************************************
+def put_figure(png):
+    '''
+    1. function takes the png bytes of a figure
+    2. write them in the store (only once for the same bytes)
+    3. return the figure id
+    '''
+    fig_id = hashlib.sha256(png).hexdigest()[:32]
+    path = figure_path(fig_id)
+
+    if os.path.exists(path):
+        os.utime(path) # already stored, mark as recently used
+        return fig_id
+
+    os.makedirs(figure_dir(), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=figure_dir(), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(png)
+    os.replace(tmp, path)
+
+    if _count_written(len(png)):
+        evict_lru(figure_dir(), figure_limit(), '.png')
+
+    return fig_id
+
+
+def _count_written(size):
+    # add the bytes of a new figure, True when the size of the store has to be checked again
+    global _written
+    with _written_lock:
+        _written += size
+        if _written < figure_limit() / 20:
+            return False
+        _written = 0
+        return True
+
+
+def touch_figure(fig_id):
+    '''mark the figure as recently used (it was served)'''
+    try:
+        os.utime(figure_path(fig_id))
+    except (OSError, TypeError):
+        pass
@@ -0,0 +1,142 @@
+import os
+import zlib
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from plot_data import plot_settings
+
+
+
+# ************************************************************************************
+# ***************************    Group Summary    ************************************
+# ************************************************************************************
+
+# the bar, box and violin subplots summarize a continuous column for each group (x [, hue]):
+#   count / mean / std            -> height of the bars
+#   ci_low / ci_high              -> error bars: confidence interval of the mean (AUTO_ANALYSIS_CI)
+#   q1 / med / q3                 -> boxes, inner boxes of the violins
+#   whislo / whishi / fliers      -> whiskers (last values inside whis * IQR) and the values outside them
+# `group_summary` computes them for several columns in one grouped pass: the group of each row is
+# numbered once, the rows of each column are sorted by (group, value) once and every statistic of every
+# group is read from the sorted blocks with numpy (no python loop over the groups).
+# the confidence interval of the mean is:
+#   normal     mean -/+ z * std / sqrt(count) (default, nothing resampled)
+#   bootstrap  percentiles of AUTO_ANALYSIS_BOOTSTRAP resampled means of each group, the resamples of
+#              all groups drawn at once by numpy (seeded by AUTO_ANALYSIS_PLOT_SEED and the column)
+# both at the AUTO_ANALYSIS_CI_LEVEL level.
+
+stat_names = ['count', 'mean', 'std', 'ci_low', 'ci_high', 'q1', 'med', 'q3', 'whislo', 'whishi']
+_draws = 2**22 # resampled values drawn at once by the bootstrap (memory of each batch)
+
+
+def ci_settings():
+  return {'method': os.environ.get('AUTO_ANALYSIS_CI', 'normal'),
+          'level': float(os.environ.get('AUTO_ANALYSIS_CI_LEVEL', 0.95)),
+          'resamples': int(os.environ.get('AUTO_ANALYSIS_BOOTSTRAP', 1000))}
+
+
+def group_codes(df, by):
+  '''number of the group of each row (-1 if a group column is null) and the groups in their sorted order'''
+  groups = df.groupby(by if len(by) > 1 else by[0], observed=True, sort=True)
+  return groups.ngroup().fillna(-1).to_numpy(dtype=np.int64), groups.size().index
+
+
+def _sorted_blocks(codes, values):
+  # values of the valid rows (group and value not null) sorted by (group, value), and their groups
+  valid = (codes >= 0) & ~np.isnan(values)
+  codes, values = codes[valid], values[valid]
+  order = np.lexsort((values, codes))
+  return values[order], codes[order]
+
+
+def _quantile(values, starts, n, q):
+  # quantile q of each sorted block (linear interpolation as pandas / numpy), nan for the empty groups
+  filled = n > 0
+  pos = q * (n[filled] - 1)
+  lo = np.floor(pos).astype(np.int64)
+  hi = np.minimum(lo + 1, n[filled] - 1)
+  a, b = values[starts[filled] + lo], values[starts[filled] + hi]
+  out = np.full(len(n), np.nan)
+  out[filled] = a + (b - a) * (pos - lo)
+  return out
+
+
+def _bootstrap(values, codes, starts, n, level, resamples, seed):
+  # percentile interval of the resampled means of every group, all groups resampled at once:
+  # each resample is a row of indices drawn inside the block of their group, so the sums of the
+  # groups are the sums of the blocks of the row (`reduceat`)
+  filled = np.flatnonzero(n)
+  means = np.full((resamples, len(n)), np.nan)
+  rng = np.random.default_rng(seed)
+  batch = max(1, _draws // max(len(values), 1))
+  first_row, size = starts[codes], n[codes]
+
+  for first in range(0, resamples, batch):
+    b = min(batch, resamples - first)
+    draws = first_row + rng.integers(0, size, size=(b, len(values)))
+    means[first:first + b, filled] = np.add.reduceat(values[draws], starts[filled], axis=1) / n[filled]
+
+  alpha = (1 - level) / 2
+  return np.quantile(means, [alpha, 1 - alpha], axis=0)
+
+
+def group_summary(df, by, cols, quantiles=True, whis=1.5, ci=None):
+  '''
+  1. function takes data frame, the group columns (x [, hue]), the continuous columns to summarize
+     (and if the quantiles / whiskers / fliers are needed, the whiskers length, the CI settings)
+  2. compute count / mean / std / CI of the mean (and quartiles, whiskers and fliers) of each column for each group
+  3. return dict of {'stats': data frame indexed by the groups with columns (column, stat),
+                     'fliers': {column: {group: values}}} (nulls ignored, groups without values left out)
+  '''
+  ci = ci or ci_settings()
+  by = [col for col in by if col is not None]
+  codes, index = group_codes(df, by)
+  n_groups = len(index)
+
+  tables, fliers = {}, {}
+  for col in cols:
+    values, group = _sorted_blocks(codes, df[col].to_numpy(dtype='float64', na_value=np.nan))
+    n = np.bincount(group, minlength=n_groups)
+    starts = np.cumsum(n) - n
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+      mean = np.bincount(group, weights=values, minlength=n_groups) / n
+      std = np.sqrt(np.bincount(group, weights=(values - mean[group]) ** 2, minlength=n_groups) / (n - 1))
+    std[n < 2] = np.nan
+    stats = {'count': n, 'mean': mean, 'std': std}
+
+    if ci['method'] == 'bootstrap':
+      stats['ci_low'], stats['ci_high'] = _bootstrap(values, group, starts, n, ci['level'], ci['resamples'],
+                                                     seed=[plot_settings()['seed'], zlib.crc32(str(col).encode())])
+      single = n < 2 # one value: no interval (as the normal one)
+      stats['ci_low'][single], stats['ci_high'][single] = np.nan, np.nan
+    else:
+      half = NormalDist().inv_cdf(0.5 + ci['level'] / 2) * std / np.sqrt(n)
+      stats['ci_low'], stats['ci_high'] = mean - half, mean + half
+
+    if quantiles:
+      q1, med, q3 = (_quantile(values, starts, n, q) for q in (0.25, 0.5, 0.75))
+      stats.update(q1=q1, med=med, q3=q3)
+
+      # whiskers: the first / last value of each block inside its limits, the others are fliers
+      iqr = q3 - q1
+      inside = (values >= (q1 - whis * iqr)[group]) & (values <= (q3 + whis * iqr)[group])
+      stats['whislo'], stats['whishi'] = q1.copy(), q3.copy()
+      kept = np.flatnonzero(inside)
+      first = np.unique(group[kept], return_index=True)
+      last = np.unique(group[kept][::-1], return_index=True)
+      stats['whislo'][first[0]] = values[kept[first[1]]]
+      stats['whishi'][last[0]] = values[kept[::-1][last[1]]]
+
+      out = ~inside
+      counts = np.bincount(group[out], minlength=n_groups)
+      blocks = np.split(values[out], np.cumsum(counts)[:-1])
+      fliers[col] = {index[g]: blocks[g] for g in np.flatnonzero(counts)}
+
+    table = pd.DataFrame({name: stats[name] for name in stat_names if name in stats}, index=index)
+    tables[col] = table[table['count'] > 0]
+
+  stats = pd.concat(tables, axis=1) if tables else pd.DataFrame(index=index)
+  return {'stats': stats, 'fliers': fliers}
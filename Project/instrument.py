@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+
+# ************************************************************************************
+# ***************************    Instrumentation    **********************************
+# ************************************************************************************
+
+# every stage of an analysis (read_csv, describe, clean_data, each column figure ...) is measured:
+#   wall     seconds
+#   cpu      cpu seconds of the thread running it (the figures: of the render process)
+#   alloc_mb peak of the memory allocated during the stage, only if AUTO_ANALYSIS_TRACE_ALLOC=1
+#            (tracemalloc makes everything slower, and its peak counts the allocations of all threads)
+# the measures go to:
+#   - the timings list of the job running in this thread (`collect`), shown on the result page
+#   - the aggregated metrics of the process, exported by /metrics (Prometheus text format)
+
+log = logging.getLogger('auto_analysis')
+
+_local = threading.local()   # timings list of the job running in this thread, its open stages
+_lock = threading.Lock()     # guard the metrics between the job threads
+
+# upper bounds (seconds) of the stage histograms
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_stages = {}   # stage -> {'buckets': [counts], 'sum', 'count', 'cpu', 'alloc', 'errors'}
+_counters = {} # (name, labels) -> count
+
+
+def trace_alloc():
+    return os.environ.get('AUTO_ANALYSIS_TRACE_ALLOC', '0') == '1'
+
+
+def start_tracing():
+    '''start tracemalloc if the allocations are measured (AUTO_ANALYSIS_TRACE_ALLOC=1)'''
+    if trace_alloc() and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+# Measure  ******************************************************************************
+@contextmanager
+def measure(name, col=None):
+    '''
+    1. context manager takes the stage name (and the column of a figure)
+    2. yield the timing dict, filled with wall / cpu seconds (and allocated MB) when the block ends
+    3. nothing is recorded, to send the timing from a render process back to the job (`record`)
+    '''
+    timing = {'stage': name, 'col': col}
+    traced = tracemalloc.is_tracing()
+    if traced:
+        frame = _open_frame()
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield timing
+    finally:
+        timing['wall'] = round(time.perf_counter() - wall, 4)
+        timing['cpu'] = round(time.thread_time() - cpu, 4)
+        if traced and tracemalloc.is_tracing():
+            timing['alloc_mb'] = round(_close_frame(frame) / 2**20, 2)
+
+
+# the peak of tracemalloc is reset by each stage, the stages still open in this thread keep the peak seen before
+def _open_frame():
+    stack = _local.__dict__.setdefault('frames', [])
+    current, peak = tracemalloc.get_traced_memory()
+    for frame in stack:
+        frame['peak'] = max(frame['peak'], peak)
+    tracemalloc.reset_peak()
+    frame = {'start': current, 'peak': current}
+    stack.append(frame)
+    return frame
+
+
+def _close_frame(frame):
+    # bytes allocated above the start of the stage at its peak
+    stack = _local.frames
+    frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+    stack.remove(frame)
+    for parent in stack:
+        parent['peak'] = max(parent['peak'], frame['peak'])
+    return frame['peak'] - frame['start']
+
+
+@contextmanager
+def stage(name, col=None):
+    '''measure the block and record it (job timings and metrics), an exception is counted as an error of the stage'''
+    failed = True
+    try:
+        with measure(name, col) as timing:
+            yield timing
+        failed = False
+    finally:
+        record(timing, failed)
+
+
+def record(timing, failed=False):
+    '''add a finished timing to the job of this thread (if any) and to the metrics'''
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings.append(dict(timing, failed=failed) if failed else timing)
+
+    with _lock:
+        metric = _stages.setdefault(timing['stage'], {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0,
+                                                      'cpu': 0.0, 'alloc': 0.0, 'errors': 0})
+        for i, bound in enumerate(buckets):
+            if timing['wall'] <= bound:
+                metric['buckets'][i] += 1
+        metric['sum'] += timing['wall']
+        metric['count'] += 1
+        metric['cpu'] += timing['cpu']
+        metric['alloc'] += max(0, timing.get('alloc_mb', 0)) * 2**20
+        metric['errors'] += failed
+
+
+@contextmanager
+def collect(timings):
+    '''record the stages run by this thread in the `timings` list (the job timings)'''
+    previous = getattr(_local, 'timings', None)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def count(name, **labels):
+    '''add 1 to the counter `name` with these labels (jobs by status ...)'''
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def rss_mb():
+    '''resident memory of the process in MB (the peak if the current one is not available)'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError, AttributeError): # no /proc (macOS, windows)
+        try:
+            import resource
+        except ImportError:
+            return 0.0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB on linux
+
+
+# Metrics  ******************************************************************************
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def metrics_text(gauges=None):
+    '''
+    1. function takes optional gauges {name: value} (memory of the process ...)
+    2. return the metrics in the Prometheus text format:
+       auto_analysis_stage_seconds (histogram), cpu / allocated / errors totals of each stage, the counters and the gauges
+    '''
+    with _lock:
+        stages = {name: dict(metric, buckets=list(metric['buckets'])) for name, metric in _stages.items()}
+        counters = dict(_counters)
+
+    lines = ['# HELP auto_analysis_stage_seconds Wall time of the analysis stages.',
+             '# TYPE auto_analysis_stage_seconds histogram']
+    for name, metric in sorted(stages.items()):
+        for bound, n in zip(buckets, metric['buckets']):
+            lines.append(f'auto_analysis_stage_seconds_bucket{{stage="{_label(name)}",le="{bound}"}} {n}')
+        lines.append(f'auto_analysis_stage_seconds_bucket{{stage="{_label(name)}",le="+Inf"}} {metric["count"]}')
+        lines.append(f'auto_analysis_stage_seconds_sum{{stage="{_label(name)}"}} {metric["sum"]:.4f}')
+        lines.append(f'auto_analysis_stage_seconds_count{{stage="{_label(name)}"}} {metric["count"]}')
+
+    totals = [('cpu', 'auto_analysis_stage_cpu_seconds_total', 'CPU time of the analysis stages.'),
+              ('alloc', 'auto_analysis_stage_alloc_bytes_total', 'Memory allocated by the analysis stages (AUTO_ANALYSIS_TRACE_ALLOC=1).'),
+              ('errors', 'auto_analysis_stage_errors_total', 'Analysis stages that raised an exception.')]
+    for key, metric_name, help_text in totals:
+        lines += [f'# HELP {metric_name} {help_text}', f'# TYPE {metric_name} counter']
+        for name, metric in sorted(stages.items()):
+            lines.append(f'{metric_name}{{stage="{_label(name)}"}} {metric[key]:g}')
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE auto_analysis_{name}_total counter')
+        for (counter, labels), n in sorted(counters.items()):
+            if counter == name:
+                labels = ','.join(f'{key}="{_label(value)}"' for key, value in labels)
+                lines.append(f'auto_analysis_{name}_total{{{labels}}} {n}')
+
+    for name, value in sorted((gauges or {}).items()):
+        lines += [f'# TYPE auto_analysis_{name} gauge', f'auto_analysis_{name} {value:g}']
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,229 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from result_cache import cache_put
+from instrument import stage, collect, count, log
+from lazy import keep_prepared, get_prepared, lazy_columns
+
+
+
+# ************************************************************************************
+# ***************************    Analysis Jobs    ************************************
+# ************************************************************************************
+
+_jobs = {}                # job id -> job dict
+_lock = threading.Lock()  # guard `_jobs` between the request threads and the job threads
+_executor = None          # local queue of analysis threads, created on first use
+_changed = threading.Condition() # notified each time a job changes (event streams of the result pages wait on it)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # number of analyses running at the same time, the others wait in the queue
+            max_jobs = int(os.environ.get('AUTO_ANALYSIS_JOB_THREADS', 2))
+            _executor = ThreadPoolExecutor(max_workers=max(1, max_jobs), thread_name_prefix='analysis')
+        return _executor
+
+
+# forget the oldest finished jobs ******************************************
+def _evict_jobs():
+    keep = int(os.environ.get('AUTO_ANALYSIS_MAX_JOBS', 50)) # finished jobs kept in memory
+    finished = sorted((job for job in _jobs.values() if job['status'] in ('done', 'failed')),
+                      key=lambda job: job['finished'])
+    for job in finished[:max(0, len(finished) - keep)]:
+        del _jobs[job['id']]
+
+
+# submit a new analysis ****************************************************
+def _new_job(df_name):
+    return {
+        'id': uuid.uuid4().hex,
+        'df_name': df_name,
+        'status': 'queued',   # queued -> running -> done | failed
+        'tables': None,       # head / info / describe html, ready before the figures
+        'columns': [],        # [{'kind', 'col', 'done'}] one item for each figure
+        'figures': [],        # [{'kind', 'col', 'fig_id'}] in the same order as `columns`
+        'other_list': None,   # columns have no plots
+        'error': None,
+        'created': time.time(),
+        'finished': None,
+        'cached': False,      # result read from the result cache
+        'compaction': None,   # memory of the cleaned data frame before / after the dtypes compaction
+        'memory': None,       # figure memory of the server process before / after the job
+        'timings': [],        # [{'stage', 'col', 'wall', 'cpu', 'alloc_mb'}] of each stage and figure
+        'version': 0,         # number of changes, to wait for the next one (`wait_job`)
+        'lazy': None,         # lazy mode: fingerprint of the prepared dataset, the figures are rendered when asked
+        'profile_table': None, # lazy mode: [{'col', 'dtype', 'nulls', 'nunique', 'role'}] of the loaded columns
+    }
+
+
+def _touch(job):
+    # the job changed (tables, figure, status ...), wake up the streams waiting on it
+    with _changed:
+        job['version'] += 1
+        _changed.notify_all()
+
+
+def wait_job(job, version, timeout=15):
+    '''
+    1. function takes a job, the last version seen and the max seconds to wait
+    2. wait until the job changes (or the timeout)
+    3. return the current version of the job
+    '''
+    with _changed:
+        _changed.wait_for(lambda: job['version'] != version, timeout)
+        return job['version']
+
+
+def _add_job(job):
+    with _lock:
+        _evict_jobs()
+        _jobs[job['id']] = job
+
+
+def submit_job(df, df_name, cache_key=None, timings=None, lazy=False):
+    '''
+    1. function takes the loaded data frame, its name (the key to cache the result, the timings of the loading
+       and the lazy mode: only prepare the data, the figures are rendered when asked)
+    2. register a new job and put it in the analysis queue
+    3. return the job id right away (the analysis runs in the background)
+    '''
+    return submit_load_job(lambda: {'df': df}, df_name, cache_key, timings, lazy)
+
+
+def submit_load_job(load, df_name, cache_key=None, timings=None, lazy=False):
+    '''
+    same as `submit_job`, but the dataset is loaded in the analysis thread:
+    `load()` returns {'df': data frame, 'tables': optional tables, 'profile': optional column profile}
+    '''
+    job = _new_job(df_name)
+    job['timings'] = list(timings or [])
+    if lazy: # the prepared dataset is kept by its fingerprint, the cache key (or the job id)
+        job['lazy'] = cache_key or job['id']
+    _add_job(job)
+
+    _get_executor().submit(_run_job, job, load, cache_key)
+
+    return job['id']
+
+
+def cached_job(result):
+    '''register a finished job from a cached result, return its id'''
+    job = _new_job(result['df_name'])
+    job.update(tables=result['tables'], columns=result['columns'], figures=result['figures'],
+               other_list=result['other_list'], compaction=result.get('compaction'), cached=True, finished=time.time(), status='done')
+    _add_job(job)
+    count('jobs', status='cached')
+
+    return job['id']
+
+
+def lazy_job(fingerprint, df_name):
+    '''register a finished lazy job from a dataset still prepared in memory, return its id (None if it was forgotten)'''
+    entry = get_prepared(fingerprint)
+    if entry is None:
+        return None
+
+    job = _new_job(df_name)
+    job.update(tables=entry['tables'], columns=lazy_columns(entry), other_list=entry['other_list'],
+               compaction=entry['compaction'], profile_table=entry['columns'], lazy=fingerprint,
+               cached=True, finished=time.time(), status='done')
+    _add_job(job)
+    count('jobs', status='cached')
+
+    return job['id']
+
+
+def get_job(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+# run the analysis of one job (analysis thread) *****************************
+def _run_job(job, load, cache_key=None):
+    # the analysis stack is imported by the first job (or preloaded), the server starts without it (see startup)
+    from autoAnalysis import all_in_one, prepare_analysis, summary_tables # my custom functions
+    from figure_pool import figure_memory
+
+    job['status'] = 'running'
+    _touch(job)
+
+    def on_plan(columns): # all columns will be plotted, before any figure is rendered
+        job['columns'] = [{'kind': kind, 'col': col, 'done': False} for kind, col in columns]
+        _touch(job)
+
+    def on_figure(kind, col, fig_id): # one figure finished (saved in the figure store)
+        job['columns'][len(job['figures'])]['done'] = True
+        job['figures'].append({'kind': kind, 'col': col, 'fig_id': fig_id})
+        _touch(job)
+
+    memory = figure_memory()
+
+    def on_compact(report): # dtypes of the cleaned data frame made smaller
+        job['compaction'] = report
+        _touch(job)
+
+    status = 'done'
+    try:
+        with collect(job['timings']): # every stage run by this thread is added to the job timings
+            with stage('load'):
+                data = load()
+            df = data['df']
+            job['tables'] = data.get('tables') or summary_tables(df) # before `all_in_one` changes the data frame
+            _touch(job)
+            if job['lazy']: # clean the data only, keep it for the figures asked later
+                prepared = prepare_analysis(df, data.get('profile'), on_compact)
+                job['columns'] = keep_prepared(job['lazy'], dict(prepared, tables=job['tables'], compaction=job['compaction']))
+                job['profile_table'], job['other_list'] = prepared['columns'], prepared['other_list']
+            else:
+                _, job['other_list'] = all_in_one(df, on_plan=on_plan, on_figure=on_figure,
+                                                  profile=data.get('profile'), on_compact=on_compact)
+    except Exception as e:
+        log.exception('analysis of %s failed (job %s)', job['df_name'], job['id'])
+        job['error'] = f'{type(e).__name__}: {e}'
+        status = 'done' if job['tables'] else 'failed' # keep the tables if only the plots failed
+
+    end = figure_memory()
+    job['memory'] = {'rss_mb_start': memory['rss_mb'], 'rss_mb_end': end['rss_mb'],
+                     'rss_mb_delta': round(end['rss_mb'] - memory['rss_mb'], 1),
+                     'pyplot_figures': end['pyplot_figures'], 'pooled_figures': end['pooled_figures']}
+
+    job['finished'] = time.time()
+    job['status'] = status
+    count('jobs', status=status)
+    _touch(job)
+
+    if cache_key and not job['error'] and not job['lazy']: # only complete results are reused
+        cache_put(cache_key, {key: job[key] for key in ('df_name', 'tables', 'columns', 'figures', 'other_list', 'compaction')})
+
+
+# json friendly view of a job ***********************************************
+def job_status(job):
+    return {
+        'job_id': job['id'],
+        'df_name': job['df_name'],
+        'status': job['status'],
+        'tables_ready': job['tables'] is not None,
+        'total': len(job['columns']),
+        'done': len(job['figures']),
+        'columns': list(job['columns']),
+        'other_list': job['other_list'],
+        'error': job['error'],
+        'cached': job['cached'],
+        'compaction': job['compaction'],
+        'memory': job['memory'],
+        'timings': list(job['timings']),
+        'lazy': job['lazy'] is not None,
+        'profile_table': job['profile_table'],
+    }
+
+
+def job_figures(job, start=0):
+    '''return the finished figures of the job from index `start`'''
+    figures = job['figures'][start:] # copy, the job thread keeps appending
+    return [dict(fig, index=start + i) for i, fig in enumerate(figures)]
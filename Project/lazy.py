@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import OrderedDict
+
+from figure_store import put_figure, figure_exists
+from instrument import stage
+
+
+
+# ************************************************************************************
+# ***************************    Lazy Analysis    ************************************
+# ************************************************************************************
+
+# in lazy mode the job only cleans the data (profile table and column list are shown right away),
+# then each column figure, or one panel of it, is rendered the first time the page asks for it:
+#   - the prepared data (cleaned frame, figure jobs, shared artifacts) is kept in memory by the
+#     fingerprint of the dataset (its result cache key), for the last AUTO_ANALYSIS_LAZY_FRAMES datasets
+#   - the panels of each column (with their random columns) are planned by the analysis (`plot_plan`),
+#     so the whole figure and its single panels always agree
+#   - each rendered figure / panel is saved in the figure store and remembered, asked again it is not drawn
+
+_prepared = OrderedDict()   # fingerprint -> prepared dataset, least recently used first
+_lock = threading.Lock()
+
+
+def lazy_settings():
+    return {'enabled': os.environ.get('AUTO_ANALYSIS_LAZY', '0') == '1',
+            'frames': int(os.environ.get('AUTO_ANALYSIS_LAZY_FRAMES', 4))}
+
+
+def keep_prepared(fingerprint, prepared):
+    '''
+    1. function takes the fingerprint of the dataset and its prepared analysis (`prepare_analysis`)
+    2. keep it in memory (the oldest datasets are forgotten)
+    3. return the columns of the lazy job: [{'kind', 'col', 'done', 'panels'}]
+    '''
+    entry = dict(prepared, figures={}, lock=threading.Lock())
+
+    with _lock:
+        _prepared[fingerprint] = entry
+        _prepared.move_to_end(fingerprint)
+        while len(_prepared) > max(1, lazy_settings()['frames']):
+            _prepared.popitem(last=False)
+
+    return lazy_columns(entry)
+
+
+def get_prepared(fingerprint):
+    '''prepared dataset of the fingerprint (None if it was forgotten)'''
+    with _lock:
+        entry = _prepared.get(fingerprint)
+        if entry is not None:
+            _prepared.move_to_end(fingerprint)
+        return entry
+
+
+def lazy_columns(entry):
+    return [{'kind': kind, 'col': col, 'done': (i, None) in entry['figures'], 'panels': len(panels)}
+            for i, (kind, col, panels) in enumerate(entry['jobs'])]
+
+
+def render_column(fingerprint, index, panel=None):
+    '''
+    1. function takes the fingerprint of a prepared dataset, the index of the column figure (and of one of its panels)
+    2. draw the whole 3x3 figure (or the panel alone) the first time, save it in the figure store
+    3. return the figure id, None if the dataset was forgotten or there is no such column / panel
+    '''
+    entry = get_prepared(fingerprint)
+    if entry is None or not 0 <= index < len(entry['jobs']):
+        return None
+    kind, col, panels = entry['jobs'][index]
+    if panel is not None and not 0 <= panel < len(panels):
+        return None
+
+    from plot_plan import render_figure, render_panel # the analysis stack, imported by the job before (see startup)
+
+    key = (index, panel)
+    with entry['lock']: # one render at a time for each dataset, a figure asked twice is drawn once
+        fig_id = entry['figures'].get(key)
+        if fig_id is None or not figure_exists(fig_id): # removed from the figure store meanwhile
+            with stage(f'{kind}_plot' if panel is None else f'{kind}_panel', col):
+                if panel is None:
+                    data = render_figure(entry['df'], col, panels, entry['art'])
+                else:
+                    data = render_panel(entry['df'], panels[panel][1], entry['art'])
+                fig_id = put_figure(data)
+            entry['figures'][key] = fig_id
+
+    return fig_id
@@ -1,78 +1,331 @@
-from flask import Flask, render_template, Response, request
-import numpy as np
-import pandas as pd
-import seaborn as sns
-import io 
-from autoAnalysis import all_in_one # my custom func
+from flask import Flask, render_template, Response, request, jsonify, redirect, url_for, abort, send_file, stream_with_context
+import os
+import json
+import logging
+import tempfile
+from startup import load_stack, stack_loaded, server_ready, start_preload, startup_times # first, it times the start
+from jobs import submit_job, submit_load_job, cached_job, lazy_job, get_job, job_status, job_figures, wait_job # my custom funcs
+from result_cache import cache_key, cache_get
+from figure_store import figure_path, figure_exists, touch_figure
+from datasets import dataset_names, builtin_dataset, start_warm_up
+from instrument import stage, collect, start_tracing, metrics_text, rss_mb, log
+from lazy import lazy_settings, render_column
+# the analysis stack (numpy, pandas, matplotlib, seaborn ...) is imported by the first analysis,
+# or preloaded in the background: the home page is served without it (see startup)
 
 
 
+logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
+log.setLevel(os.environ.get('AUTO_ANALYSIS_LOG_LEVEL', 'INFO'))
+start_tracing() # only if AUTO_ANALYSIS_TRACE_ALLOC=1
+
 app = Flask(__name__)
 
-# Dataset names
-dataset_names = ["titanic", "tips", "penguins",  "taxis", "dots", "exercise", "geyser", "glue", "iris", "mpg", ]
+# keep the built-in datasets of AUTO_ANALYSIS_WARM_DATASETS in memory (background thread)
+start_warm_up()
+
+server_ready()
+start_preload() # import the analysis stack now in a background thread (AUTO_ANALYSIS_PRELOAD, AUTO_ANALYSIS_WARM_POOL)
 
 
 # home page
 @app.route('/')
 def index():
-    return render_template('home.html', dataset_names=dataset_names)
+    return render_template('home.html', dataset_names=dataset_names, lazy=lazy_settings()['enabled'])
 
 
 
-# create analysis page
-@app.route('/load_dataset', methods=['POST'])
-def load_dataset():
+# cached result of a dataset, only if all its figures are still in the figure store
+def cached_result(key):
+    result = cache_get(key)
+    if result and all(figure_exists(fig['fig_id']) for fig in result['figures']):
+        return result
+    return None
+
+
+
+# start the analysis of the request dataset
+def start_analysis():
+    '''
+    1. take the dataset chosen from the select box, or the uploaded csv / parquet / feather / arrow file
+    2. return a finished job if the same dataset was analysed before (result cache)
+    3. otherwise load the dataset (built-in datasets from their local copy, big csv files are streamed,
+       columnar files memory mapped by the job) and submit a new analysis job
+    4. in lazy mode ("Render Figures When Viewed"), reuse the dataset if it is still prepared in memory,
+       else the job only prepares it
+    5. return the job id, None if there is no valid dataset
+    '''
+    load_stack() # waits for the preload, or imports the stack for the first analysis
+    import pandas as pd
+    from autoAnalysis import ANALYSIS_VERSION
+    from streaming import load_stream, stream_settings
+    from columnar import columnar_format, load_columnar
+    from sketches import stats_settings
+    from plot_data import plot_settings
+    from group_summary import ci_settings
+    from density import kde_settings
+    from engine import engine_settings, active_engine, load_engine
+
+    # everything that changes the result
+    settings = {'version': ANALYSIS_VERSION, 'stats': stats_settings(), 'plot': plot_settings(), 'ci': ci_settings(),
+                'kde': kde_settings()}
+    lazy = request.form.get('lazy') == 'on'
 
-    valid = False # var to check if there is df or not 
     if 'dataset_file' not in request.files: # if there is no name "dataset_file" in my request
         # Load dataset from select box
         df_name = request.form.get('dataset_name') # get "dataset_name" from my request
-        if df_name:
-            df = sns.load_dataset(df_name) # load data using sns
-            valid = True
-    else:
+        if df_name not in dataset_names: # only the datasets of the select box (their local copies are files named by them)
+            return None
 
-        file = request.files['dataset_file'] # get file from my request 
+        key = cache_key(f'seaborn:{df_name}'.encode(), settings) # built-in datasets never change
+        result = cached_result(key)
+        if result:
+            return cached_job(result)
+        job_id = lazy and lazy_job(key, df_name) # the same dataset still prepared in memory
+        if job_id:
+            return job_id
+
+        # read by the job: from memory if warm, else the local copy (downloaded by seaborn the first time)
+        return submit_load_job(lambda: builtin_dataset(df_name), df_name, cache_key=key, lazy=lazy)
+
+    else:
+        file = request.files['dataset_file'] # get file from my request
         if file.filename == '': # if there is no file name
-            flash('No file selected')  # message "No file"
-            return redirect(request.url)
+            return None
+        df_name = os.path.splitext(file.filename)[0] # get only file name without extention (.csv, .parquet ...)
+        fmt = columnar_format(file.filename) # None for csv files
+
+        # big csv files (or when asked) are streamed in chunks, the plots use a random sample
+        file.stream.seek(0, os.SEEK_END)
+        size = file.stream.tell()
+        file.stream.seek(0)
+        streamed = not fmt and (request.form.get('streaming') == 'on' or size > float(os.environ.get('AUTO_ANALYSIS_STREAM_MB', 100)) * 1024 * 1024)
+        if streamed:
+            settings['stream'] = stream_settings()
+        # the saved uploads (streamed csv, columnar files) are reduced by duckdb / polars if asked (see engine)
+        engine = active_engine() if streamed or fmt else 'pandas'
+        if engine != 'pandas':
+            settings['engine'] = dict(engine_settings(), engine=engine, sample_size=stream_settings()['sample_size'])
+            settings.pop('stream', None)
+
+        key = cache_key(file.stream, settings) # hash of the uploaded bytes
+        result = cached_result(key)
+        if result:
+            return cached_job(dict(result, df_name=df_name))
+        job_id = lazy and lazy_job(key, df_name)
+        if job_id:
+            return job_id
+
+        if streamed or fmt:
+            # keep the upload in our own temp file, the request one is removed when the request ends
+            fd, path = tempfile.mkstemp(suffix=os.path.splitext(file.filename)[1])
+            os.close(fd)
+            file.save(path)
+            if engine != 'pandas': # only the stats and a sample of the file come back to pandas
+                return submit_load_job(lambda: load_engine(path, fmt or 'csv', settings['engine']['sample_size'], settings=settings['engine']),
+                                       df_name, cache_key=key, lazy=lazy)
+            if fmt: # columnar file, memory mapped and only the usable columns read
+                return submit_load_job(lambda: load_columnar(path, fmt), df_name, cache_key=key, lazy=lazy)
+            return submit_load_job(lambda: load_stream(path, **settings['stream']), df_name, cache_key=key, lazy=lazy)
+
+        timings = []
         try :
-            df = pd.read_csv(file) # read csv file using pandas 
-            df_name = file.filename[:-4] # get only file name without extention (.csv)
-            valid = True
-        except:
-            
-            return render_template('result.html', valid=valid)
-
-
-    # Get the first 5 rows of the loaded dataset
-    head_table = df.head().to_html(classes='table table-striped')
-
-    # Get the dataset information
-    buffer = io.StringIO() #create a buffer from StringIO
-    df.info(buf=buffer) # save the df.info in buffer
-    info_table = buffer.getvalue() # get value from the buffer
-
-    # Calculate the summary statistics
-    pd.set_option('display.float_format', lambda x: f'{x:.2f}')# set the float format for pandas outputs
-    try: 
-        des_n = df.describe().to_html(classes='table table-striped')
-    except:
-        des_n = None
-    try :
-        des_c = df.describe(exclude=[int,float]).to_html(classes='table table-striped')
-    except:
-        des_c = None 
-    try:    
-        # display plots 
-        fig_data,other_list = all_in_one(df) # my custom function to display plots to each column in df 
-    except:
-        fig_data,other_list = None, None
-
-    return render_template('result.html', valid=valid, df_name=df_name, head_table=head_table,
-                           info_table=info_table, des_n=des_n, des_c=des_c, 
-                           data=fig_data,other_list=other_list)
+            with collect(timings), stage('read_csv'):
+                df = pd.read_csv(file) # read csv file using pandas
+        except Exception as e:
+            log.warning('could not read %s: %s: %s', file.filename, type(e).__name__, e)
+            return None
+
+    return submit_job(df, df_name, cache_key=key, timings=timings, lazy=lazy)
+
+
+
+# create analysis page
+@app.route('/load_dataset', methods=['POST'])
+def load_dataset():
+
+    job_id = start_analysis()
+    if job_id is None:
+        return render_template('result.html', valid=False)
+
+    # the analysis runs in the background, show its page right away
+    return redirect(url_for('job_view', job_id=job_id), code=303)
+
+
+
+# ***********************************************************************************
+# *******************************   Analysis Jobs   *********************************
+# ***********************************************************************************
+
+def find_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+# submit a dataset, return the job id
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    job_id = start_analysis()
+    if job_id is None:
+        return jsonify(error='no valid dataset'), 400
+
+    return jsonify(job_status(get_job(job_id))), 202, {'Location': url_for('job_info', job_id=job_id)}
+
+
+# progress of the job (per column)
+@app.route('/jobs/<job_id>')
+def job_info(job_id):
+    return jsonify(job_status(find_job(job_id)))
+
+
+# finished figures of the job, from index `start`
+@app.route('/jobs/<job_id>/figures')
+def job_figures_list(job_id):
+    job = find_job(job_id)
+    start = request.args.get('start', 0, type=int)
+    figures = [dict(fig, url=url_for('figure', fig_id=fig['fig_id'])) for fig in job_figures(job, start)]
+    return jsonify(status=job['status'], figures=figures)
+
+
+# head / info / describe tables of the job (html)
+@app.route('/jobs/<job_id>/tables')
+def job_tables(job_id):
+    job = find_job(job_id)
+    if job['tables'] is None:
+        return '', 204
+    return render_template('_tables.html', **job['tables'])
+
+
+# server-sent event (`event_id` lets the browser resume from it after a reconnection)
+def sse(event, data, event_id=None):
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+# stream of the job changes for the result page: tables, compaction, each figure, progress, then done
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = find_job(job_id)
+    start = request.headers.get('Last-Event-ID', request.args.get('start', 0, type=int), type=int) # next figure to send
+    have_tables = request.args.get('tables') == '1'           # the page already shows them
+    have_compaction = request.args.get('compaction') == '1'
+
+    def events(start, have_tables, have_compaction):
+        progress = None
+        while True:
+            version = job['version'] # read before the job, a change made meanwhile is not missed by `wait_job`
+
+            if job['tables'] is not None and not have_tables:
+                yield sse('tables', {'html': render_template('_tables.html', **job['tables'])})
+                have_tables = True
+
+            if job['compaction'] and not have_compaction:
+                yield sse('compaction', job['compaction'])
+                have_compaction = True
+
+            for fig in job_figures(job, start):
+                yield sse('figure', dict(fig, url=url_for('figure', fig_id=fig['fig_id'])), fig['index'] + 1)
+                start = fig['index'] + 1
+
+            if progress != (len(job['figures']), len(job['columns'])):
+                progress = (len(job['figures']), len(job['columns']))
+                yield sse('progress', {'done': progress[0], 'total': progress[1]})
+
+            if job['status'] in ('done', 'failed'):
+                yield sse('done', job_status(job))
+                return
+
+            if wait_job(job, version) == version: # nothing new for a while, keep the connection open
+                yield ': keep-alive\n\n'
+
+    return Response(stream_with_context(events(start, have_tables, have_compaction)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# analysis page, filled while the job is running
+@app.route('/jobs/<job_id>/view')
+def job_view(job_id):
+    job = find_job(job_id)
+    tables = job['tables'] or {}
+    return render_template('result.html', valid=job['status'] != 'failed', job_id=job_id,
+                           status=job['status'], df_name=job['df_name'], **tables,
+                           figures=job_figures(job), total=len(job['columns']),
+                           other_list=job['other_list'], compaction=job['compaction'],
+                           timings=job['timings'] if show_timings() else None,
+                           lazy=job['lazy'] is not None, columns=job['columns'], profile_table=job['profile_table'])
+
+
+# timing panel of the result page (?timings=1, or always with AUTO_ANALYSIS_TIMINGS_PANEL=1)
+def show_timings():
+    return request.args.get('timings') == '1' or os.environ.get('AUTO_ANALYSIS_TIMINGS_PANEL', '0') == '1'
+
+
+
+# ***********************************************************************************
+# *******************************   Lazy Figures   **********************************
+# ***********************************************************************************
+
+# figure of a column of a lazy job (or one of its panels), rendered the first time it is asked
+def lazy_figure(job_id, index, panel=None):
+    job = find_job(job_id)
+    if job['lazy'] is None or job['status'] != 'done':
+        abort(404)
+
+    with collect(job['timings']):
+        fig_id = render_column(job['lazy'], index, panel)
+    if fig_id is None:
+        abort(410) # no such column, or the prepared dataset was forgotten (analyse it again)
+
+    if panel is None:
+        job['columns'][index]['done'] = True
+    return redirect(url_for('figure', fig_id=fig_id))
+
+
+@app.route('/jobs/<job_id>/columns/<int:index>.png')
+def column_figure(job_id, index):
+    return lazy_figure(job_id, index)
+
+
+@app.route('/jobs/<job_id>/columns/<int:index>/panels/<int:panel>.png')
+def column_panel(job_id, index, panel):
+    return lazy_figure(job_id, index, panel)
+
+
+
+# ***********************************************************************************
+# *******************************   Figures   ***************************************
+# ***********************************************************************************
+
+# png of a figure, its id is the hash of its bytes, so it can be cached forever
+@app.route('/figures/<fig_id>.png')
+def figure(fig_id):
+    path = figure_path(fig_id)
+    if path is None or not figure_exists(fig_id):
+        abort(404)
+    touch_figure(fig_id)
+
+    response = send_file(path, mimetype='image/png', etag=fig_id, conditional=True, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+
+# ***********************************************************************************
+# *******************************   Metrics   ***************************************
+# ***********************************************************************************
+
+# time of each stage (histograms), jobs by status, memory and startup times, in the Prometheus text format
+@app.route('/metrics')
+def metrics():
+    gauges = {'rss_bytes': rss_mb() * 2**20}
+    if stack_loaded(): # no figures before (and matplotlib is not imported for them)
+        from figure_pool import figure_memory
+        memory = figure_memory()
+        gauges.update(pyplot_figures=memory['pyplot_figures'], pooled_figures=memory['pooled_figures'])
+    gauges.update(startup_times())
+    return Response(metrics_text(gauges), mimetype='text/plain; version=0.0.4')
 
 
 
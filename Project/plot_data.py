@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+
+
+# ************************************************************************************
+# ***************************    Plot Data Reduction    ******************************
+# ************************************************************************************
+
+# the plots draw one marker for each row, so big data frames are reduced before
+# seaborn sees them. small data frames (<= max points) are plotted as they are.
+
+def plot_settings():
+  '''max number of rows drawn by one subplot (AUTO_ANALYSIS_PLOT_POINTS) and seed of the random subplots (AUTO_ANALYSIS_PLOT_SEED)'''
+  return {'max_points': int(os.environ.get('AUTO_ANALYSIS_PLOT_POINTS', 5000)),
+          'seed': int(os.environ.get('AUTO_ANALYSIS_PLOT_SEED', 0))}
+
+
+def max_points():
+  return plot_settings()['max_points']
+
+
+# Stratified Sample  ******************************************************************
+def stratified_sample(df, by=None, n=None, min_per_group=20, seed=0):
+  '''
+  1. function takes data frame, the columns of the groups (x / hue), number of rows to keep
+  2. keep the same ratio of rows from each group (at least `min_per_group` rows, so small groups stay visible)
+  3. return the sample (the data frame itself if it is small enough)
+  '''
+  n = n or max_points()
+  if len(df) <= n:
+    return df
+
+  by = [col for col in (by or []) if col is not None]
+  shuffled = df.sample(frac=1, random_state=seed) # random order, then the first rows of each group are a random sample
+  if not by:
+    return shuffled.iloc[:n].sort_index()
+
+  groups = shuffled.groupby(by, observed=True, dropna=False, sort=False)
+  sizes = groups[by[0]].transform('size').to_numpy()
+  quota = np.maximum(np.ceil(sizes * n / len(df)), np.minimum(sizes, min_per_group))
+
+  return shuffled[groups.cumcount().to_numpy() < quota].sort_index()
+
+
+# LTTB  *********************************************************************************
+def lttb(x, y, n):
+  '''
+  1. function takes the x and y arrays (x sorted) and the number of points to keep
+  2. Largest-Triangle-Three-Buckets: split the points in n - 2 buckets, keep from each bucket the point
+     making the largest triangle with the point kept before and the mean of the next bucket
+  3. return the indices of the kept points
+  '''
+  size = len(x)
+  if n >= size or n < 3:
+    return np.arange(size)
+
+  edges = np.linspace(1, size - 1, n - 1).astype(int) # buckets between the first and the last point
+  keep = np.empty(n, dtype=np.int64)
+  keep[0], keep[-1] = 0, size - 1
+
+  a = 0
+  for i in range(n - 2):
+    start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+    nxt_start, nxt_end = end, (edges[i + 2] if i + 2 < n - 1 else size)
+    cx, cy = x[nxt_start:nxt_end].mean(), y[nxt_start:nxt_end].mean() # mean of the next bucket
+
+    area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+    a = start + int(np.argmax(area))
+    keep[i + 1] = a
+
+  return keep
+
+
+def line_data(df, colx, coly, n=None):
+  '''
+  1. function takes data frame and the x / y columns of a line plot
+  2. average y for each x (as seaborn does), then keep `n` points with LTTB
+  3. return small data frame of [colx, coly]
+  '''
+  n = n or max_points()
+  if len(df) <= n:
+    return df
+
+  line = df.groupby(colx, observed=True)[coly].mean().reset_index() # sorted by x
+  if len(line) <= n:
+    return line
+
+  keep = lttb(line[colx].to_numpy(dtype=float), line[coly].to_numpy(dtype=float), n)
+  return line.iloc[keep]
+
+
+# 2D Density  ***************************************************************************
+def density_2d(df, colx, coly, bins=60):
+  '''
+  1. function takes data frame and the x / y columns of a scatter plot
+  2. count the points in a grid of bins x bins cells
+  3. return the counts (0 -> nan, not drawn) and the edges of the cells
+  '''
+  counts, xedges, yedges = np.histogram2d(df[colx].to_numpy(dtype=float), df[coly].to_numpy(dtype=float), bins=bins)
+  counts[counts == 0] = np.nan
+  return counts.T, xedges, yedges # rows of the grid are y
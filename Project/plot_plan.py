@@ -0,0 +1,227 @@
+import os
+import zlib
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from all_plots import spec_panel, panel_pixels, composite_figure, panel_png # my custom functions
+from shared_artifacts import summarize_groups
+from plot_data import plot_settings
+from figure_pool import panel_phase
+
+
+
+# ************************************************************************************
+# ***************************    Plot Plan    ****************************************
+# ************************************************************************************
+
+# the subplots of all figures of a dataset are chosen before anything is drawn:
+#   - each figure is a list of panels ((row, col), spec), a spec is the plot name and its columns:
+#     ('strip', x, y, hue), ('bar', x, y, hue), ('scatter', x, y, hue, style), ('heatmap',) ...
+#   - the random columns come from a generator seeded by AUTO_ANALYSIS_PLOT_SEED and the column,
+#     so the same dataset always gets the same figures (and a column does not change the others)
+#   - the group stats of all bar / box / violin subplots are computed at once (one grouped pass for each
+#     (x, hue) of the dataset, see group_summary), before the figures are sent to the render processes
+#   - each subplot is drawn alone (`panel_pixels`) and its pixels are memoized by (dataset fingerprint, spec, phase):
+#     the same spec twice in a figure, in another figure or in a view asked again is drawn once,
+#     the 3x3 figure is pasted from the pixels of its subplots (the phase is the fraction of a pixel
+#     where the subplot starts in the 3x3 figure, the cells of the same phase share their pixels)
+# each process keeps AUTO_ANALYSIS_PANEL_CACHE_MB of subplot pixels (least recently used dropped first).
+
+_memo = OrderedDict()   # (fingerprint, spec, phase) -> (pixels, offset), least recently used first
+_memo_bytes = 0         # size of the pixels in the memo
+_lock = threading.Lock() # the jobs of the web server render in several threads
+
+
+def memo_settings():
+  return {'max_mb': float(os.environ.get('AUTO_ANALYSIS_PANEL_CACHE_MB', 64))}
+
+
+# Choose the Subplots  ******************************************************************
+def cat_specs(colx, coly, colh, rng):
+  '''
+  1. function takes a categorical column, the continuous columns, the hue columns and the random generator
+  2. return the panels of its figure [((row, col), spec)]
+  '''
+
+  # *********************************************************
+  # ************ Plot on the subplots (First Row) ***********
+  # *********************************************************
+
+  panels = [((0, 0), ('pie', colx)), ((0, 1), ('count', colx))]
+
+  rand_col = rng.choice(coly) # Choose a random column from the conti_list
+  panels.append(((0, 2), ('strip', colx, rand_col, None)))
+
+  # *********************************************************
+  # ****** Plot on the subplots (Second and Third Row) ******
+  # *********************************************************
+
+  if len(colh)>1:
+    for cell, plot in [((1, 0), 'bar'), ((1, 1), 'strip'), ((1, 2), 'violin'),
+                       ((2, 0), 'strip'), ((2, 1), 'box'), ((2, 2), 'bar')]:
+      rand_col = rng.choice(coly) # Choose a random column from the conti_list
+      h_col = rng.choice([col for col in colh if col != rand_col and col != colx]) # Choose a random column from the colh exclude rand_col
+      panels.append((cell, (plot, colx, rand_col, h_col)))
+
+  return panels
+
+
+def cont_specs(colx, cont_list, cat_list, colh, rng):
+  '''
+  1. function takes a continuous column, the continuous / categorical / hue columns and the random generator
+  2. return the panels of its figure [((row, col), spec)]
+  '''
+
+  # *********************************************************
+  # ************ Plot on the subplots (First Row) ***********
+  # *********************************************************
+  panels = [((0, 0), ('hist', colx))]
+
+  if len(cont_list) > 1 :
+    rand_col = rng.choice([col for col in cont_list if col != colx]) # Choose a random column from the conti_list
+    panels.append(((0, 1), ('line', colx, rand_col)))
+
+    rand_col = rng.choice([col for col in cont_list if col != colx]) # Choose a random column from the conti_list
+    panels.append(((0, 2), ('scatter', colx, rand_col, None, None)))
+
+  # *********************************************************
+  # ************ Plot on the subplots (Second Row) ***********
+  # *********************************************************
+
+  panels.append(((1, 0), ('boxen', colx)))
+
+  if len(cont_list) > 1 :
+    panels.append(((1, 1), ('heatmap',)))
+
+  rand_cat = rng.choice(cat_list) # Choose a random column from the cat_list
+  h_col = rng.choice([col for col in colh if col != rand_cat]) if len(colh)>1 else colh[0] # Choose a random column from the colh exclude rand_cat
+  panels.append(((1, 2), ('box', rand_cat, colx, h_col)))
+
+  # *********************************************************
+  # ************ Plot on the subplots (Third Row) ***********
+  # *********************************************************
+
+  if len(cont_list) > 1 and len(cat_list) > 1 :
+    for cell, with_hue in [((2, 0), True), ((2, 1), False), ((2, 2), True)]:
+      rand_col = rng.choice([col for col in cont_list if col != colx]) # Choose a random column from the conti_list
+      rand_cat = rng.choice(cat_list) # Choose a random column from the cat_list
+      h_col = None
+      if with_hue:
+        h_col = rng.choice([col for col in colh if col != rand_cat]) if len(colh)>1 else colh[0] # Choose a random column from the colh exclude rand_cat
+      panels.append((cell, ('scatter', colx, rand_col, rand_cat, h_col)))
+
+  return panels
+
+
+def figure_specs(kind, col, args, seed=None):
+  '''panels of the figure of one column ('cat' | 'cont', column, extra args of its job), seeded by the column'''
+  seed = plot_settings()['seed'] if seed is None else seed
+  rng = random.Random(f'{seed}:{kind}:{col}') # a string seed is the same in every process
+  return cat_specs(col, *args, rng) if kind == 'cat' else cont_specs(col, *args, rng)
+
+
+def plan_figures(jobs, seed=None):
+  '''
+  1. function takes the figure jobs of the dataset [(kind, column, args)] (and the seed, default AUTO_ANALYSIS_PLOT_SEED)
+  2. choose the subplots of each figure
+  3. return the panels of each figure [[((row, col), spec)]] in the order of the jobs
+  '''
+  return [figure_specs(kind, col, args, seed) for kind, col, args in jobs]
+
+
+def unique_specs(plan):
+  '''the specs of the plan, each one once (in the order they are first used)'''
+  return list(dict.fromkeys(spec for panels in plan for _, spec in panels))
+
+
+def batch_aggregates(df, plan, art):
+  '''
+  1. function takes the cleaned data frame, the plan of its figures and the shared artifacts
+  2. collect the y columns of the bar (mean / CI) and box / violin (quartiles / whiskers) subplots of each (x, hue)
+  3. summarize them once for each (x, hue) and keep them in the artifacts, read by the plots in this
+     process or in the render processes
+  '''
+  columns = {} # (x, hue) -> {'means': [y ...], 'boxes': [y ...]}
+  for spec in unique_specs(plan):
+    if spec[0] in ('bar', 'box', 'violin'):
+      need = columns.setdefault((spec[1], spec[3]), {'means': [], 'boxes': []})
+      need['means' if spec[0] == 'bar' else 'boxes'].append(spec[2])
+
+  for by, need in columns.items():
+    if need['boxes']:
+      summarize_groups(df, by, need['boxes'], art, quantiles=True)
+    if need['means']:
+      summarize_groups(df, by, need['means'], art)
+
+
+# Memo of the Subplots  *****************************************************************
+def _memo_get(key):
+  with _lock:
+    pixels = _memo.get(key)
+    if pixels is not None:
+      _memo.move_to_end(key)
+    return pixels
+
+
+def _memo_put(key, pixels):
+  global _memo_bytes
+  max_bytes = memo_settings()['max_mb'] * 2**20
+  with _lock:
+    if key in _memo or pixels[0].nbytes > max_bytes:
+      return
+    _memo[key] = pixels
+    _memo_bytes += pixels[0].nbytes
+    while _memo_bytes > max_bytes:
+      _, (image, _) = _memo.popitem(last=False)
+      _memo_bytes -= image.nbytes
+
+
+def clear_memo():
+  global _memo_bytes
+  with _lock:
+    _memo.clear()
+    _memo_bytes = 0
+
+
+def _spec_rng(spec):
+  # generator of the random parts of a subplot (strip jitter): the same spec, the same points, and local to
+  # the subplot (in lazy mode the panels are drawn by concurrent request threads)
+  return np.random.default_rng(zlib.crc32(repr(spec).encode()))
+
+
+# Render  *******************************************************************************
+def subplot_pixels(df, spec, cell, art=None):
+  '''pixels of the subplot of the spec in the cell (drawn the first time, then read from the memo)'''
+  phase = panel_phase(*cell)
+  key = (art.get('fingerprint'), spec, phase) if art else None
+  pixels = _memo_get(key) if key and key[0] else None
+  if pixels is None:
+    pixels = panel_pixels(spec_panel(df, spec, art, _spec_rng(spec)), phase)
+    if key and key[0]:
+      _memo_put(key, pixels)
+  return pixels
+
+
+def render_figure(df, colx, panels, art=None):
+  '''
+  1. function takes the cleaned data frame, the column, the panels of its figure (plan) and the shared artifacts
+  2. take the pixels of each subplot (memoized, see above) and paste them in the 3x3 figure
+  3. return the png bytes
+  '''
+  return composite_figure([(cell, subplot_pixels(df, spec, cell, art)) for cell, spec in panels], colx)
+
+
+def render_panel(df, spec, art=None):
+  '''png of one subplot alone, in its own figure (lazy mode)'''
+  return panel_png(spec_panel(df, spec, art, _spec_rng(spec)))
+
+
+def cat_plot(df, colx, coly, colh=None, art=None, seed=None):
+  return render_figure(df, colx, figure_specs('cat', colx, (coly, colh), seed), art)
+
+
+def cont_plot(df, colx, cont_list, cat_list, colh, art=None, seed=None):
+  return render_figure(df, colx, figure_specs('cont', colx, (cont_list, cat_list, colh), seed), art)
@@ -0,0 +1,139 @@
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from plot_plan import render_figure # my custom functions
+from figure_store import put_figure
+from instrument import measure, log
+
+
+
+# ************************************************************************************
+# ***************************    Render Pool    **************************************
+# ************************************************************************************
+
+# the cleaned DataFrame and the shared artifacts of the dataset, sent once to each worker process by `_init_worker`
+_df = None
+_art = None
+
+# warm pool (AUTO_ANALYSIS_WARM_POOL=1, started with the server): the worker processes are kept between
+# the analyses, so the figures never wait for new processes to import matplotlib / seaborn. the data frame
+# and artifacts of each analysis are written once to a temp file (removed when its figures are done), each worker
+# reads them with its first figure and keeps the ones of the last AUTO_ANALYSIS_JOB_THREADS analyses (the analyses
+# running at the same time send their figures to the same workers).
+_warm_pool = None
+_warm_lock = threading.Lock()
+_shared = OrderedDict() # in a warm worker: temp file -> (data frame, artifacts), least recently used first
+
+
+def _init_worker(df, art):
+  global _df, _art
+  _df, _art = df, art # every figure job in this worker reads from the same frame and artifacts
+
+
+def render_job(df, job, art=None):
+  '''
+  1. function takes data frame, one figure job ('cat' | 'cont', column, planned panels) and the shared artifacts
+  2. draw the 3x3 figure of the column from its panels (`render_figure`)
+  3. save the png in the figure store (in the worker, only the id goes back)
+  4. return the figure id and the timing of the figure (recorded by the job thread)
+  '''
+  kind, col, panels = job
+
+  with measure(f'{kind}_plot', col) as timing:
+    fig_id = put_figure(render_figure(df, col, panels, art))
+
+  return fig_id, timing
+
+
+def _render(job):
+  return render_job(_df, job, _art)
+
+
+def _render_shared(task):
+  path, job = task
+  if path not in _shared: # first figure of this analysis in this worker
+    with open(path, 'rb') as f:
+      _shared[path] = pickle.load(f)
+    while len(_shared) > max(1, int(os.environ.get('AUTO_ANALYSIS_JOB_THREADS', 2))):
+      _shared.popitem(last=False)
+  _shared.move_to_end(path)
+  df, art = _shared[path]
+  return render_job(df, job, art)
+
+
+# number of worker processes ***********************************************
+def worker_count(workers=None):
+  if workers is None: # not given, read it from the environment (0 or missing = all cores)
+    workers = int(os.environ.get('AUTO_ANALYSIS_WORKERS', 0)) or os.cpu_count() or 1
+
+  return max(1, workers)
+
+
+# warm pool ***************************************************************
+def _ready():
+  return os.getpid()
+
+
+def start_warm_pool(workers=None):
+  '''start the worker processes of the warm pool and wait until they can render, return their number'''
+  global _warm_pool
+  workers = worker_count(workers)
+  if workers <= 1: # one core, the figures are rendered in the job thread
+    return 0
+
+  with _warm_lock:
+    if _warm_pool is None:
+      pool = ProcessPoolExecutor(max_workers=workers)
+      # one task for each worker: all of them are started (and import this module, so the plots) before any figure
+      for future in [pool.submit(_ready) for _ in range(workers)]:
+        future.result()
+      _warm_pool = pool
+  return workers
+
+
+def _stop_warm_pool():
+  global _warm_pool
+  with _warm_lock:
+    pool, _warm_pool = _warm_pool, None
+  if pool is not None:
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# render all figure jobs ***************************************************
+def render_figures(df, jobs, workers=None, art=None):
+  '''
+  1. function takes the cleaned data frame, a list of figure jobs and the shared artifacts
+  2. send each job to a pool of worker processes that share the data frame and the artifacts
+     (the warm pool if the server started it, else new processes for this analysis)
+  3. yield the figure id and the timing of each job in the same order as `jobs`
+  '''
+  workers = min(worker_count(workers), len(jobs))
+
+  if workers <= 1: # one job or one core, no need to start processes
+    for job in jobs:
+      yield render_job(df, job, art)
+    return
+
+  pool = _warm_pool
+  if pool is not None:
+    fd, path = tempfile.mkstemp(suffix='.pkl', prefix='render-')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump((df, art), f, protocol=pickle.HIGHEST_PROTOCOL)
+      yield from pool.map(_render_shared, [(path, job) for job in jobs])
+    except BrokenProcessPool: # a worker died, the next analyses start their own processes
+      log.exception('the warm render pool is broken')
+      _stop_warm_pool()
+      raise
+    finally:
+      os.remove(path)
+    return
+
+  with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(df, art)) as pool:
+    # `map` keeps the order of the jobs even if they finish out of order
+    yield from pool.map(_render, jobs)
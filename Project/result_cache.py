@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import tempfile
+
+
+
+# ************************************************************************************
+# ***************************    Result Cache    *************************************
+# ************************************************************************************
+
+# the cache keeps one json file for each analysed dataset:
+#   <cache dir>/<sha256 of dataset bytes + settings>.json
+# the modification time of a file is its last use, the least recently used files
+# are removed when the total size of the cache is bigger than the limit.
+
+def cache_dir():
+    return os.environ.get('AUTO_ANALYSIS_CACHE_DIR',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+
+
+def cache_limit():
+    '''max size of the cache in bytes (0 = cache disabled)'''
+    return int(float(os.environ.get('AUTO_ANALYSIS_CACHE_MB', 256)) * 1024 * 1024)
+
+
+# key of a dataset ***********************************************************
+def cache_key(data, settings):
+    '''
+    1. function takes the dataset (bytes or a binary file) and the analysis settings (dict)
+    2. hash the dataset bytes (a file is read in chunks, then rewound)
+    3. return the hex key of the dataset and the settings
+    '''
+    h = hashlib.sha256()
+
+    if isinstance(data, bytes):
+        h.update(data)
+    else:
+        start = data.tell()
+        for chunk in iter(lambda: data.read(1024 * 1024), b''):
+            h.update(chunk)
+        data.seek(start) # leave the file ready to be read again
+
+    h.update(json.dumps(settings, sort_keys=True).encode())
+
+    return h.hexdigest()
+
+
+def _path(key):
+    return os.path.join(cache_dir(), f'{key}.json')
+
+
+# read a result **************************************************************
+def cache_get(key):
+    '''return the cached result of the key, None if it is not in the cache'''
+    if not cache_limit():
+        return None
+
+    path = _path(key)
+    try:
+        with open(path, encoding='utf-8') as f:
+            result = json.load(f)
+        os.utime(path) # mark as recently used
+    except (OSError, ValueError): # missing, removed by another process, or broken file
+        return None
+
+    return result
+
+
+# save a result **************************************************************
+def cache_put(key, result):
+    '''
+    1. function takes the key and a json friendly result
+    2. write it atomically in the cache directory
+    3. remove the least recently used results if the cache is too big
+    '''
+    limit = cache_limit()
+    if not limit:
+        return
+
+    os.makedirs(cache_dir(), exist_ok=True)
+
+    # write in a temp file first, so readers never see half a file
+    fd, tmp = tempfile.mkstemp(dir=cache_dir(), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+    os.replace(tmp, _path(key))
+
+    evict_lru(cache_dir(), limit, '.json')
+
+
+# remove the least recently used files **************************************
+def evict_lru(directory, limit, suffix):
+    '''
+    1. function takes a directory, max size in bytes and the suffix of the files it manages
+    2. remove the files with the oldest modification time (last use) until the total size fits
+    '''
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries): # oldest use first
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
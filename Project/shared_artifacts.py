@@ -0,0 +1,135 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from summary import summarize
+from group_summary import group_summary, ci_settings
+from plot_data import plot_settings
+from density import kde_settings
+
+
+
+# ************************************************************************************
+# ***************************    Shared Artifacts    *********************************
+# ************************************************************************************
+
+# results computed on the whole data frame are the same for every column figure,
+# so they are computed once for the dataset and shared by all figures:
+#   corr          -> correlation matrix of the numerical columns (heatmap)
+#   value_counts  -> classes counts of each categorical column (pie / count plots)
+#   stats         -> count / mean / std / quartiles of the numerical columns (boxen plot lines)
+#   histograms    -> histograms / KDE curves of the whole file of a streamed csv (see streaming),
+#                    drawn instead of the ones of its sample
+#   groups        -> count / mean / CI (and quartiles / whiskers / fliers) of the continuous columns
+#                    for each group (bar, box and violin plots, see group_summary)
+#   fingerprint   -> hash of the data frame and the plot / CI settings, names the memoized subplots (see plot_plan)
+# the group results depend on the (x, hue) of the subplots, they are computed for all the subplots
+# of the dataset by the plot plan (`batch_aggregates`), or the first time they are asked for,
+# then kept in the same dict.
+
+def dataset_artifacts(df, cat_list, conti_list, histograms=None):
+  '''
+  1. function takes the cleaned data frame, the categorical and continuous columns (and the histograms of the whole file)
+  2. compute the correlation matrix (2 continuous columns at least), the value counts of the categorical columns
+     and the stats of the numerical columns (one pass, see `summary`)
+  3. return dict of the artifacts (+ empty memo of the group results)
+  '''
+  corr = df.select_dtypes(include='number').corr() if len(conti_list) > 1 else None
+  summary = summarize(df, counts=cat_list)
+  histograms = {col: hist for col, hist in (histograms or {}).items() if col in conti_list}
+
+  fingerprint = frame_fingerprint(df)
+  if histograms: # the subplots of the sample are not the ones of the file
+    h = hashlib.sha1(fingerprint.encode())
+    for col, hist in sorted(histograms.items(), key=lambda item: str(item[0])):
+      h.update(str(col).encode() + hist['edges'].tobytes() + hist['counts'].tobytes())
+    fingerprint = h.hexdigest()
+
+  return {
+    'fingerprint': fingerprint,
+    'conti_list': list(conti_list),
+    'corr': corr,
+    'heatmap': None, # rgba image of the heatmap, drawn once from `corr`
+    'value_counts': summary['counts'],
+    'stats': summary['numeric'],
+    'histograms': histograms,
+    'groups': {},
+  }
+
+
+def frame_fingerprint(df):
+  '''hash of the values, index, columns and dtypes of the data frame and of the plot / CI / KDE settings'''
+  h = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+  h.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+  h.update(repr(sorted({**plot_settings(), **ci_settings(), **kde_settings()}.items())).encode())
+  return h.hexdigest()
+
+
+# order of the classes  *****************************************************************
+def category_order(s):
+  '''classes of a column in the order seaborn draws them (categories, sorted numbers or first appearance)'''
+  if isinstance(s.dtype, pd.CategoricalDtype):
+    return list(s.cat.categories)
+
+  order = list(s.dropna().unique())
+  if pd.api.types.is_numeric_dtype(s):
+    order = sorted(order)
+  return order
+
+
+def value_counts(df, col, art=None):
+  '''counts of each class of the column (from the artifacts if they have it)'''
+  if art and col in art['value_counts']:
+    return art['value_counts'][col]
+  return df[col].value_counts()
+
+
+def column_stats(df, col, art=None):
+  '''count / mean / std / min / quartiles / max of a numerical column (from the artifacts if they have it)'''
+  if art and art['stats'] is not None and col in art['stats']:
+    return art['stats'][col]
+  return df[col].describe()
+
+
+# Group Stats  **************************************************************************
+def summarize_groups(df, by, cols, art=None, quantiles=False):
+  '''
+  1. function takes data frame, the group columns (x [, hue]), the continuous columns (and if the quartiles are needed)
+  2. summarize the columns not summarized yet for these groups in one grouped pass (`group_summary`)
+  3. return dict of {column: {'stats', 'fliers'}} of these groups (kept in the artifacts for the next subplots)
+  '''
+  by = [col for col in by if col is not None]
+  store = art['groups'].setdefault(tuple(by), {}) if art else {}
+  missing = [col for col in dict.fromkeys(cols) if col not in store or (quantiles and 'q1' not in store[col]['stats'])]
+
+  if missing:
+    summary = group_summary(df, by, missing, quantiles=quantiles)
+    for col in missing:
+      store[col] = {'stats': summary['stats'][col], 'fliers': summary['fliers'].get(col, {})}
+  return store
+
+
+def group_stats(df, by, coly, art=None):
+  '''
+  1. function takes data frame, the group columns (x [, hue]) and the y column
+  2. summarize y for each group (from the artifacts if the plot plan did it, see plot_plan)
+  3. return data frame of [count, mean, std, ci_low, ci_high (, quartiles, whiskers)] indexed by the groups
+  '''
+  return summarize_groups(df, by, [coly], art)[coly]['stats']
+
+
+# Box Stats  ****************************************************************************
+def box_stats(df, by, coly, art=None):
+  '''
+  1. function takes data frame, the group columns (x [, hue]) and the y column
+  2. take the quartiles of y for each group, the whiskers (last value inside 1.5 * IQR) and the fliers
+  3. return dict of {group: stats} in the format of `ax.bxp`
+  '''
+  summary = summarize_groups(df, by, [coly], art, quantiles=True)[coly]
+  fliers = summary['fliers']
+
+  return {group: {'q1': row.q1, 'med': row.med, 'q3': row.q3, 'whislo': row.whislo, 'whishi': row.whishi,
+                  'fliers': fliers.get(group, np.array([]))}
+          for group, row in zip(summary['stats'].index, summary['stats'].itertuples(index=False))
+          if row.count > 0}
@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+
+# ************************************************************************************
+# ***************************    Sketches    *****************************************
+# ************************************************************************************
+
+# approximate statistics with a fixed memory, whatever the number of rows:
+#   HyperLogLog -> number of distinct values
+#   KLL         -> quantiles
+# both are plain dicts, and two sketches of the same kind can be merged, so partial
+# results (chunks of a file) are combined without going back to the data.
+
+def stats_settings():
+  '''
+  stats backend from the environment:
+  AUTO_ANALYSIS_STATS = 'exact' (default) | 'sketch'
+  AUTO_ANALYSIS_DISTINCT_ERROR / AUTO_ANALYSIS_QUANTILE_ERROR = relative error of the sketches
+  '''
+  return {
+    'backend': os.environ.get('AUTO_ANALYSIS_STATS', 'exact'),
+    'distinct_error': float(os.environ.get('AUTO_ANALYSIS_DISTINCT_ERROR', 0.01)),
+    'quantile_error': float(os.environ.get('AUTO_ANALYSIS_QUANTILE_ERROR', 0.01)),
+  }
+
+
+def use_sketches(settings=None):
+  return (settings or stats_settings())['backend'] == 'sketch'
+
+
+def _hash(values):
+  # 64 bits hash of each value (numbers, strings, mixed objects)
+  return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+
+
+# ***********************************************************************************
+# ****************************   HyperLogLog   **************************************
+# ***********************************************************************************
+
+def hll_new(error=0.01):
+  '''
+  1. function takes the wanted relative error of the count
+  2. choose the number of registers m = 2**p, error = 1.04 / sqrt(m)
+  3. return an empty sketch
+  '''
+  p = int(np.clip(np.ceil(np.log2((1.04 / error) ** 2)), 4, 18))
+  return {'p': p, 'registers': np.zeros(2 ** p, dtype=np.uint8)}
+
+
+def _bit_length(x):
+  # number of bits of each uint64, exact (the halves fit in a float64)
+  hi, lo = (x >> np.uint64(32)).astype(np.float64), (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+  bl = lambda v: np.where(v > 0, np.floor(np.log2(np.maximum(v, 1))) + 1, 0)
+  return np.where(hi > 0, 32 + bl(hi), bl(lo)).astype(np.int64)
+
+
+def hll_add(sketch, values):
+  '''add the values (array / series, nulls excluded by the caller) to the sketch'''
+  if not len(values):
+    return sketch
+
+  p = sketch['p']
+  h = _hash(values)
+  idx = (h >> np.uint64(64 - p)).astype(np.int64)            # first p bits -> register
+  rest = h & np.uint64((1 << (64 - p)) - 1)                  # other bits -> rank of the first 1
+  rank = (64 - p) - _bit_length(rest) + 1
+
+  # keep the max rank of each register
+  best = pd.Series(rank).groupby(idx).max()
+  reg = sketch['registers']
+  reg[best.index] = np.maximum(reg[best.index], best.to_numpy().astype(np.uint8))
+
+  return sketch
+
+
+def hll_merge(a, b):
+  '''merge two sketches with the same precision'''
+  return {'p': a['p'], 'registers': np.maximum(a['registers'], b['registers'])}
+
+
+def hll_count(sketch):
+  '''estimated number of distinct values'''
+  reg = sketch['registers']
+  m = len(reg)
+  alpha = 0.7213 / (1 + 1.079 / m)
+  estimate = alpha * m * m / np.sum(2.0 ** -reg.astype(np.float64))
+
+  zeros = int((reg == 0).sum())
+  if estimate <= 2.5 * m and zeros: # small counts: linear counting is better
+    estimate = m * np.log(m / zeros)
+
+  return int(round(estimate))
+
+
+def hll_error(sketch):
+  return 1.04 / np.sqrt(len(sketch['registers']))
+
+
+def approx_nunique(df, error=0.01):
+  '''estimated number of distinct values of each column (series like `df.nunique()`)'''
+  return pd.Series({col: hll_count(hll_add(hll_new(error), df[col].dropna().to_numpy())) for col in df},
+                   dtype='int64')
+
+
+# ***********************************************************************************
+# ****************************   KLL Quantiles   ************************************
+# ***********************************************************************************
+
+def kll_new(error=0.01, seed=0):
+  '''
+  1. function takes the wanted rank error of the quantiles (and the seed of the compactions)
+  2. choose the size k of the biggest compactor (k = 200 -> about 1.65 %)
+  3. return an empty sketch (with its own random generator: the same values give the same quantiles)
+  '''
+  return {'k': max(8, int(np.ceil(3.3 / error))), 'levels': [np.empty(0)], 'n': 0,
+          'min': np.inf, 'max': -np.inf, 'rng': np.random.default_rng(seed)}
+
+
+def _capacity(k, height, level):
+  # the top level keeps k items, each level below keeps 2/3 of the one above
+  return max(2, int(np.ceil(k * (2 / 3) ** (height - 1 - level))))
+
+
+def _compress(sketch):
+  '''
+  compact the first level over its capacity: sort it, keep every other item (random offset)
+  and move them one level up (with twice the weight), until all levels fit
+  '''
+  levels, k = sketch['levels'], sketch['k']
+  while True:
+    height = len(levels)
+    for level in range(height):
+      if len(levels[level]) >= _capacity(k, height, level):
+        break
+    else:
+      return sketch
+
+    if level + 1 == height:
+      levels.append(np.empty(0))
+
+    items = np.sort(levels[level])
+    even = len(items) - len(items) % 2 # an odd item stays at this level
+    levels[level + 1] = np.concatenate([levels[level + 1], items[sketch['rng'].integers(2):even:2]])
+    levels[level] = items[even:]
+
+
+def kll_add(sketch, values):
+  '''add the numbers (nulls excluded by the caller) to the sketch'''
+  values = np.asarray(values, dtype=np.float64)
+  if not len(values):
+    return sketch
+
+  sketch['levels'][0] = np.concatenate([sketch['levels'][0], values])
+  sketch['n'] += len(values)
+  sketch['min'], sketch['max'] = min(sketch['min'], values.min()), max(sketch['max'], values.max())
+
+  return _compress(sketch)
+
+
+def kll_merge(a, b):
+  '''merge two sketches (the result has the precision and the random generator of `a`)'''
+  height = max(len(a['levels']), len(b['levels']))
+  pad = lambda levels: levels + [np.empty(0)] * (height - len(levels))
+  merged = {'k': a['k'], 'rng': a['rng'], 'n': a['n'] + b['n'],
+            'min': min(a['min'], b['min']), 'max': max(a['max'], b['max']),
+            'levels': [np.concatenate(pair) for pair in zip(pad(a['levels']), pad(b['levels']))]}
+  return _compress(merged)
+
+
+def kll_quantiles(sketch, qs):
+  '''
+  1. function takes the sketch and list of quantiles (0 -> 1)
+  2. sort the kept items with their weights (2 ** level)
+  3. return the item at the rank of each quantile
+  '''
+  if not sketch['n']:
+    return [np.nan] * len(qs)
+
+  items = np.concatenate(sketch['levels'])
+  weights = np.concatenate([np.full(len(kept), 2.0 ** level) for level, kept in enumerate(sketch['levels'])])
+  order = np.argsort(items)
+  items, cum = items[order], np.cumsum(weights[order])
+
+  out = []
+  for q in qs:
+    if q <= 0:
+      out.append(sketch['min'])
+    elif q >= 1:
+      out.append(sketch['max'])
+    else:
+      out.append(items[min(int(np.searchsorted(cum, q * cum[-1])), len(items) - 1)])
+  return out
+
+
+def approx_quantiles(s, qs, error=0.01):
+  '''quantiles of a numerical series from a KLL sketch'''
+  return kll_quantiles(kll_add(kll_new(error), s.dropna().to_numpy()), qs)
@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+import importlib
+
+from instrument import stage, log
+
+
+
+# ************************************************************************************
+# ***************************    Server Startup    ***********************************
+# ************************************************************************************
+
+# the web server starts without the analysis stack: numpy, pandas, matplotlib and seaborn (with the
+# theme set by all_plots) take a few seconds to import on a cold machine, the home page needs none of them.
+#   - the analysis modules are imported the first time an analysis needs them (`load_stack`)
+#   - or in a background thread as soon as the server is up (AUTO_ANALYSIS_PRELOAD=1, default),
+#     the server answers meanwhile and the first analysis finds them ready
+#   - with AUTO_ANALYSIS_WARM_POOL=1 the render worker processes are started then too, and kept
+#     for all the analyses (see render_pool)
+# the time to be ready is logged and exported by /metrics:
+#   server_ready_seconds   from the start of the process to the app ready to serve
+#   stack_ready_seconds    from the same start to the analysis stack imported (preloaded or first analysis)
+#   stack_import_seconds   the import of the stack alone
+# `python benchmarks.py cold-start` measures them in new processes.
+
+# modules of the analysis, importing them loads all the heavy ones
+stack_modules = ['autoAnalysis', 'streaming', 'columnar', 'render_pool', 'lazy', 'all_plots']
+
+
+def _process_age():
+    # seconds since the start of this process (linux), else 0 (the start is the import of this module)
+    try:
+        with open('/proc/self/stat') as f:
+            started = int(f.read().rsplit(')', 1)[1].split()[19]) # clock ticks after the boot
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - started / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+
+_started = time.perf_counter() - _process_age() # start of the server process
+_times = {}                                     # name -> seconds (see above)
+_lock = threading.Lock()                        # one import of the stack, the other threads wait for it
+
+
+def startup_settings():
+    return {'preload': os.environ.get('AUTO_ANALYSIS_PRELOAD', '1') == '1',
+            'warm_pool': os.environ.get('AUTO_ANALYSIS_WARM_POOL', '0') == '1'}
+
+
+def since_start():
+    '''seconds since the start of the server process'''
+    return time.perf_counter() - _started
+
+
+def startup_times():
+    '''seconds of each startup step done so far'''
+    return {name: round(seconds, 3) for name, seconds in _times.items()}
+
+
+def server_ready():
+    '''the app is created and can serve (the analysis stack is not imported yet)'''
+    _times['server_ready_seconds'] = time.perf_counter() - _started
+    log.info('server ready in %.2fs', _times['server_ready_seconds'])
+
+
+def stack_loaded():
+    return 'stack_ready_seconds' in _times
+
+
+def load_stack():
+    '''
+    1. import the analysis modules (numpy, pandas, matplotlib, seaborn ...) if they are not imported yet
+    2. the threads calling it meanwhile wait for the same import
+    3. return the seconds the import took
+    '''
+    with _lock:
+        if not stack_loaded():
+            start = time.perf_counter()
+            with stage('import_stack'):
+                for name in stack_modules:
+                    importlib.import_module(name)
+            _times['stack_import_seconds'] = time.perf_counter() - start
+            _times['stack_ready_seconds'] = time.perf_counter() - _started
+            log.info('analysis stack imported in %.2fs (%.2fs after the start)',
+                     _times['stack_import_seconds'], _times['stack_ready_seconds'])
+
+    return _times['stack_import_seconds']
+
+
+def _preload(warm_pool):
+    try:
+        load_stack()
+        if warm_pool:
+            from render_pool import start_warm_pool
+            start = time.perf_counter()
+            workers = start_warm_pool()
+            _times['warm_pool_seconds'] = time.perf_counter() - start
+            log.info('%d render workers ready in %.2fs', workers, _times['warm_pool_seconds'])
+    except Exception: # the analyses import the stack again, and render without the warm pool
+        log.exception('preload of the analysis stack failed')
+
+
+def start_preload():
+    '''import the analysis stack (and start the warm render pool) in a background thread, as the environment asks'''
+    settings = startup_settings()
+    if settings['preload'] or settings['warm_pool']:
+        threading.Thread(target=_preload, args=(settings['warm_pool'],), name='preload', daemon=True).start()
@@ -0,0 +1,345 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from column_profile import profile_columns
+from type_inference import replace_missing
+from density import binned_kde
+from sketches import stats_settings, use_sketches, hll_new, hll_add, hll_merge, hll_count, hll_error, kll_new, kll_add, kll_merge, kll_quantiles
+
+
+
+# ************************************************************************************
+# ***************************    Streaming CSV    ************************************
+# ************************************************************************************
+
+# a big csv file is read in chunks, each chunk updates running accumulators of every
+# column, then it is dropped. only these accumulators and a fixed size random sample
+# of the rows are kept, so the memory does not grow with the size of the file.
+
+HIST_BINS = 1024 # bins of the running histogram of each numerical column
+
+
+# ***********************************************************************************
+# ****************************   Accumulators   *************************************
+# ***********************************************************************************
+
+def _new_acc():
+  return {
+    'count': 0, 'nulls': 0, 'object': False, 'dtype': None, # dtype of the column in the sample
+    'n': 0, 'mean': 0.0, 'm2': 0.0, 'min': np.inf, 'max': -np.inf, # numbers
+    'hist': None, 'lo': 0.0, 'width': 1.0,                         # running histogram
+    'hashes': np.empty(0, dtype=np.uint64), 'overflow': False,     # distinct values
+    'counts': None,                                                # value counts (object / bool)
+    'hll': None, 'kll': None,                                      # sketches (stats backend 'sketch')
+  }
+
+
+# running histogram *****************************************************************
+def _hist_add(acc, values):
+  '''
+  1. function takes the accumulator of a column and the new numbers
+  2. grow the histogram range (double the bin width) until all numbers are covered
+  3. add the numbers to the bins
+  '''
+  lo_v, hi_v = values.min(), values.max()
+
+  if acc['hist'] is None: # first numbers, the range of the first chunk
+    acc['lo'] = lo_v
+    acc['width'] = max(hi_v - lo_v, 1e-9) / HIST_BINS * 1.000001
+    acc['hist'] = np.zeros(HIST_BINS, dtype=np.int64)
+
+  while lo_v < acc['lo'] or hi_v >= acc['lo'] + acc['width'] * HIST_BINS:
+    merged = acc['hist'].reshape(-1, 2).sum(axis=1) # two neighbour bins -> one bin
+    empty = np.zeros(HIST_BINS // 2, dtype=np.int64)
+    if lo_v < acc['lo']: # grow to the left
+      acc['hist'] = np.concatenate([empty, merged])
+      acc['lo'] -= acc['width'] * HIST_BINS
+    else: # grow to the right
+      acc['hist'] = np.concatenate([merged, empty])
+    acc['width'] *= 2
+
+  idx = ((values - acc['lo']) / acc['width']).astype(np.int64)
+  acc['hist'] += np.bincount(np.clip(idx, 0, HIST_BINS - 1), minlength=HIST_BINS)
+
+
+def _hist_quantiles(acc, qs):
+  # quantiles from the histogram, linear inside a bin
+  cum = np.cumsum(acc['hist'])
+  out = []
+  for q in qs:
+    target = q * cum[-1]
+    i = int(np.searchsorted(cum, target))
+    before = cum[i - 1] if i else 0
+    inside = (target - before) / acc['hist'][i] if acc['hist'][i] else 0
+    out.append(min(max(acc['lo'] + (i + inside) * acc['width'], acc['min']), acc['max']))
+  return out
+
+
+def histogram(stats, col, bins=None):
+  '''
+  1. function takes the stream stats and a numerical column (and number of bins)
+  2. merge the running histogram into at most `bins` bins (default: sqrt of the number of rows, as `hist_plot`)
+  3. return dict of the histogram of the whole file {'edges', 'counts'} and of its KDE curve {'x', 'y'} (as `hist_kde`)
+  '''
+  acc = stats['columns'][col]
+  bins = bins or int(np.ceil(stats['rows'] ** 0.5))
+  nonzero = np.nonzero(acc['hist'])[0]
+  first, last = nonzero[0], nonzero[-1] + 1 # only the used part of the range
+  group = -(-(last - first) // bins) # running bins in one bin of the plot
+  size = -(-(last - first) // group)
+  fine = np.pad(acc['hist'][first:last], (0, size * group - (last - first)))
+  lo = acc['lo'] + first * acc['width']
+
+  std = np.sqrt(acc['m2'] / (acc['n'] - 1)) if acc['n'] > 1 else 0
+  x, y = binned_kde(fine, lo, acc['width'], std, scale=group)
+  return {'edges': lo + np.arange(size + 1) * group * acc['width'], 'counts': fine.reshape(size, group).sum(axis=1),
+          'x': x, 'y': y}
+
+
+# update the accumulators of one column with one chunk *******************************
+def _update(acc, s, max_distinct, stats):
+  nulls = s.isna()
+  acc['count'] += int((~nulls).sum())
+  acc['nulls'] += int(nulls.sum())
+  values = s[~nulls]
+
+  if s.dtype == object:
+    acc['object'] = True # object in one chunk -> object in the whole file
+
+  # numbers (object columns too, as `clean_data` converts them with `pd.to_numeric`)
+  nums = values if s.dtype != object else pd.to_numeric(values, errors='coerce').dropna()
+  nums = nums.to_numpy(dtype=float) if s.dtype != bool else nums.to_numpy(dtype=int).astype(float)
+  nums = nums[np.isfinite(nums)]
+  if len(nums):
+    n, mean = len(nums), nums.mean()
+    m2 = ((nums - mean) ** 2).sum()
+    delta = mean - acc['mean']
+    total = acc['n'] + n
+    # merge mean and sum of squares of the chunk with the running ones (Chan et al.)
+    acc['m2'] += m2 + delta ** 2 * acc['n'] * n / total
+    acc['mean'] += delta * n / total
+    acc['n'] = total
+    acc['min'], acc['max'] = min(acc['min'], nums.min()), max(acc['max'], nums.max())
+    _hist_add(acc, nums)
+
+  if use_sketches(stats):
+    # sketch of the chunk, merged in the sketch of the file
+    acc['hll'] = hll_merge(acc['hll'] or hll_new(stats['distinct_error']), hll_add(hll_new(stats['distinct_error']), values.to_numpy()))
+    if len(nums):
+      acc['kll'] = kll_merge(acc['kll'] or kll_new(stats['quantile_error']), kll_add(kll_new(stats['quantile_error']), nums))
+
+  # distinct values, exact until `max_distinct` then estimated by a HyperLogLog of the same hashes
+  else:
+    hashes = np.unique(pd.util.hash_pandas_object(values, index=False).to_numpy())
+    if acc['overflow']:
+      hll_add(acc['hll'], hashes)
+    else:
+      acc['hashes'] = np.union1d(acc['hashes'], hashes)
+      if len(acc['hashes']) > max_distinct:
+        acc['hll'] = hll_add(hll_new(stats['distinct_error']), acc['hashes'])
+        acc['hashes'], acc['overflow'] = np.empty(0, dtype=np.uint64), True
+
+  # value counts (for the mode, top and freq), only the most common values are kept
+  if s.dtype == object or s.dtype == bool:
+    counts = values.value_counts()
+    acc['counts'] = counts if acc['counts'] is None else acc['counts'].add(counts, fill_value=0)
+    if len(acc['counts']) > 2 * max_distinct:
+      acc['counts'] = acc['counts'].nlargest(max_distinct)
+
+
+# ***********************************************************************************
+# ****************************   Reservoir Sample   *********************************
+# ***********************************************************************************
+
+def _reservoir_add(sample, chunk, seen, size, rng):
+  '''
+  1. function takes the current sample, a new chunk, number of rows seen before it and the sample size
+  2. keep each row of the stream with the same probability (size / rows seen)
+  3. return the new sample
+  '''
+  chunk = chunk.reset_index(drop=True)
+
+  free = max(0, size - len(sample)) # the sample is not full yet, take the first rows
+  if free:
+    head = chunk.iloc[:free].set_axis(range(len(sample), len(sample) + min(free, len(chunk))))
+    sample = pd.concat([sample, head]) if len(sample) else head
+    chunk = chunk.iloc[free:]
+    seen += len(head)
+  if not len(chunk):
+    return sample
+
+  # row t of the stream replaces a random slot with probability size / t
+  t = seen + np.arange(1, len(chunk) + 1)
+  slots = (rng.random(len(chunk)) * t).astype(np.int64)
+  keep = slots < size
+  rows, slots = np.nonzero(keep)[0], slots[keep]
+
+  # a later row wins when two rows pick the same slot
+  last = pd.Series(rows).groupby(slots).last()
+  if not len(last):
+    return sample
+
+  new = chunk.iloc[last.to_numpy()].set_axis(last.index)
+  return pd.concat([sample.drop(index=last.index), new]).sort_index()
+
+
+# ***********************************************************************************
+# ****************************   Stream a CSV File   ********************************
+# ***********************************************************************************
+
+def stream_csv(file, chunksize=100_000, sample_size=10_000, max_distinct=100_000, seed=0, stats=None):
+  '''
+  1. function takes a csv file (path or binary file), the streaming and the stats settings
+  2. read the file in chunks of `chunksize` rows, replace the noise strings by nulls
+  3. update the accumulators of each column and the random sample of `sample_size` rows
+  4. return the sample data frame and the stats of the whole file
+  '''
+  rng = np.random.default_rng(seed)
+  stats = stats or stats_settings()
+  accs, head, sample, rows = {}, None, pd.DataFrame(), 0
+
+  for chunk in pd.read_csv(file, chunksize=chunksize):
+    if head is None:
+      head = chunk.head()
+    replace_missing(chunk)
+
+    for col in chunk:
+      _update(accs.setdefault(col, _new_acc()), chunk[col], max_distinct, stats)
+
+    sample = _reservoir_add(sample, chunk, rows, sample_size, rng)
+    rows += len(chunk)
+
+  if head is None:
+    raise ValueError('the csv file has no rows')
+
+  # columns of mixed types in different chunks are objects in the sample too
+  for col, acc in accs.items():
+    if acc['object'] and sample[col].dtype != object:
+      sample[col] = sample[col].astype(object)
+    acc['dtype'] = sample[col].dtype
+
+  return sample.reset_index(drop=True), {'rows': rows, 'head': head, 'columns': accs, 'stats': stats}
+
+
+# ***********************************************************************************
+# ****************************   Stats -> Profile / Tables   ************************
+# ***********************************************************************************
+
+def _nunique(acc):
+  return hll_count(acc['hll']) if acc['hll'] else len(acc['hashes'])
+
+
+def _quantiles(acc, qs):
+  return kll_quantiles(acc['kll'], qs) if acc['kll'] else _hist_quantiles(acc, qs)
+
+
+def _mode(acc):
+  return acc['counts'].idxmax() if acc['counts'] is not None and len(acc['counts']) else None
+
+
+def stream_profile(sample, stats):
+  '''
+  1. function takes the sample and the stats of the whole file
+  2. build the column profile of the sample (value types)
+  3. replace its nulls / cardinality by the ones of the whole file, add the mean and mode fill values
+  4. return the profile (marked as `streamed`, its counts are not recomputed from the sample)
+  '''
+  profile = profile_columns(sample)
+  accs = stats['columns']
+
+  profile['nulls'] = [accs[col]['nulls'] for col in profile.index]
+  profile['nunique'] = [_nunique(accs[col]) for col in profile.index]
+  profile['mean'] = [accs[col]['mean'] if accs[col]['n'] else np.nan for col in profile.index]
+  profile['mode'] = pd.Series([_mode(accs[col]) for col in profile.index], index=profile.index, dtype=object)
+
+  profile.attrs['rows'] = stats['rows']
+  profile.attrs['streamed'] = True
+  profile.attrs['histograms'] = {col: histogram(stats, col) for col, acc in accs.items() if acc['hist'] is not None}
+  # estimated counts (sketch backend, or more than `max_distinct` values in a column): `check_id` allows their error
+  estimated = use_sketches(stats['stats']) or any(acc['overflow'] for acc in accs.values())
+  profile.attrs['nunique_error'] = hll_error(hll_new(stats['stats']['distinct_error'])) if estimated else 0
+
+  return profile
+
+
+def file_info(rows, counts, dtypes, sample_rows, source='streamed'):
+  '''
+  1. function takes the rows of the whole file, the non-null count and the dtype (in the sample) of each column
+  2. return the df.info like text of the file, with the rows of the sample used for the plots
+  '''
+  lines = [f"<class 'pandas.core.frame.DataFrame'> ({source})",
+           f'RangeIndex: {rows} entries, 0 to {rows - 1}',
+           f'Data columns (total {len(counts)} columns):',
+           f" #   {'Column':<20} {'Non-Null Count':<16} Dtype",
+           f"---  {'------':<20} {'--------------':<16} -----"]
+  for i, (col, count) in enumerate(counts.items()):
+    lines.append(f" {i:<3} {str(col):<20} {str(count) + ' non-null':<16} {dtypes[col]}")
+  kinds = pd.Series([str(dtype) for dtype in dtypes.values()]).value_counts().sort_index()
+  lines.append('dtypes: ' + ', '.join(f'{t}({n})' for t, n in kinds.items()))
+  lines.append(f'sample used for the plots: {sample_rows} rows')
+  return '\n'.join(lines) + '\n'
+
+
+def stream_tables(sample, stats):
+  '''
+  1. function takes the sample and the stats of the whole file
+  2. create the same tables as `summary_tables`: head, info, numerical and object describe
+  3. return dict of the tables
+  '''
+  accs = stats['columns']
+  rows = stats['rows']
+
+  head_table = stats['head'].to_html(classes='table table-striped')
+
+  # df.info like text
+  info_table = file_info(rows, {col: acc['count'] for col, acc in accs.items()},
+                         {col: acc['dtype'] for col, acc in accs.items()}, len(sample))
+
+  pd.set_option('display.float_format', lambda x: f'{x:.2f}')# set the float format for pandas outputs
+
+  # numerical describe (int / float columns)
+  num = {col: acc for col, acc in accs.items() if acc['n'] and acc['dtype'].kind in 'iuf'}
+  des_n = None
+  if num:
+    des_n = pd.DataFrame({col: [acc['n'], acc['mean'], np.sqrt(acc['m2'] / (acc['n'] - 1)) if acc['n'] > 1 else np.nan,
+                                acc['min'], *_quantiles(acc, (0.25, 0.5, 0.75)), acc['max']]
+                          for col, acc in num.items()},
+                         index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+    des_n = des_n.to_html(classes='table table-striped')
+
+  # object describe (all other columns)
+  obj = {col: acc for col, acc in accs.items() if col not in num and acc['counts'] is not None}
+  des_c = None
+  if obj:
+    des_c = pd.DataFrame({col: [acc['count'], _nunique(acc), _mode(acc), int(acc['counts'].max())]
+                          for col, acc in obj.items()},
+                         index=['count', 'unique', 'top', 'freq'])
+    des_c = des_c.to_html(classes='table table-striped')
+
+  return {'head_table': head_table, 'info_table': info_table, 'des_n': des_n, 'des_c': des_c}
+
+
+# load a spooled upload for an analysis job ********************************************
+def load_stream(path, **settings):
+  '''
+  1. function takes the path of a csv file (removed at the end) and the `stream_csv` settings
+  2. stream the file
+  3. return the sample, its tables and its column profile (input of an analysis job)
+  '''
+  try:
+    sample, stats = stream_csv(path, **settings)
+  finally:
+    os.remove(path)
+
+  return {'df': sample, 'tables': stream_tables(sample, stats), 'profile': stream_profile(sample, stats)}
+
+
+def stream_settings():
+  '''streaming settings from the environment'''
+  return {
+    'chunksize': int(os.environ.get('AUTO_ANALYSIS_CHUNK_ROWS', 100_000)),
+    'sample_size': int(os.environ.get('AUTO_ANALYSIS_SAMPLE_ROWS', 10_000)),
+    'max_distinct': int(os.environ.get('AUTO_ANALYSIS_MAX_DISTINCT', 100_000)),
+  }
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+
+
+# ************************************************************************************
+# ***************************    Summary Engine    ***********************************
+# ************************************************************************************
+
+# the describe tables, df.info and the plot annotations all need the same statistics,
+# `summarize` computes them once for the data frame:
+#   numeric  -> count / mean / std / min / quartiles / max of all numerical columns at once
+#               (one partial sort of the numerical block gives the min, the quartiles and the max)
+#   counts   -> classes counts of the other columns (top / freq / unique of the object describe, pie / count plots)
+#   non_null -> non-null count of every column (df.info)
+# the tables made from it are the same as pandas gives them (`describe`, `info`); when pandas would do
+# something special (dates, empty or very big data frames) the tables are left to pandas.
+
+stat_names = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+_quantiles = (0.25, 0.5, 0.75)
+
+
+def _plain_number(dtype):
+  # numbers the vectorized stats handle as pandas does (no dates / durations / complex,
+  # no nullable Int64 / Float64: pandas describes them with their own dtype)
+  return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) \
+    and not pd.api.types.is_extension_array_dtype(dtype) and dtype.kind in 'iuf'
+
+
+def _lerp(a, b, t):
+  # linear interpolation between 2 sorted values, the same way as numpy quantiles (exact at both ends)
+  diff = b - a
+  return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def numeric_stats(df, cols):
+  '''
+  1. function takes data frame and its numerical columns
+  2. compute count / mean / std / min / 25% / 50% / 75% / max of all columns at once
+     (nulls ignored, one partial sort of the columns for the min, quartiles and max)
+  3. return data frame in the layout of `df.describe()` (stats as rows)
+  '''
+  values = np.asfortranarray(df[cols].to_numpy(dtype='float64', na_value=np.nan)) # each column contiguous
+  valid = ~np.isnan(values)
+  count = valid.sum(axis=0)
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mean = np.where(valid, values, 0).sum(axis=0) / count
+    std = np.sqrt((np.where(valid, values - mean, 0) ** 2).sum(axis=0) / (count - 1))
+    std[count < 2] = np.nan
+
+  # only the min, the values around each quartile and the max have to be in their sorted place:
+  # partition the columns with the same non-null count together (nulls are put at the end)
+  stats = np.full((len(stat_names), len(cols)), np.nan)
+  stats[0], stats[1], stats[2] = count, mean, std
+  for n in np.unique(count[count > 0]):
+    group = np.flatnonzero(count == n)
+    pos = [q * (n - 1) for q in _quantiles]
+    kth = sorted({0, n - 1, *(int(np.floor(p)) for p in pos), *(min(int(np.floor(p)) + 1, n - 1) for p in pos)})
+    part = np.partition(values[:, group], kth, axis=0)
+    stats[3, group] = part[0]
+    for i, p in enumerate(pos, start=4):
+      lo = int(np.floor(p))
+      stats[i, group] = _lerp(part[lo], part[min(lo + 1, n - 1)], p - lo)
+    stats[7, group] = part[n - 1]
+
+  return pd.DataFrame(stats, index=stat_names, columns=pd.Index(cols))
+
+
+def summarize(df, counts=None):
+  '''
+  1. function takes data frame (and the columns to count the classes of, default all not numerical columns)
+  2. compute the numerical stats, the classes counts and the non-null counts
+  3. return dict of {'numeric', 'counts', 'non_null'}
+  '''
+  numeric = [col for col in df if _plain_number(df[col].dtype)]
+  others = [col for col in df if col not in numeric]
+  counts = others if counts is None else counts
+
+  stats = numeric_stats(df, numeric) if numeric else None
+  value_counts = {col: df[col].value_counts() for col in counts}
+
+  non_null = {}
+  for col in df:
+    if stats is not None and col in numeric:
+      non_null[col] = int(stats.at['count', col])
+    elif col in value_counts and not isinstance(df[col].dtype, pd.CategoricalDtype):
+      non_null[col] = int(value_counts[col].sum())
+    else:
+      non_null[col] = int(df[col].count())
+
+  return {'numeric': stats, 'counts': value_counts, 'non_null': pd.Series(non_null, dtype='int64')}
+
+
+# Describe  *****************************************************************************
+def describe_numeric(df, summary):
+  '''`df.describe()` from the summary, None if pandas has to do it (dates, no numerical columns)'''
+  default = df.select_dtypes(include=['number', 'datetime'])
+  if not len(default.columns) or not all(_plain_number(t) for t in default.dtypes):
+    return None
+  return summary['numeric'][list(default.columns)]
+
+
+def describe_other(df, summary):
+  '''`df.describe(exclude=[int, float])` from the summary, None if pandas has to do it (dates ...)'''
+  cols = list(df.select_dtypes(exclude=[int, float]).columns)
+  if not cols or any(col not in summary['counts'] or pd.api.types.is_datetime64_any_dtype(df[col])
+                     or pd.api.types.is_timedelta64_dtype(df[col]) or _plain_number(df[col].dtype) for col in cols):
+    return None
+
+  described = []
+  for col in cols:
+    counts = summary['counts'][col]
+    counts = counts[counts != 0] # categories never seen
+    top, freq = (counts.index[0], counts.iloc[0]) if len(counts) else (np.nan, np.nan)
+    described.append(pd.Series([summary['non_null'][col], len(counts), top, freq], index=['count', 'unique', 'top', 'freq'],
+                               name=col, dtype=None if len(counts) else object))
+  return pd.concat(described, axis=1, sort=False)
+
+
+# Info  *********************************************************************************
+def _sizeof_fmt(num, qualifier):
+  for unit in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+    if num < 1024.0:
+      return f'{num:3.1f}{qualifier} {unit}'
+    num /= 1024.0
+  return f'{num:3.1f}{qualifier} PB'
+
+
+def info_text(df, summary):
+  '''
+  1. function takes data frame and its summary
+  2. return the text of `df.info()` with the non-null counts of the summary,
+     None if pandas shows it another way (empty, too many columns / rows for the counts)
+  '''
+  if not len(df.columns) or len(df.columns) > pd.get_option('display.max_info_columns') \
+     or len(df) > pd.get_option('display.max_info_rows'):
+    return None
+
+  headers = [' # ', 'Column', 'Non-Null Count', 'Dtype']
+  rows = [(f' {i}', str(col), f"{summary['non_null'][col]} non-null", str(dtype))
+          for i, (col, dtype) in enumerate(df.dtypes.items())]
+  widths = [max(len(header), *(len(row[i]) for row in rows)) for i, header in enumerate(headers)]
+
+  def line(cells):
+    return '  '.join(str(cell)[:width].ljust(width) for cell, width in zip(cells, widths))
+
+  dtype_counts = df.dtypes.value_counts().groupby(lambda t: t.name).sum()
+  qualifier = '+' if 'object' in dtype_counts or df.index._is_memory_usage_qualified() else ''
+
+  lines = [str(type(df)), df.index._summary(), f'Data columns (total {len(df.columns)} columns):',
+           line(headers), line(['-' * len(header) for header in headers])]
+  lines += [line(row) for row in rows]
+  lines.append(f"dtypes: {', '.join(f'{name}({n:d})' for name, n in sorted(dtype_counts.items()))}")
+  lines.append(f'memory usage: {_sizeof_fmt(df.memory_usage(index=True, deep=False).sum(), qualifier)}')
+  return '\n'.join(lines) + '\n'
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from summary import summarize, describe_numeric, describe_other
+
+
+def _frame():
+  return pd.DataFrame({'a': [1.5, 2.0, np.nan, 4.0], 'b': [3, 1, 2, 2],
+                       'n': pd.array([1, None, 3, 4], dtype='Int64'), 'c': ['x', 'y', 'x', None]})
+
+
+def _describe(df, numeric=True):
+  # the table the app shows: the summary's one, or pandas' when it returns None
+  summary = summarize(df)
+  des = describe_numeric(df, summary) if numeric else describe_other(df, summary)
+  return des if des is not None else (df.describe() if numeric else df.describe(exclude=[int, float]))
+
+
+def test_describe_numeric_plain():
+  df = _frame()[['a', 'b']]
+  pd.testing.assert_frame_equal(describe_numeric(df, summarize(df)), df.describe())
+
+
+def test_describe_nullable_int():
+  df = _frame()
+  pd.testing.assert_frame_equal(_describe(df), df.describe())
+  pd.testing.assert_frame_equal(_describe(df, numeric=False), df.describe(exclude=[int, float]))
@@ -0,0 +1,105 @@
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+
+# ************************************************************************************
+# ***************************    Type Inference    ***********************************
+# ************************************************************************************
+
+# list of some possible string values can be found insted of 'nulls'
+missing_str = ['miss','not found','unknown','NA','unspecified','other','N/A','invalid','none','null','empty','@','/','$','%','&','?','!','~','|','\\','< >','[]']
+
+_missing = pd.Index(missing_str)
+
+
+def type_settings():
+  '''
+  type inference settings from the environment:
+  AUTO_ANALYSIS_TYPE_SAMPLE = number of random values of each object column used to infer its type
+  '''
+  return {'sample': int(os.environ.get('AUTO_ANALYSIS_TYPE_SAMPLE', 100))}
+
+
+def _is_text(s):
+  # only object / string columns can hold the noise strings
+  return s.dtype == object or isinstance(s.dtype, pd.StringDtype)
+
+
+# Missing Tokens  ***********************************************************************
+def missing_mask(s):
+  '''
+  1. function takes a column
+  2. look up the distinct values only (factorize), then map the result back to the rows
+  3. return boolean array, True where the value is one of `missing_str`
+  '''
+  codes, uniques = pd.factorize(s)
+  hit = np.append(pd.Index(uniques).isin(_missing), False) # code -1 (null) -> the last item, False
+  return hit[codes]
+
+
+def replace_missing(df, cols=None):
+  '''
+  1. function takes data frame (and the columns to check, default all)
+  2. replace the noise strings by nulls in the object / string columns only (numbers can't have them)
+  3. return the list of changed columns
+  '''
+  changed = []
+  for col in (df.columns if cols is None else cols):
+    if not _is_text(df[col]):
+      continue
+
+    mask = missing_mask(df[col])
+    if mask.any():
+      df[col] = df[col].mask(mask)
+      changed.append(col)
+
+  return changed
+
+
+# Value Types  **************************************************************************
+# pandas name of the values type -> python type used by `clean_data`
+_inferred = {'string': str, 'boolean': bool, 'integer': int, 'floating': float, 'mixed-integer-float': float}
+
+
+def sample_values(s, n, seed=0):
+  '''random sample of `n` not null values of the column, the noise strings excluded'''
+  values = s.dropna()
+  if _is_text(values):
+    values = values[~missing_mask(values)]
+  if len(values) > n:
+    values = values.sample(n, random_state=seed)
+  return values
+
+
+def value_type(values):
+  '''
+  1. function takes a sample of values of an object column
+  2. let pandas name the type of all values at once (mode of the python types only if they are mixed)
+  3. strings that are all numbers (a number column with some noise strings) are numbers
+  4. return the python type (str / bool / int / float ...) or None if there are no values
+  '''
+  if not len(values):
+    return None
+
+  t = _inferred.get(pd.api.types.infer_dtype(values, skipna=True))
+  if t is None: # mixed types, the most common one
+    t = Counter(type(v) for v in values).most_common(1)[0][0]
+
+  if t == str and pd.to_numeric(values, errors='coerce').notna().all():
+    return float
+
+  return t
+
+
+def infer_types(df, cols, sample=None, seed=0):
+  '''
+  1. function takes data frame, the object columns and the sample size (default from the environment)
+  2. infer the type of each column from a random sample of its values
+  3. return dict of {column: python type}
+  '''
+  sample = sample or type_settings()['sample']
+  return {col: value_type(sample_values(df[col], sample, seed)) for col in cols}